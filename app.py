@@ -4,125 +4,135 @@
 # data management
 import os
 import re
+import json
+import time
+import threading
+import hashlib
+import argparse
 import numpy as np
 import pandas as pd
-from unicodedata import lookup
+from functools import lru_cache
 from urllib.parse import unquote
+from povstats import gini
+from datasets import DatasetManager
+from snapshot import snapshot_root
+from figure_cache import FigureCache
+from figure_encoding import compact_figure
+from histogram import binned_histogram
+from rollup import group_columns, region_comparison_figure, rollup_statistics
+import trends
+from gap_fill import fill_labels, fill_modes, latest_rows
+from prefix_index import PrefixIndex
+import notes
+from table_query import filter_frame, sort_frame, page_frame, decode_sort
+from metrics import (api_queries, callback_response_bytes, callback_serialise_seconds, instrumented_callback, render, response_cache_requests,
+                     stage, write_startup_profile)
+from export import export_chunks, export_etag, export_formats, export_positions, export_url, id_columns, parse_list, parse_years
+from series_api import api_layouts, query_from_args, run_batch
 
 
 # data visualization
 from plotly import express as px
+from plotly.io.json import to_json_plotly
+import plotly.io as pio
 import plotly.graph_objects as go
 from dash.dash_table import DataTable
 import dash_bootstrap_components as dbc
 from dash.exceptions import PreventUpdate
-from dash import Dash, html, dcc, Output, Input, callback
+from dash import Dash, Patch, html, dcc, no_update, Output, Input, State, ClientsideFunction, clientside_callback, callback as dash_callback
+from flask import Response, abort, g, has_request_context, request, stream_with_context
 
 # cell management
 import warnings
 warnings.filterwarnings("ignore")
 
-data = pd.read_csv('data_2020/PovStatsData.csv')
-
-country = pd.read_csv('data_2020/PovStatsCountry.csv', na_values = '', keep_default_na = False)
-
-series = pd.read_csv("data_2020/PovStatsSeries.csv")
-
-poverty_indicator = pd.read_csv('data_2020/poverty_2020.csv', low_memory = False)
-
-# create list of regions in dataframe
-regions = ['East Asia & Pacific', 'Europe & Central Asia',
-           'Fragile and conflict affected situations', 'High income',
-           'IDA countries classified as fragile situations', 'IDA total',
-           'Latin America & Caribbean', 'Low & middle income', 'Low income',
-           'Lower middle income', 'Middle East & North Africa', 'Middle income',
-           'South Asia', 'Sub-Saharan Africa', 'Upper middle income', 'World']
-
-# create subset of original dataframe
-# remove the region names and maintain the country names
-data_sub = data[~data["Country Name"].isin(regions) & (data["Indicator Name"] == "Population, total")].reset_index()
-
-# slice columns, starting from 1994
-year_list = data_sub.columns[5:51].values.tolist()
-
-# convert column names (strings) to integers
-year_list = [int(year) for year in year_list]
-
-# get information on Gini coefficient
-gini = 'Gini index (World Bank estimate)'
-
-# separate regions from non-regions
-country['is_country'] = country['Region'].notna()
-
-# create country flag emojis
-# get list of country codes
-country_code_list = country[country['is_country']]['2-alpha code'].dropna().str.lower().tolist()
-
-# create function for country flags
-def country_flag(alpha_code):
-    # handle the situation where the provided letters are either NaN or not part of the country code list
-    if pd.isna(alpha_code) or (alpha_code.lower() not in country_code_list):
-        return ''
-    # create emoji if alpha code is part of country code list
-    code_a = lookup(f'REGIONAL INDICATOR SYMBOL LETTER {alpha_code[0]}')
-    code_b = lookup(f'REGIONAL INDICATOR SYMBOL LETTER {alpha_code[1]}')
-    # concatenate alpha codes
-    return code_a + code_b
-
-    # # alternative approach
-    # code_a = f"{alpha_code[0]}"
-    # code_b = f"{alpha_code[1]}"
-    # return flag(code_a + code_b)
-
-# add country flags to dataframe
-country['flag'] = [country_flag(code) for code in country['2-alpha code']]
-
-# drop irrelevant column
-data = data.drop(columns = ['Unnamed: 51'], axis = 1)
-# melt data dataframe. melting involves coverting columns into rows
-# convert all years into one column
-# set id variables. keep these as rows and duplicate them as needed to keep the mapping in place
-id_vars = [col for col in data.columns[:4]]
-data_melt = data.melt(
-    id_vars = id_vars,
-    var_name = "Year"
-).dropna(subset = ['value'])
-
-# convert year column to integer
-data_melt['Year'] = data_melt['Year'].astype(int)
-
-# pivot data dataframe. pivoting involves converting rows into columns
-data_melt_pivot = data_melt.pivot(
-    index = ['Country Name', 'Country Code', 'Year'],
-    columns = 'Indicator Name',
-    values = 'value'
-).reset_index()
-
-
-# merge dataframes
-# pivot data and country data
-poverty = pd.merge(
-    left = data_melt_pivot,
-    right = country,
-    left_on = "Country Code",
-    right_on = "Country Code",
-    how = 'left'
-)
-
-# select income shares within countries, for all years, with a focus on 20%
-income_share_df = poverty.filter(regex = "Country Name|^Year$|Income share.*?20" ).dropna()
-
-# rearrange columns
-income_share_df_sorted = income_share_df.rename(columns = {
-    'Income share held by lowest 20%': '1 Income share held by lowest 20%',
-    'Income share held by second 20%': '2 Income share held by second 20%',
-    'Income share held by third 20%': '3 Income share held by third 20%',
-    'Income share held by fourth 20%': '4 Income share held by fourth 20%',
-    'Income share held by highest 20%': '5 Income share held by highest 20%',
-}).sort_index(axis = 1)
-
-# remove redundant parts of the column names
-income_share_df_sorted.columns = [re.sub('\d Income share held by ', '', col).title() for col in income_share_df_sorted.columns]
+# set the directory holding the vintages (data_2019, data_2020, ...), and where their precompiled snapshots live
+data_root = os.environ.get('WDI_DATA_ROOT', '.')
+snapshot_dir = os.environ.get('WDI_SNAPSHOT_ROOT', snapshot_root)
+# keep a vintage active, otherwise the most recent one is, so that a new edition is swapped in when it appears
+active_vintage = os.environ.get('WDI_DATA_DIR')
+# seconds between two checks of the vintages for new or modified files, 0 to never check
+refresh_interval = float(os.environ.get('WDI_REFRESH_INTERVAL', 60))
+# map the numeric columns of the snapshot read-only, so that all gunicorn workers share one copy
+shared_memory = os.environ.get('WDI_SHARED_MEMORY', '1') != '0'
+
+# load the ready-made frames of every vintage from their snapshots (see snapshot.py and datasets.py)
+# the csv files are parsed, melted and pivoted only when a snapshot is missing or stale
+with stage('load_vintages'):
+    datasets = DatasetManager(data_root, active_vintage and os.path.basename(os.path.normpath(active_vintage)),
+                              snapshot_dir, shared_memory, refresh_interval)
+
+# read the fitted trends (see trends.py) from a directory shared by the workers
+# they are fitted when the snapshot is built, or with python trends.py, never while answering requests
+trends.trends_root = os.environ.get('WDI_TRENDS_DIR', trends.trends_root)
+
+# keep the databases of the notes on the data (see notes.py) in a directory shared by the workers
+notes.notes_root = os.environ.get('WDI_NOTES_DIR', notes.notes_root)
+
+# build frames ahead of time, e.g. under gunicorn --preload so that the forked workers share them
+warm_frames = os.environ.get('WDI_WARM_FRAMES')
+if warm_frames:
+    datasets.get().materialise(None if warm_frames == 'all' else warm_frames.split(','))
+
+# number of rows sent per page of the histogram table
+histogram_table_page_size = 50
+
+# number of options a searchable dropdown lists, before the user types and for every search
+search_option_limit = 25
+
+# run the heaviest figure callbacks as dash background callbacks, in processes of their own managed through a
+# local disk cache, so that they do not hold a worker for the whole request and can be cancelled
+background_manager = None
+if os.environ.get('WDI_BACKGROUND_CALLBACKS') == '1':
+    import diskcache
+    from dash import DiskcacheManager
+    background_manager = DiskcacheManager(diskcache.Cache(os.environ.get('WDI_BACKGROUND_CACHE_DIR', os.path.join('cache', 'background'))))
+
+# keep the most recently used map charts in memory, optionally backed by a directory shared by the workers
+# WDI_FIGURE_CACHE_DIR_MB bounds the size of that directory
+map_figure_cache = FigureCache(int(os.environ.get('WDI_FIGURE_CACHE_SIZE', 64)), os.environ.get('WDI_FIGURE_CACHE_DIR'),
+                               max_disk_bytes = int(float(os.environ.get('WDI_FIGURE_CACHE_DIR_MB', 256)) * (1 << 20)))
+
+# keep the responses of the callbacks, which only depend on their inputs and the data, so that a request repeating
+# the inputs of an earlier one is answered without running its callback
+# WDI_RESPONSE_CACHE_SIZE bounds the number of responses kept in memory (0 to turn the cache off), WDI_RESPONSE_CACHE_DIR
+# adds a directory shared by all workers, bounded by WDI_RESPONSE_CACHE_DIR_MB, and WDI_RESPONSE_CACHE_TTL is the number
+# of seconds a response is kept
+response_cache_size = int(os.environ.get('WDI_RESPONSE_CACHE_SIZE', 128))
+response_cache = FigureCache(response_cache_size, os.environ.get('WDI_RESPONSE_CACHE_DIR'),
+                             float(os.environ.get('WDI_RESPONSE_CACHE_TTL', 3600)),
+                             int(float(os.environ.get('WDI_RESPONSE_CACHE_DIR_MB', 256)) * (1 << 20))) if response_cache_size > 0 else None
+
+# hash the versions of the loaded vintages and the active one, which tag the cached responses built from them
+def datasets_tag(datasets_loaded, active):
+    versions = sorted((vintage, frames.version) for vintage, frames in datasets_loaded.items())
+    return hashlib.sha256(json.dumps([versions, active]).encode()).hexdigest()[:12]
+
+# drop the cached figures and responses of the data no longer loaded, whenever the vintages are swapped
+def prune_caches(datasets_loaded, active):
+    map_figure_cache.retain(frames.version for frames in datasets_loaded.values())
+    if response_cache is not None:
+        response_cache.retain([datasets_tag(datasets_loaded, active)])
+
+datasets.listeners.append(prune_caches)
+prune_caches(*datasets.current)
+
+# limits of the series API, so that large requests cannot starve the callbacks served by the same worker
+# WDI_API_CONCURRENCY is the number of API requests a worker answers at once, the others wait up to WDI_API_QUEUE_SECONDS
+# and are then turned away with 503, WDI_API_MAX_QUERIES bounds the queries of a batch, and WDI_API_MAX_CELLS and
+# WDI_API_MAX_REQUEST_CELLS bound the cells (rows times fields) of a query and of a whole request
+api_slots = threading.BoundedSemaphore(int(os.environ.get('WDI_API_CONCURRENCY', 2)))
+api_queue_seconds = float(os.environ.get('WDI_API_QUEUE_SECONDS', 1))
+api_max_queries = int(os.environ.get('WDI_API_MAX_QUERIES', 50))
+api_max_cells = int(os.environ.get('WDI_API_MAX_CELLS', 200000))
+api_max_request_cells = int(os.environ.get('WDI_API_MAX_REQUEST_CELLS', 1000000))
+
+# send the numeric arrays of the figures as base64 typed arrays (see figure_encoding.py), 0 to send plain json lists
+compact_figures = os.environ.get('WDI_COMPACT_FIGURES', '1') != '0'
+
+# prepare a figure for sending to the browser
+def send_figure(fig):
+    return compact_figure(fig) if compact_figures else fig
 
 # setup tabss
 tab1 = dbc.Tab([
@@ -160,12 +170,40 @@ tab2 = dbc.Tab([
             ])
         ], label = 'Project Info')
 
+# label a vintage, e.g. data_2020, by its edition
+def vintage_label(vintage):
+    return vintage.replace('data_', '') + ' edition'
+
 def initial_fig():
     fig = go.Figure()
     fig.layout.paper_bgcolor = '#2C3E50'
     fig.layout.plot_bgcolor = '#2C3E50'
     return fig
 
+# get the options running a callback in the background, with a cancel button and optionally a progress bar,
+# whose components are named after the figure, e.g. indicator_histogram_cancel and indicator_histogram_progress
+# a job is also cancelled when its inputs change before it ends, since dash then asks to terminate the old job
+def background_options(name, progress = False):
+    if background_manager is None:
+        return {}
+    options = {'background': True,
+               'manager': background_manager,
+               'running': [(Output(f'{name}_cancel', 'style'), {'display': 'inline-block'}, {'display': 'none'})],
+               'cancel': [Input(f'{name}_cancel', 'n_clicks')]}
+    if progress:
+        options['progress'] = [Output(f'{name}_progress', 'value'), Output(f'{name}_progress', 'max')]
+        options['running'].append((Output(f'{name}_progress', 'style'), {'display': 'flex'}, {'display': 'none'}))
+    return options
+
+# background callbacks reporting progress get the progress setter as first argument, which is passed on by keyword
+def progress_first(function):
+    if background_manager is None:
+        return function
+    def with_progress(set_progress, *args):
+        return function(*args, set_progress = set_progress)
+    with_progress.__name__ = function.__name__
+    return with_progress
+
 # create a function to wrap indicator names
 def wrap_indicator_names(indicator_name):
     # create list to contain wraped name
@@ -177,71 +215,8 @@ def wrap_indicator_names(indicator_name):
         wraped_name.append(' '.join(name_split[word:word + 3]))
     return '<br>'.join(wraped_name)
 
-# get country names
-countries = data['Country Name'].unique()
-# create dataframe for gini index, eliminating rows with missing values
-gini_df = poverty[poverty[gini].notna()]
-gini_years = gini_df["Year"].drop_duplicates().sort_values()
-gini_countries = gini_df["Country Name"].unique()
-# select columns to be ploted
-income_share_df_sorted_col = income_share_df_sorted.columns[:-2]
-countries_income_share_df_sorted = income_share_df_sorted["Country Name"].unique()
-country_list = gini_df["Country Name"].unique().tolist()
-# create first column
-col1 = dbc.Col([
-            dbc.Label("Year", className = "mx-2"),
-
-            html.Br(),
-            dcc.Dropdown(id = 'gini_year_dropdown',
-                         placeholder = "Select a year",
-                         options = [{'label': year,
-                                     'value': year} for year in gini_years],
-   style = {
-'color': '#2C3E50'}),
-            dcc.Graph(id = 'gini_year_barcharts', figure = initial_fig())
-])
-
-# create second column
-col2 = dbc.Col([
-            dbc.Label("Country"),
-
-            html.Br(),
-            dcc.Dropdown(id = 'gini_country_dropdown',
-                         multi = True,
-                         placeholder = "Select one or more countries",
-                         options = [{'label': country,
-                                     'value': country} for country in gini_countries],
-   style = {
-'color': '#2C3E50'},
-                        ),
-            dcc.Graph(id = 'gini_country_barcharts', figure = initial_fig())
-        ])
-
-col3 = dbc.Col(lg = 1)
-col4 = dbc.Col([
-        html.H3("Income Share Distribution", style = {
-        'fontFamily': 'sans-serif',
-        'textAlign': 'center',
-            }),
-        html.Br(),
-        dbc.Label("Country"),
-        dcc.Dropdown(id = 'income_level_country',
-                         placeholder = "Select a country",
-                         options = [{'label': country,
-                                   'value': country} for country in countries_income_share_df_sorted],
-   style = {
-'color': '#2C3E50'}),
-
-        dcc.Graph(id = 'income_level_country_barchart', figure = initial_fig()),
-])
-
-# filter poverty indicator dataset
-poverty_gap_cols = poverty_indicator.filter(regex = 'Poverty gap').columns
- # create four variables, one for each poverty level
-perc_pov_19 = poverty_gap_cols[0]
-perc_pov_31 = poverty_gap_cols[1]
-perc_pov_32 = poverty_gap_cols[2]
-perc_pov_55 = poverty_gap_cols[3]
+# poverty lines of the marks of the poverty gap slider
+poverty_gap_levels = ['$1.90 ', '$3.10 ', '$3.20 ', '$5.50 ']
 
 # get colors for marks for the slider
 cividis0 = px.colors.sequential.Cividis[0]
@@ -260,217 +235,563 @@ indicator_marks = {
     },
 }
 
-# create dataframe for percentage poverty
-poverty_indicator = poverty_indicator.rename(columns = {'Year': 'year'})
-perc_pov_df = poverty_indicator[poverty_indicator['is_country'].notna()].dropna(subset = poverty_gap_cols)
-perc_pov_years = sorted(set(perc_pov_df['year']))
-year_marks = {year: {'label': str(year), 'style': {'color': 'white'}} for year in perc_pov_years[::5]}  # slicing the year list with a step of five
-
-poverty_indicator_slider = dbc.Col([
-                   dbc.Label("Select poverty level: ", style = {'fontFamily': 'sans-serif', 'paddingRight': '10px'}),
-                   dcc.Slider(id = 'poverty_indicator_slider',
-                   min = 0,
-                   max = 3,
-                   step = 1,
-                   value = 0,
-                   included = False,
-                   marks = indicator_marks
-              )], lg = 4)
-year_slider =    dbc.Col([dbc.Label("Select a year: ",  style = {'fontFamily': 'sans-serif', 'marginRight': '10px'}),
-                  dcc.Slider(id = 'percentage_poverty_year_slider',
-                  min = perc_pov_years[0],
-                  max = perc_pov_years[-1],
-                  step = 1,
-                  included = False,
-                  value = 2014,
-                  marks = year_marks
-                        )], lg = 5)
-
-poverty_graph_col = dbc.Col([dcc.Graph(id = 'percentage_poverty__scatter_chart', figure = initial_fig())], lg = 10)
-
-# get indicators
-indicator_list = poverty_indicator.columns[3:54]
-
-# get countries
-country_sub = poverty_indicator[poverty_indicator['is_country'].notna()]
-
 """#### Main Layout"""
 # instantiate app
-app = Dash(__name__, external_stylesheets = [dbc.themes.DARKLY])
+# callbacks of the dashboards refer to components that are not in the initial layout
+app = Dash(__name__, external_stylesheets = [dbc.themes.DARKLY], suppress_callback_exceptions = True)
 
 # set up server
 server = app.server
 
-# get list of indicators
-indicator_list = poverty_indicator.columns[3:54]
-# get list of countries
-country_list = poverty_indicator[poverty_indicator['is_country'].notna()]["Country Name"].drop_duplicates().sort_values().tolist()
-
-main_layout = html.Div([
-    html.Div([
-        dbc.NavbarSimple([
-                    dbc.DropdownMenu([
-                        dbc.DropdownMenuItem(country, href = country) for country in country_list
-                    ], label = "Select a country")
-                    ], brand = 'Home', brand_href = '/', light = True
-                    ),
-        dbc.Row([
-            dbc.Col(lg = 1, md = 1, sm = 1),
-            dbc.Col([
-                dcc.Location(id = 'location'),
-                html.Div(id = 'main_content'),
-            ], lg = 10),
-        ])
-    ], style = {'fontFamily': 'sans-serif', 'fontSize': '14px',
-            'backgroundColor': '#2C3E50'})
-])
+# remember how long the callback of a request took, so that the rest of the request can be told apart
+def remember_callback_time(name, elapsed):
+    if has_request_context():
+        g.callback_time = (name, elapsed)
+
+# every callback records its wall time, the rows it selects and how it ended (see metrics.py)
+callback = instrumented_callback(dash_callback, remember_callback_time)
+
+@server.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+# record the time spent serialising the output of a callback, and the size of the response
+@server.after_request
+def record_callback_response(response):
+    if request.path.endswith('_dash-update-component') and 'callback_time' in g:
+        name, elapsed = g.callback_time
+        callback_serialise_seconds.observe(max(time.perf_counter() - g.request_start - elapsed, 0), callback = name)
+        callback_response_bytes.observe(response.calculate_content_length() or 0, callback = name)
+    return response
+
+# hash a callback request with the versions of the data, which together decide its response, and get the tag of those
+def callback_cache_key(body):
+    datasets.maybe_refresh()
+    tag = datasets_tag(*datasets.current)
+    key = [body.get('output'), body.get('inputs', []), body.get('state', []), body.get('changedPropIds', []), tag]
+    return hashlib.sha256(json.dumps(key, sort_keys = True, default = str).encode()).hexdigest()[:32], tag
+
+# answer a callback request from the response cache on the server
+# dash posts its callback requests without If-None-Match, so there is no revalidation by the browser to answer
+# the polling requests of background callbacks, which carry their job in the query string, are left alone
+@server.before_request
+def serve_cached_callback():
+    if response_cache is None or request.method != 'POST' or not request.path.endswith('_dash-update-component') or request.args:
+        return None
+    body = request.get_json(silent = True)
+    if not isinstance(body, dict):
+        return None
+    key, tag = g.response_key, g.response_tag = callback_cache_key(body)
+    cached = response_cache.get(key, tag)
+    if cached is None:
+        response_cache_requests.inc(outcome = 'miss')
+        return None
+    response_cache_requests.inc(outcome = 'hit')
+    g.response_cached = True
+    return Response(cached, mimetype = 'application/json')
+
+# keep the response of a callback that ran, unless it declined to update or started a background job
+@server.after_request
+def store_callback_response(response):
+    key = g.get('response_key')
+    if key is None or g.get('response_cached') or response.status_code != 200:
+        return response
+    body = response.get_data(as_text = True)
+    if body.startswith('{"multi"'):
+        response_cache.put(key, body, g.get('response_tag'))
+    return response
+
+# expose the metrics in the prometheus text format
+@server.route('/metrics')
+def metrics_endpoint():
+    return Response(render(), mimetype = 'text/plain; version=0.0.4')
+
+# the layouts depend on the data, so they are built on first use rather than at import
+# and once more for every vintage, or whenever the frames of a vintage are swapped
+def main_layout():
+    return vintage_layout(datasets.get(), tuple(datasets.vintages()), datasets.active)
+
+# the options of the large dropdowns, which are searched as the user types rather than sent with the layouts
+search_sources = {
+    'countries': lambda frames: frames['country_list'],
+    'indicators': lambda frames: frames['indicator_list'],
+    'gini_countries': lambda frames: frames['gini_df']['Country Name'].unique(),
+    'income_share_countries': lambda frames: frames['income_share_df_sorted']['Country Name'].unique(),
+}
+
+@lru_cache(maxsize = 32)
+def search_index(frames, source):
+    return PrefixIndex(search_sources[source](frames))
+
+# list the options of a searchable dropdown: the labels matching a search, or the first ones, and the selected values
+def search_options(frames, source, search = '', selected = None):
+    selected = [] if selected is None else selected if isinstance(selected, list) else [selected]
+    labels = search_index(frames, source).search(search or '', search_option_limit)
+    return [{'label': label, 'value': label} for label in labels + [value for value in selected if value not in labels]]
+
+# serialise the main layout once per dataset version, with the hash of its json as its ETag
+@lru_cache(maxsize = 8)
+@stage('layout:serialise')
+def serialised_layout(frames, vintages, active):
+    body = to_json_plotly(vintage_layout(frames, vintages, active))
+    return body, hashlib.sha256(body.encode()).hexdigest()[:32]
+
+# serve the layout from its serialised copy, or with 304 when the browser already has it
+@server.before_request
+def serve_cached_layout():
+    if request.method != 'GET' or not request.path.endswith('_dash-layout'):
+        return None
+    body, etag = serialised_layout(datasets.get(), tuple(datasets.vintages()), datasets.active)
+    if request.if_none_match.contains(etag):
+        return Response(status = 304, headers = {'ETag': f'"{etag}"'})
+    return Response(body, mimetype = 'application/json', headers = {'ETag': f'"{etag}"'})
+
+@lru_cache(maxsize = 8)
+@stage('layout:main')
+def vintage_layout(frames, vintages, active):
+    return html.Div([
+        html.Div([
+            dbc.NavbarSimple([
+                        # the countries are searched as the user types, see searchable_dropdown
+                        dcc.Dropdown(id = 'country_search_dropdown',
+                                     placeholder = "Select a country",
+                                     options = search_options(frames, 'countries'),
+                                     style = {'width': '220px', 'color': 'black', 'marginRight': '10px'}),
+                        # edition of the dataset the dashboards show
+                        dcc.Dropdown(id = 'vintage_dropdown',
+                                     value = active,
+                                     clearable = False,
+                                     options = [{'label': vintage_label(vintage), 'value': vintage} for vintage in vintages],
+                                     style = {'width': '160px', 'color': 'black'}),
+                        ], brand = 'Home', brand_href = '/', light = True
+                        ),
+            dbc.Row([
+                dbc.Col(lg = 1, md = 1, sm = 1),
+                dbc.Col([
+                    # the country picked in the navigation bar changes the page without reloading it
+                    dcc.Location(id = 'location', refresh = 'callback-nav'),
+                    html.Div(id = 'main_content'),
+                ], lg = 10),
+            ]),
+            # the template of the charts drawn in the browser, sent once with the page rather than with every store
+            dcc.Store(id = 'figure_template', data = pio.templates[pio.templates.default].to_plotly_json())
+        ], style = {'fontFamily': 'sans-serif', 'fontSize': '14px',
+                'backgroundColor': '#2C3E50'})
+    ])
 
 """#### Indicators Dashboard"""
 
-indicators_dashboard = html.Div([
-    html.Meta(charSet="UTF-8"),
-    html.Meta(name='viewport', content='width=device-width,initial-scale=1'),
-    dbc.Col([
-             html.Br(),
-             html.H3("Poverty and Equity Database"),
-             html.H4("The World Bank"),
-             ], style = {'textAlign': 'center'}),
-    html.Br(),
-    dbc.Row([
-             # dbc.Col(lg = 1, md = 1, sm = 1),
-             dbc.Col([
-                     dcc.Dropdown(id = 'indicator_dropdown',
-                                  value = 'Gini index (World Bank estimate)',
-                                  options = [{'label': indicator, 'value': indicator} for indicator in indicator_list],
-                                  style = {'fontFamily': 'sans-serif','color': 'black'}),
-                     dcc.Loading(
-                                 id = 'loading',
-                                 type = 'default',
-                                 fullscreen = False,
-                                 children = [
-                                             # create graph component
-                                             dcc.Graph(id = 'indicator_map_chart'),
-                                             dcc.Markdown(id = 'indicator_details', style = {'backgroundColor': '#e5ecf6',
-                                                            'fontFamily': 'sans-serif',
-                                                            'color': 'black'})])])
-           ]),
-    html.Br(),
-    dbc.Row([
-        dbc.Col(width = {"size": 1, "order": 1}, lg = {"size": 1, "order": 1}),
-        dbc.Col([
-            dbc.Label("Indicator: ", style = {'fontFamily': 'sans-serif', 'color': 'white', 'whiteSpace': 'normal'}),
-            dcc.Dropdown(id = 'indicator_histogram_dropdown',
-                        value = gini,
-                        options = [{'label': indicator ,
-                                       'value': indicator} for indicator in indicator_list],
-                        style = {'fontSize': 12, 'fontFamily': 'sans-serif', 'color': 'black'}),
-
-            ], width = {"size": 5, "order": 2}, lg = {"size": 6, "order": 2}),
-        dbc.Col([
-            dbc.Label("Years: ", style = {'fontFamily': 'sans-serif', 'color': 'white'}),
-            html.Br(),
-            dcc.Dropdown(id = 'indicator_year_dropdown',
-                            placeholder = "Select one or more years",
-                            multi = True,
-                            value = [2015],
-                            options = [{'label': year,
-                                       'value': year} for year in year_list],
-                            style = {'fontFamily': 'sans-serif', 'color': 'black'})
-            ], width = {"size": 4, "order": 3}, lg = {"size": 4, "order": 3}),
-        ]),
-    html.Br(),
-    dbc.Row([
-        dbc.Col(width = {"size": 2, "order": 1}, lg = {"size": 2, "order": 1}),
-        dbc.Col([
-            dbc.Label("Modify number of bins: ", style = {'fontFamily': 'sans-serif', 'color': 'white'}),
+@lru_cache(maxsize = 8)
+@stage('layout:indicators_dashboard')
+def indicators_dashboard(frames):
+    gini_df = frames['gini_df']
+    perc_pov_df = frames['perc_pov_df']
+    # get the years covered by the vintage
+    year_list = frames['years']['year'].tolist()
+
+    gini_years = gini_df["Year"].drop_duplicates().sort_values()
+    # create first column
+    col1 = dbc.Col([
+                dbc.Label("Year", className = "mx-2"),
+
+                html.Br(),
+                dcc.Dropdown(id = 'gini_year_dropdown',
+                             placeholder = "Select a year",
+                             options = [{'label': year,
+                                         'value': year} for year in gini_years],
+       style = {
+    'color': '#2C3E50'}),
+                dcc.Checklist(id = 'gini_year_fill',
+                              value = [],
+                              inline = True,
+                              options = [{'label': ' Latest available value', 'value': 'latest'}],
+                              inputStyle = {'marginRight': '5px'}),
+                dcc.Graph(id = 'gini_year_barcharts', figure = initial_fig()),
+                dcc.Store(id = 'gini_year_store', data = gini_year_store(frames))
+    ])
+
+    # create second column
+    col2 = dbc.Col([
+                dbc.Label("Country"),
+
+                html.Br(),
+                dcc.Dropdown(id = 'gini_country_dropdown',
+                             multi = True,
+                             placeholder = "Select one or more countries",
+                             options = search_options(frames, 'gini_countries'),
+       style = {
+    'color': '#2C3E50'},
+                            ),
+                dcc.Checklist(id = 'gini_country_overlays',
+                              value = [],
+                              inline = True,
+                              options = [{'label': ' Trend and forecast', 'value': 'trend'}],
+                              inputStyle = {'marginRight': '5px'}),
+                dcc.Graph(id = 'gini_country_barcharts', figure = initial_fig())
+            ])
+
+    col3 = dbc.Col(lg = 1)
+    col4 = dbc.Col([
+            html.H3("Income Share Distribution", style = {
+            'fontFamily': 'sans-serif',
+            'textAlign': 'center',
+                }),
             html.Br(),
-            dcc.Slider(id = 'bin_slider',
-                       dots = True,
+            dbc.Label("Country"),
+            dcc.Dropdown(id = 'income_level_country',
+                             placeholder = "Select a country",
+                             options = search_options(frames, 'income_share_countries'),
+       style = {
+    'color': '#2C3E50'}),
+
+            dcc.Graph(id = 'income_level_country_barchart', figure = initial_fig()),
+    ])
+
+    # get years with percentage poverty data
+    perc_pov_years = sorted(set(perc_pov_df['year']))
+    year_marks = {year: {'label': str(year), 'style': {'color': 'white'}} for year in perc_pov_years[::5]}  # slicing the year list with a step of five
+
+    poverty_indicator_slider = dbc.Col([
+                       dbc.Label("Select poverty level: ", style = {'fontFamily': 'sans-serif', 'paddingRight': '10px'}),
+                       dcc.Slider(id = 'poverty_indicator_slider',
                        min = 0,
-                       step = 5,
+                       max = 3,
+                       step = 1,
+                       value = 0,
                        included = False,
-                       marks = {num: str(num) for num in range(0, 105, 5)}
-                      ),
-                ], width = {"size": 7, "order": 2}, lg = {"size": 6, "order": 2})
-    ]),
-    html.Br(),
-    dcc.Graph(id = 'indicator_histogram'),
-    html.Br(),
-    dbc.Row([
-        # dbc.Col(width = {"size": 2, "order": 1}, lg = {"size": 2, "order": 1}),
+                       marks = indicator_marks
+                  )], lg = 4)
+    year_slider =    dbc.Col([dbc.Label("Select a year: ",  style = {'fontFamily': 'sans-serif', 'marginRight': '10px'}),
+                      dcc.Slider(id = 'percentage_poverty_year_slider',
+                      min = perc_pov_years[0],
+                      max = perc_pov_years[-1],
+                      step = 1,
+                      included = False,
+                      value = 2014,
+                      marks = year_marks
+                            )], lg = 5)
+
+
+    return html.Div([
+        html.Meta(charSet="UTF-8"),
+        html.Meta(name='viewport', content='width=device-width,initial-scale=1'),
         dbc.Col([
-            html.Div(id = 'histogram_table', style = {'fontFamily': 'sans-serif', 'color': 'black'})
-        ])
-    ]),
-    html.Br(),
-    html.H3("Gini Index", style = {
-        'fontFamily': 'sans-serif',
-        'textAlign': 'center',
-    }),
-    html.Br(),
-    dbc.Row([col1, col2]),
-    html.Br(),
-    dbc.Row([col3, col4]),
-    html.Br(),
-    html.H3("Poverty Gap", style = {'fontFamily': 'sans-serif', 'textAlign': 'center'}),
-    html.H5("(at $1.9, $3.1, $3.2, and 5.5 (% of total population))", style = {'fontFamily': 'sans-serif', 'textAlign': 'center'}),
-    html.Br(), html.Br(),
-    dbc.Row([dbc.Col(lg = 2), poverty_indicator_slider, year_slider
-    #     dbc.Col(lg=2),  # Spacer column
-    #     dbc.Col([  # Col for the sliders
-    #         dbc.Row([  # Nested row for the sliders
-    #             dbc.Col([
-    #                 dbc.Label("Select poverty level:", style={'fontFamily': 'sans-serif', 'paddingRight': '10px'}),
-    #                 dcc.Slider(
-    #                 id = 'poverty_indicator_slider',
-    #                 min = 0,
-    #                 max = 3,
-    #                 step = 1,
-    #                 value = 0,
-    #                 included = False,
-    #                 marks = indicator_marks
-    #             ),
-    #         ]),
-    #             dbc.Col([
-    #                 dbc.Label("Select a year:", style={'fontFamily': 'sans-serif', 'marginRight': '10px'}),
-    #                 dcc.Slider(
-    #                 id = 'percentage_poverty_year_slider',
-    #                 min = perc_pov_years[0],
-    #                 max = perc_pov_years[-1],
-    #                 step = 1,
-    #                 included = False,
-    #                 value = 2014,
-    #                 marks = {num: str(num) for num in range(1981, 2014, 7)}
-    #             ),
-    #         ]),
-    #     ]),
-    # ], lg=5),
-    # dbc.Col(lg=5),
-    
-]),
-    html.Br(),
-    dcc.Graph(id = 'percentage_poverty__scatter_chart'),
-    html.Br(),
-    dbc.Tabs([tab1, tab2]),
-], style = {'fontFamily': 'sans-serif',
-            'backgroundColor': '#2C3E50'})
+                 html.Br(),
+                 html.H3("Poverty and Equity Database"),
+                 html.H4("The World Bank"),
+                 ], style = {'textAlign': 'center'}),
+        html.Br(),
+        dbc.Row([
+                 # dbc.Col(lg = 1, md = 1, sm = 1),
+                 dbc.Col([
+                         dcc.Dropdown(id = 'indicator_dropdown',
+                                      value = 'Gini index (World Bank estimate)',
+                                      options = search_options(frames, 'indicators', selected = gini),
+                                      style = {'fontFamily': 'sans-serif','color': 'black'}),
+                         # only shown while the map chart is built in the background
+                         dbc.Button('Cancel', id = 'indicator_map_chart_cancel', size = 'sm', color = 'secondary',
+                                    style = {'display': 'none'}),
+                         # the animated map sends every year at once, the map of a year fetches other years on demand
+                         dcc.RadioItems(id = 'indicator_map_mode',
+                                        value = 'animated',
+                                        inline = True,
+                                        options = [{'label': ' Animated ', 'value': 'animated'},
+                                                   {'label': ' One year at a time ', 'value': 'year'}],
+                                        inputStyle = {'marginLeft': '10px'}),
+                         # the years without data are left blank, or show the latest value so far, or a value
+                         # interpolated between two years with data
+                         dcc.RadioItems(id = 'indicator_map_fill',
+                                        value = 'none',
+                                        inline = True,
+                                        options = [{'label': ' Years with data ', 'value': 'none'},
+                                                   {'label': ' Latest available value ', 'value': 'latest'},
+                                                   {'label': ' Interpolated ', 'value': 'interpolate'}],
+                                        inputStyle = {'marginLeft': '10px'}),
+                         html.Div([
+                             dcc.Slider(id = 'indicator_map_year_slider', step = 1, included = False)
+                         ], id = 'indicator_map_year_container', style = {'display': 'none'}),
+                         dcc.Loading(
+                                     id = 'loading',
+                                     type = 'default',
+                                     fullscreen = False,
+                                     children = [
+                                                 # create graph component
+                                                 dcc.Graph(id = 'indicator_map_chart'),
+                                                 dcc.Markdown(id = 'indicator_details', style = {'backgroundColor': '#e5ecf6',
+                                                                'fontFamily': 'sans-serif',
+                                                                'color': 'black'})])])
+               ]),
+        html.Br(),
+        dbc.Row([
+            dbc.Col(width = {"size": 1, "order": 1}, lg = {"size": 1, "order": 1}),
+            dbc.Col([
+                dbc.Label("Indicator: ", style = {'fontFamily': 'sans-serif', 'color': 'white', 'whiteSpace': 'normal'}),
+                dcc.Dropdown(id = 'indicator_histogram_dropdown',
+                            value = gini,
+                            options = search_options(frames, 'indicators', selected = gini),
+                            style = {'fontSize': 12, 'fontFamily': 'sans-serif', 'color': 'black'}),
 
-# update callback function
-@callback(Output('indicator_map_chart', 'figure'),
-              Output('indicator_details', 'children'),
-              Input('indicator_dropdown', 'value'))
+                ], width = {"size": 5, "order": 2}, lg = {"size": 6, "order": 2}),
+            dbc.Col([
+                dbc.Label("Years: ", style = {'fontFamily': 'sans-serif', 'color': 'white'}),
+                html.Br(),
+                dcc.Dropdown(id = 'indicator_year_dropdown',
+                                placeholder = "Select one or more years",
+                                multi = True,
+                                value = [2015],
+                                options = [{'label': year,
+                                           'value': year} for year in year_list],
+                                style = {'fontFamily': 'sans-serif', 'color': 'black'})
+                ], width = {"size": 4, "order": 3}, lg = {"size": 4, "order": 3}),
+            ]),
+        html.Br(),
+        dbc.Row([
+            dbc.Col(width = {"size": 2, "order": 1}, lg = {"size": 2, "order": 1}),
+            dbc.Col([
+                dbc.Label("Modify number of bins: ", style = {'fontFamily': 'sans-serif', 'color': 'white'}),
+                html.Br(),
+                dcc.Slider(id = 'bin_slider',
+                           dots = True,
+                           min = 0,
+                           step = 5,
+                           included = False,
+                           marks = {num: str(num) for num in range(0, 105, 5)}
+                          ),
+                    ], width = {"size": 7, "order": 2}, lg = {"size": 6, "order": 2})
+        ]),
+        html.Br(),
+        # only shown while the histogram is built in the background
+        dbc.Row([
+            dbc.Col(dbc.Progress(id = 'indicator_histogram_progress', value = 0, max = 1, style = {'display': 'none'})),
+            dbc.Col(dbc.Button('Cancel', id = 'indicator_histogram_cancel', size = 'sm', color = 'secondary',
+                               style = {'display': 'none'}), width = 'auto'),
+        ]),
+        dcc.Graph(id = 'indicator_histogram'),
+        html.Br(),
+        dbc.Row([
+            # dbc.Col(width = {"size": 2, "order": 1}, lg = {"size": 2, "order": 1}),
+            dbc.Col([
+                html.Div(id = 'histogram_table', style = {'fontFamily': 'sans-serif', 'color': 'black'})
+            ])
+        ]),
+        html.Br(),
+        html.H3("Gini Index", style = {
+            'fontFamily': 'sans-serif',
+            'textAlign': 'center',
+        }),
+        html.Br(),
+        dbc.Row([col1, col2]),
+        html.Br(),
+        dbc.Row([col3, col4]),
+        html.Br(),
+        html.H3("Poverty Gap", style = {'fontFamily': 'sans-serif', 'textAlign': 'center'}),
+        html.H5("(at $1.9, $3.1, $3.2, and 5.5 (% of total population))", style = {'fontFamily': 'sans-serif', 'textAlign': 'center'}),
+        html.Br(), html.Br(),
+        dbc.Row([dbc.Col(lg = 2), poverty_indicator_slider, year_slider,
+                 dbc.Col(dcc.Checklist(id = 'poverty_gap_fill',
+                                       value = [],
+                                       options = [{'label': ' Latest available value', 'value': 'latest'}],
+                                       inputStyle = {'marginRight': '5px'}), lg = 1)
+        #     dbc.Col(lg=2),  # Spacer column
+        #     dbc.Col([  # Col for the sliders
+        #         dbc.Row([  # Nested row for the sliders
+        #             dbc.Col([
+        #                 dbc.Label("Select poverty level:", style={'fontFamily': 'sans-serif', 'paddingRight': '10px'}),
+        #                 dcc.Slider(
+        #                 id = 'poverty_indicator_slider',
+        #                 min = 0,
+        #                 max = 3,
+        #                 step = 1,
+        #                 value = 0,
+        #                 included = False,
+        #                 marks = indicator_marks
+        #             ),
+        #         ]),
+        #             dbc.Col([
+        #                 dbc.Label("Select a year:", style={'fontFamily': 'sans-serif', 'marginRight': '10px'}),
+        #                 dcc.Slider(
+        #                 id = 'percentage_poverty_year_slider',
+        #                 min = perc_pov_years[0],
+        #                 max = perc_pov_years[-1],
+        #                 step = 1,
+        #                 included = False,
+        #                 value = 2014,
+        #                 marks = {num: str(num) for num in range(1981, 2014, 7)}
+        #             ),
+        #         ]),
+        #     ]),
+        # ], lg=5),
+        # dbc.Col(lg=5),
+    
+    ]),
+        html.Br(),
+        dcc.Graph(id = 'percentage_poverty__scatter_chart'),
+        dcc.Store(id = 'poverty_gap_store', data = poverty_gap_store(frames)),
+        html.Br(),
+        html.H3("Regions and Income Groups", style = {'fontFamily': 'sans-serif', 'textAlign': 'center'}),
+        html.Br(),
+        dbc.Row([
+            dbc.Col([
+                dbc.Label("Indicator: ", style = {'fontFamily': 'sans-serif', 'color': 'white'}),
+                dcc.Dropdown(id = 'region_indicator_dropdown',
+                             value = gini,
+                             clearable = False,
+                             options = search_options(frames, 'indicators', selected = gini),
+                             style = {'fontFamily': 'sans-serif', 'color': 'black'}),
+                ], lg = 6),
+            dbc.Col([
+                dbc.Label("Statistic: ", style = {'fontFamily': 'sans-serif', 'color': 'white'}),
+                dcc.Dropdown(id = 'region_statistic_dropdown',
+                             value = 'weighted_mean',
+                             clearable = False,
+                             options = [{'label': label, 'value': statistic} for statistic, label in rollup_statistics.items()],
+                             style = {'fontFamily': 'sans-serif', 'color': 'black'}),
+                ], lg = 3),
+            dbc.Col([
+                dbc.Label("Group by: ", style = {'fontFamily': 'sans-serif', 'color': 'white'}),
+                dcc.RadioItems(id = 'region_group_type',
+                               value = group_columns[0],
+                               inline = True,
+                               options = [{'label': f' {column} ', 'value': column} for column in group_columns],
+                               inputStyle = {'marginLeft': '10px'},
+                               style = {'color': 'white'}),
+                ], lg = 3),
+        ]),
+        dcc.Graph(id = 'region_comparison_chart'),
+        html.Br(),
+        dbc.Tabs([tab1, tab2]),
+    ], style = {'fontFamily': 'sans-serif',
+                'backgroundColor': '#2C3E50'})
+
+# get the notes on points of a chart as hover text, such as how the survey of a country and year was run
+# None when the indicator has no notes, so that the charts of most indicators are left as they were
+def notes_hover(frames, indicator, country_codes, years):
+    record = frames['indicator_metadata'].get(indicator)
+    if record is None:
+        return None
+    texts = frames['notes'].hover_text(record['Indicator Code'], list(country_codes), list(years))
+    return texts if any(texts) else None
+
+# show the notes given as custom data in the hover labels of the traces of a chart made by plotly express
+# a trace whose points all share one note, such as the line of a country with a note on all its years, gets it
+# written into its hover template instead, rather than sent once per point
+def add_notes_hover(fig):
+    for trace in list(fig.data) + [trace for frame in fig.frames for trace in frame.data]:
+        texts = set() if trace.customdata is None else {row[0] for row in trace.customdata}
+        if len(texts) == 1 and '%{' not in next(iter(texts)):
+            trace.hovertemplate = trace.hovertemplate.replace('<extra></extra>', next(iter(texts)) + '<extra></extra>')
+            trace.customdata = None
+        else:
+            trace.hovertemplate = trace.hovertemplate.replace('<extra></extra>', '%{customdata[0]}<extra></extra>')
+    return fig
 
-# update the function that takes the selected indicator and returns the desired
-# map chart
-def display_indicator_map_chart(indicator):
-    fig = px.choropleth(country_sub,
+# create the dotted line of the fitted trend of a country and its forecast (see trends.py), or None when its series
+# has too few years of data
+def trend_trace(frames, country_code, country, indicator, **options):
+    line = frames['trends'].line(country_code, indicator)
+    if line is None:
+        return None
+    years, values = line
+    labels = ['trend'] * 2 + ['forecast'] * (len(years) - 2)
+    return go.Scatter(x = years, y = values, text = labels, mode = 'lines', name = f'{country} trend', showlegend = False,
+                      hovertemplate = f'<b>{country}</b> %{{text}}<br>year=%{{x}}<br>{indicator}=%{{y}}<extra></extra>', **options)
+
+# join the notes on the points of a chart and the labels of how their values were filled in, None when both are empty
+def join_hover(*texts):
+    texts = [text for text in texts if text]
+    if not texts:
+        return None
+    return [''.join(parts) for parts in zip(*texts)]
+
+# create the animated map chart of an indicator
+# every year lists every country, with missing values where it has no data, so that the frames of the animation
+# share their country codes and names, and only their values are sent for every year
+# the years without data may be filled in with the latest value so far or interpolated (see gap_fill.py)
+def indicator_map_figure(frames, indicator, fill = 'none'):
+    df = frames['country_sub'].select({}, [indicator])[['Country Code', 'Country Name', 'year', indicator]]
+    countries = df[['Country Code', 'Country Name']].drop_duplicates('Country Code')
+    years = pd.DataFrame({'year': sorted(df['year'].unique())})
+    grid = countries.merge(years, how = 'cross').merge(df[['Country Code', 'year', indicator]], how = 'left', on = ['Country Code', 'year'])
+    labels = None
+    if fill != 'none':
+        values, flags, source_years = frames['latest_values'].lookup(indicator, grid['Country Code'], grid['year'], fill)
+        # keep the values of the table where the data files have none, such as those of an exported poverty table
+        grid[indicator] = np.where(flags > 0, values, grid[indicator])
+        labels = fill_labels(flags, source_years)
+    note_texts = join_hover(notes_hover(frames, indicator, grid['Country Code'], grid['year']), labels)
+    if note_texts:
+        # countries without data that year show no hover label, so their notes are left out
+        grid['Note'] = np.where(grid[indicator].notna(), note_texts, '')
+    fig = px.choropleth(grid,
                        color = indicator,
                        locations = "Country Code",
                        color_continuous_scale = 'plotly3',
                        animation_frame = 'year',
                        hover_name = "Country Name",
                        title = indicator,
+                       custom_data = ['Note'] if note_texts else None,
                        height = 650)
+    if note_texts:
+        add_notes_hover(fig)
+    return style_map_figure(fig, indicator)
+
+# get the values of an indicator for every country, one array per year with data, aligned on the country codes
+# and, when the years without data are filled in, the labels of how their values were found
+@lru_cache(maxsize = 32)
+def indicator_map_years(frames, indicator, fill = 'none'):
+    frame = frames['poverty_country_index'].select({}, [indicator])
+    table = frame.pivot_table(index = 'year', columns = 'Country Code', values = indicator, aggfunc = 'first', dropna = False)
+    codes = frame[['Country Code', 'Country Name']].drop_duplicates('Country Code').sort_values('Country Code')
+    table = table.reindex(columns = codes['Country Code'])
+    labels = None
+    if fill != 'none':
+        years = np.repeat(table.index.to_numpy(), len(table.columns))
+        values, flags, source_years = frames['latest_values'].lookup(indicator, np.tile(table.columns.to_numpy(), len(table)), years, fill)
+        table = pd.DataFrame(np.where(flags > 0, values, table.to_numpy().ravel()).reshape(table.shape), index = table.index, columns = table.columns)
+        labels = dict(zip(table.index, np.array(fill_labels(flags, source_years), dtype = object).reshape(table.shape)))
+    table = table.dropna(how = 'all')
+    labels = labels and {year: labels[year].tolist() for year in table.index}
+    return codes['Country Code'].tolist(), codes['Country Name'].tolist(), {year: row.to_numpy() for year, row in table.iterrows()}, labels
+
+# get the notes on the countries of the map of a year, aligned on the country codes
+# None when the indicator has no notes at all, otherwise empty for the countries without notes that year,
+# so that the other years can be patched in
+def indicator_map_year_notes(frames, indicator, year):
+    record = frames['indicator_metadata'].get(indicator)
+    if record is None or not frames['notes'].has_notes(record['Indicator Code']):
+        return None
+    codes = indicator_map_years(frames, indicator)[0]
+    return frames['notes'].hover_text(record['Indicator Code'], codes, [year] * len(codes))
+
+# get the hover text of the map of a year: the notes on the countries and how their values were filled in
+# None when the indicator has neither notes nor filled values, otherwise empty for the countries without either
+def indicator_map_year_hover(frames, indicator, year, fill = 'none'):
+    codes, _, _, labels = indicator_map_years(frames, indicator, fill)
+    note_texts = indicator_map_year_notes(frames, indicator, year)
+    if labels is None:
+        return note_texts
+    return join_hover(note_texts, labels[year]) or [''] * len(codes)
+
+# create the map chart of one year of an indicator, whose colors are fixed over the years so that only z changes
+def indicator_map_year_figure(frames, indicator, year, fill = 'none'):
+    codes, names, values, _ = indicator_map_years(frames, indicator, fill)
+    every_value = np.concatenate(list(values.values()))
+    hover_texts = indicator_map_year_hover(frames, indicator, year, fill)
+    fig = go.Figure(go.Choropleth(locations = codes,
+                                  z = values[year],
+                                  text = names,
+                                  customdata = hover_texts,
+                                  coloraxis = 'coloraxis',
+                                  hovertemplate = '<b>%{text}</b><br>Country Code=%{location}<br>' + indicator + '=%{z}' +
+                                                  ('%{customdata}' if hover_texts else '') + '<extra></extra>'))
+    fig.update_layout(title = f'{indicator} - {year}',
+                      height = 650,
+                      coloraxis = {'colorscale': px.colors.sequential.Plotly3,
+                                   'cmin': np.nanmin(every_value), 'cmax': np.nanmax(every_value)})
+    return style_map_figure(fig, indicator)
+
+# apply the look shared by the map charts
+def style_map_figure(fig, indicator):
     # remove the rectangular frame around the map
     fig.layout.geo.showframe = False
 
@@ -502,32 +823,81 @@ def display_indicator_map_chart(indicator):
 
     # wrap the title of the colorbar
     fig.layout.coloraxis.colorbar.title = wrap_indicator_names(indicator)
+    return fig
 
-    # subset indicator dataframe based on what a user selects
-    series_subset = series[series['Indicator Name'].eq(indicator)]
+# the map chart only depends on the indicator, the filling of the years without data and the data,
+# so it is built once per dataset version
+def cached_indicator_map_figure(frames, indicator, fill = 'none'):
+    key = ('indicator_map_chart', indicator, frames.version) + ((fill,) if fill != 'none' else ())
+    return map_figure_cache.figure(key, lambda: send_figure(indicator_map_figure(frames, indicator, fill)), frames.version)
 
-    if series_subset.empty:
+# build the map charts of every indicator of the active vintage ahead of time
+def warm_figure_cache():
+    frames = datasets.get()
+    for indicator in frames['indicator_list']:
+        cached_indicator_map_figure(frames, indicator)
+    return frames
+
+# update callback function
+@callback(Output('indicator_map_chart', 'figure'),
+              Output('indicator_details', 'children'),
+              Output('indicator_map_year_slider', 'min'),
+              Output('indicator_map_year_slider', 'max'),
+              Output('indicator_map_year_slider', 'value'),
+              Output('indicator_map_year_slider', 'marks'),
+              Output('indicator_map_year_container', 'style'),
+              Input('indicator_dropdown', 'value'),
+              Input('indicator_map_mode', 'value'),
+              Input('indicator_map_fill', 'value'),
+              State('vintage_dropdown', 'value'),
+              **background_options('indicator_map_chart'))
+
+# update the function that takes the selected indicator and returns the desired
+# map chart
+def display_indicator_map_chart(indicator, mode, fill, vintage):
+    frames = datasets.get(vintage)
+    fill = fill if fill in fill_modes else 'none'
+    slider = [no_update] * 4 + [{'display': 'none'}]
+    years = sorted(indicator_map_years(frames, indicator, fill)[2]) if mode == 'year' else []
+    if years:
+        # start from the latest year with data, the other years are patched in by update_indicator_map_year
+        fig = send_figure(indicator_map_year_figure(frames, indicator, years[-1], fill))
+        slider = [years[0], years[-1], years[-1],
+                  {year: {'label': str(year), 'style': {'color': 'white'}} for year in years[::max(len(years) // 8, 1)]}, {}]
+    else:
+        fig = cached_indicator_map_figure(frames, indicator, fill)
+
+    # get the details of the indicator a user selects
+    details = frames['indicator_metadata'].get(indicator)
+
+    if details is None:
         markdown = "There is currently no information available on this indicator"
     else:
-        # get the limitations column from the dataframe
-        # replace empty rows with N/A
-        # replace any instances of two newline characters, \n\n, with a single space, if any
-        # extract the first element under its values attribute
-        limitations = series_subset['Limitations and exceptions'].fillna('N/A').str.replace('\n\n', ' ').values[0]
-
-        markdown = f"""
-                    ### {series_subset["Indicator Name"].values[0]}
-                    {series_subset["Long definition"].values[0]}
-
-                    * **Unit of measure**: {series_subset['Unit of measure'].fillna("count").values[0]}
-                    * **Periodicity**
-                    {series_subset["Periodicity"].fillna("N/A").values[0]}
-                    * **Source**: {series_subset["Source"].values[0]}
-                    #### Limitations and exceptions
-                    {limitations}
-                """
+        markdown = details['markdown']
     # display map and markdown
-    return [fig, markdown]
+    return [fig, markdown] + slider
+
+# show another year on the map of one year, sending only the new colors and title
+@callback(Output('indicator_map_chart', 'figure', allow_duplicate = True),
+          Input('indicator_map_year_slider', 'value'),
+          State('indicator_dropdown', 'value'),
+          State('indicator_map_mode', 'value'),
+          State('indicator_map_fill', 'value'),
+          State('vintage_dropdown', 'value'),
+          prevent_initial_call = True)
+def update_indicator_map_year(year, indicator, mode, fill, vintage):
+    frames = datasets.get(vintage)
+    fill = fill if fill in fill_modes else 'none'
+    values = indicator_map_years(frames, indicator, fill)[2]
+    if mode != 'year' or year not in values:
+        raise PreventUpdate
+    patched = Patch()
+    patched['data'][0]['z'] = values[year]
+    hover_texts = indicator_map_year_hover(frames, indicator, year, fill)
+    if hover_texts:
+        patched['data'][0]['customdata'] = hover_texts
+    patched['layout']['title']['text'] = f'{indicator} - {year}'
+    return patched
 
 
 # # create callbacks
@@ -535,24 +905,25 @@ def display_indicator_map_chart(indicator):
           Output('histogram_table','children'),
           Input('indicator_histogram_dropdown', 'value'),
           Input('indicator_year_dropdown', 'value'),
-          Input('bin_slider', 'value')
+          Input('bin_slider', 'value'),
+          State('vintage_dropdown', 'value'),
+          **background_options('indicator_histogram', progress = True)
          )
-
-def display_histogram(indicator, years, bin):
+@progress_first
+def display_histogram(indicator, years, bin, vintage, set_progress = None):
     if not (indicator) or not (years):
         raise PreventUpdate
-    # create subset of poverty dataframe
-    poverty_subset = poverty_indicator[poverty_indicator['year'].isin(years) & poverty_indicator['is_country']]
-    # create histogram object
-    fig = px.histogram(
-        poverty_subset,
-        x = indicator,
-        color = 'year',
-        nbins = bin,
-        facet_col = 'year',
+    frames = datasets.get(vintage)
+    # create histogram object from counts binned on the server
+    fig = binned_histogram(
+        frames['histogram_bins'],
+        indicator,
+        years,
+        bins = bin,
         facet_col_wrap = 4,
         height = 700,
-        title = " - ".join([indicator, 'Histogram'])
+        title = " - ".join([indicator, 'Histogram']),
+        progress = set_progress and (lambda done, total: set_progress((done, total)))
     )
     # eliminate overlaping a-axis labels
     fig.for_each_xaxis(lambda axis: axis.update(title = ''))
@@ -563,41 +934,151 @@ def display_histogram(indicator, years, bin):
                        yref = 'paper',
                        showarrow = False)
     fig.layout.paper_bgcolor = '#e5ecf6'
-    # filter poverty dataframe
-
-    # get columns from dataframe
-    df_columns = poverty_subset[['Country Name', 'year', indicator]].columns
-    # create data table
-    data_table = DataTable(
-                             data = poverty_subset[['Country Name', 'year', indicator]].to_dict('records'),
-                             columns = [{'name': column, 'id': column} for column in df_columns],
+    fig = send_figure(fig)
+    # create data table, whose rows are served page by page by update_histogram_table
+    data_table = html.Div([
+        DataTable(
+                             id = 'histogram_data_table',
+                             columns = [{'name': column, 'id': column} for column in ['Country Name', 'year', indicator]],
                              # allow text to overflow into multiple lines if needed
                              style_header = {'whiteSpace': 'normal'},
                              # ensure that while scrolling, the headers remain fixed in place
                              fixed_rows = {"headers": True},
                              # control the height of the table
                              style_table = {"height": '400px'},
-                             # control the display of table rows
-                             virtualization = True,
+                             # serve pages of rows from the server
+                             page_action = 'custom',
+                             page_current = 0,
+                             page_size = histogram_table_page_size,
                               # add the ability to sort columns
-                             sort_action = 'native',
+                             sort_action = 'custom',
+                             sort_by = [],
                              # add the ability to filter columns
-                             filter_action = 'native',
+                             filter_action = 'custom',
+                             filter_query = '',
                              # set cell minimum width
                              style_cell = {'minWidth': '140px'},
-                             # enable download of table as csv
-                             export_format = 'csv',
-                            )
+                            ),
+        # download the full table as csv from the server
+        html.A('Download CSV', id = 'histogram_table_export', href = export_url(indicator, years, vintage = vintage),
+               style = {'color': 'white'}),
+    ])
     return fig, data_table
 
-# create first callback function
-@callback(Output('gini_year_barcharts', 'figure')
-              ,Input('gini_year_dropdown', 'value')
-             )
-def plot_gini_chart_for_selected_year(selected_year):
+# select the rows shown in the histogram table
+def histogram_table_frame(frames, indicator, years):
+    return frames['poverty_country_index'].select({'year': years}, [indicator])[['Country Name', 'year', indicator]]
+
+@callback(Output('histogram_data_table', 'data'),
+          Output('histogram_data_table', 'page_count'),
+          Output('histogram_table_export', 'href'),
+          Input('histogram_data_table', 'page_current'),
+          Input('histogram_data_table', 'page_size'),
+          Input('histogram_data_table', 'sort_by'),
+          Input('histogram_data_table', 'filter_query'),
+          State('indicator_histogram_dropdown', 'value'),
+          State('indicator_year_dropdown', 'value'),
+          State('vintage_dropdown', 'value'))
+def update_histogram_table(page_current, page_size, sort_by, filter_query, indicator, years, vintage):
+    if not (indicator) or not (years):
+        raise PreventUpdate
+    # filter and sort the selection, then send only the requested page
+    table = sort_frame(filter_frame(histogram_table_frame(datasets.get(vintage), indicator, years), filter_query), sort_by)
+    page, page_count = page_frame(table, page_current, page_size)
+    return page.to_dict('records'), page_count, export_url(indicator, years, filter_query, sort_by, vintage)
+
+# stream a slice of the poverty data as csv or parquet, e.g.
+# /export/Gini index (World Bank estimate)?years=2000-2019&countries=GHA,BRA&format=parquet
+# several indicators are exported at once with /export?indicator=...&indicator=...
+# aggregates=0 leaves out regions and income groups, and the filter and sort parameters apply
+# the filtering and sorting of the histogram table, vintage=data_2019 exports another edition
+@server.route('/export', defaults = {'indicator': None})
+@server.route('/export/<path:indicator>')
+def export_indicator(indicator):
+    frames = datasets.get(request.args.get('vintage'))
+    indicators = [indicator] if indicator else request.args.getlist('indicator')
+    if not indicators or any(name not in frames['indicator_list'] for name in indicators):
+        abort(404)
+    export_format = request.args.get('format', 'csv')
+    if export_format not in export_formats:
+        abort(400)
+
+    # the export only changes with the dataset, so clients may keep it and revalidate it
+    etag = export_etag(frames.version, request.full_path)
+    if request.if_none_match.contains(etag):
+        return Response(status = 304, headers = {'ETag': f'"{etag}"'})
+
+    year_list = frames['years']['year']
+    try:
+        years = parse_years(request.args.get('years'), year_list.min(), year_list.max())
+    except ValueError:
+        abort(400)
+    countries = parse_list(request.args.get('countries')) + request.args.getlist('country')
+    index = frames['poverty_country_index' if request.args.get('aggregates') == '0' else 'poverty_index']
+    columns = id_columns + indicators
+    frame = index.table.frame(indicators, export_positions(index, years, countries))[columns]
+    if request.args.get('filter') or request.args.get('sort'):
+        frame = sort_frame(filter_frame(frame, request.args.get('filter')), decode_sort(request.args.getlist('sort')))
+
+    filename = 'export' if len(indicators) > 1 else re.sub(r'\W+', '_', indicators[0]).strip('_')
+    return Response(stream_with_context(export_chunks(export_format, frame, columns)),
+                    mimetype = export_formats[export_format],
+                    headers = {'Content-Disposition': f'attachment; filename="{filename}.{export_format}"',
+                               'ETag': f'"{etag}"',
+                               'Cache-Control': 'public, max-age=3600'})
+
+# answer a batch of queries of the poverty data as json, read-only
+# POST {"vintage": ..., "layout": "columnar" or "records", "queries": [{"indicators": [...], "countries": [...],
+# "years": "2000-2010" or [2000, 2010], "fields": [...], "dropna": true, "aggregates": true}, ...]}
+# or GET with a single query, e.g. /api/v1/series?indicator=Population, total&countries=GHA,TGO&years=2000-2010
+# every query gets a result, or an error when it is invalid or selects too many cells
+@server.route('/api/v1/series', methods = ['GET', 'POST'])
+def series_api():
+    if request.method == 'POST':
+        body = request.get_json(silent = True)
+        if not isinstance(body, dict) or not isinstance(body.get('queries'), list):
+            return api_error('the body must be a json object with a list of queries', 400)
+    else:
+        body = {'vintage': request.args.get('vintage'), 'layout': request.args.get('layout'), 'queries': [query_from_args(request.args)]}
+    layout = body.get('layout') or 'columnar'
+    if layout not in api_layouts:
+        return api_error(f'layout must be one of {", ".join(api_layouts)}', 400)
+    if len(body['queries']) > api_max_queries:
+        return api_error(f'a request holds at most {api_max_queries} queries', 413)
+    vintage = body.get('vintage')
+    if vintage and vintage not in datasets.vintages():
+        return api_error(f'unknown vintage {vintage}', 404)
+    frames = datasets.get(vintage)
+
+    # the answer only changes with the dataset and the request, so clients may keep it and revalidate it
+    etag = export_etag(frames.version, request.full_path + request.get_data(as_text = True))
+    if request.if_none_match.contains(etag):
+        return Response(status = 304, headers = {'ETag': f'"{etag}"'})
+
+    # wait for a free slot a short while, rather than queueing behind other large requests
+    if not api_slots.acquire(timeout = api_queue_seconds):
+        api_queries.inc(len(body['queries']), outcome = 'busy')
+        return api_error('too many requests to the API at once, retry later', 503, {'Retry-After': '1'})
+    try:
+        with stage('api:series'):
+            results = run_batch(frames, body['queries'], api_max_cells, api_max_request_cells, layout,
+                                lambda outcome: api_queries.inc(outcome = outcome))
+            answer = json.dumps({'vintage': vintage or datasets.active, 'version': frames.version, 'layout': layout,
+                                 'results': results}, separators = (',', ':'), allow_nan = False)
+    finally:
+        api_slots.release()
+    return Response(answer, mimetype = 'application/json', headers = {'ETag': f'"{etag}"', 'Cache-Control': 'public, max-age=3600'})
+
+# answer a request to the API with an error as json
+def api_error(message, status, headers = None):
+    return Response(json.dumps({'error': message}), status = status, mimetype = 'application/json', headers = headers)
+
+# create the gini chart of a year
+# the chart is drawn in the browser by giniYearChart (assets/clientside.js), this figure is the template it follows
+def gini_year_figure(frames, selected_year):
     if not selected_year:
         raise PreventUpdate
-    df = gini_df[gini_df["Year"].eq(selected_year)].sort_values(gini).dropna(subset = [gini])
+    df = frames['gini_index'].select({"Year": selected_year}).sort_values(gini).dropna(subset = [gini])
     countries = len(df["Country Name"])
     fig = px.bar(data_frame = df,
       x = gini,
@@ -614,14 +1095,21 @@ def plot_gini_chart_for_selected_year(selected_year):
     return fig
 # create second callback function
 @callback(Output('gini_country_barcharts', 'figure'),
-             Input('gini_country_dropdown', 'value'))
+             Input('gini_country_dropdown', 'value'),
+             Input('gini_country_overlays', 'value'),
+             State('vintage_dropdown', 'value'))
 
 
-def plot_gini_bar_chart_for_selected_countries(selected_countries):
+def plot_gini_bar_chart_for_selected_countries(selected_countries, overlays, vintage):
     # create of list of countries
     if not selected_countries:
         raise PreventUpdate
-    df = gini_df[gini_df["Country Name"].isin(selected_countries)].dropna(subset = [gini])
+    frames = datasets.get(vintage)
+    df = frames['gini_index'].select({"Country Name": selected_countries}).dropna(subset = [gini])
+    # show the notes on the surveys, when the vintage has them
+    note_texts = notes_hover(frames, gini, df['Country Code'], df['Year'])
+    if note_texts:
+        df = df.assign(Note = note_texts)
     fig = px.bar(data_frame = df,
       x = 'Year',
       y = gini,
@@ -630,21 +1118,37 @@ def plot_gini_bar_chart_for_selected_countries(selected_countries):
       labels = {gini: "Gini Index"},
       height = 100 + 250 * len(selected_countries),
       title = '<br>'.join([gini, ', '.join(selected_countries)]),
+      custom_data = ['Note'] if note_texts else None,
 
             )
     # # customize hover template to display the hover information in the desired format
     # fig.update_traces(hovertemplate = 'Country Name: %{customdata[0]}<br>GINI index: %{customdata[1]}',
     #               customdata = gini_df[["Country Name", gini]])
     # fig.layout.paper_bgcolor = '#2C3E50'
-
-    return fig
+    if note_texts:
+        add_notes_hover(fig)
+    if 'trend' in (overlays or []):
+        # plotly express makes a trace per facet, in the order the countries first appear
+        codes = df.drop_duplicates('Country Name').set_index('Country Name')['Country Code']
+        for country, bars in zip(df['Country Name'].unique(), list(fig.data)):
+            trace = trend_trace(frames, codes[country], country, gini, xaxis = bars.xaxis, yaxis = bars.yaxis,
+                                line = {'color': '#2C3E50', 'dash': 'dot'})
+            if trace is not None:
+                fig.add_trace(trace)
+
+    return send_figure(fig)
 
 @callback(Output('income_level_country_barchart', 'figure'),
-             Input('income_level_country', 'value'))
-def plot_income_share_per_country(country):
+             Input('income_level_country', 'value'),
+             State('vintage_dropdown', 'value'))
+def plot_income_share_per_country(country, vintage):
     if country is None:
         raise PreventUpdate
-    fig = px.bar(income_share_df_sorted[income_share_df_sorted["Country Name"] == country],
+    frames = datasets.get(vintage)
+    income_share_df_sorted = frames['income_share_df_sorted']
+    # select columns to be ploted
+    income_share_df_sorted_col = income_share_df_sorted.columns[:-2]
+    fig = px.bar(frames['income_share_index'].select({"Country Name": country}),
                  x = income_share_df_sorted_col,
                  y = "Year",
                  title = " - ".join(["Income Share Quintiles", country]),
@@ -661,14 +1165,18 @@ def plot_income_share_per_country(country):
     fig.layout.xaxis.title = "Percent of Total Income"
     # fig.layout.paper_bgcolor = '#2C3E50'
 
-    return fig
+    return send_figure(fig)
 
-@callback(Output('percentage_poverty__scatter_chart', 'figure'),
-             Input('percentage_poverty_year_slider', 'value'),
-             Input('poverty_indicator_slider', 'value'))
-def plot_poverty_and_year_chart(year, indicator):
-    indicator = poverty_gap_cols[indicator]
-    df = perc_pov_df[perc_pov_df['year'].eq(year)].dropna(subset = [indicator]).sort_values(indicator)
+# create the poverty gap chart of a year and a poverty line
+# the chart is drawn in the browser by povertyGapChart (assets/clientside.js), this figure is the template it follows
+def poverty_gap_figure(frames, year, indicator):
+    perc_pov_df = frames['perc_pov_df']
+    # pick the poverty gap at the level of the slider mark, which not every vintage reports
+    indicator = [col for col in perc_pov_df.filter(regex = 'Poverty gap').columns if poverty_gap_levels[indicator] in col]
+    if not indicator:
+        raise PreventUpdate
+    indicator = indicator[0]
+    df = frames['perc_pov_index'].select({'year': year}).dropna(subset = [indicator]).sort_values(indicator)
     # handle empty data
     if df.empty:
         raise PreventUpdate
@@ -688,92 +1196,275 @@ def plot_poverty_and_year_chart(year, indicator):
     fig.layout.xaxis.ticksuffix = '%'
     return fig
 
+# strip the data of a figure made by plotly express, keeping its trace and layout for the browser to fill in
+def figure_skeleton(fig):
+    figure = fig.to_plotly_json()
+    trace = {key: value for key, value in figure['data'][0].items() if key not in ('x', 'y', 'hovertext')}
+    trace['marker'] = {key: value for key, value in trace.get('marker', {}).items() if not isinstance(value, (list, np.ndarray))}
+    layout = {key: value for key, value in figure['layout'].items() if key not in ('template', 'title', 'height')}
+    return {'trace': trace, 'layout': layout}
+
+# split a column of country names into the distinct names and the position of every row among them
+def encode_countries(names):
+    countries, positions = np.unique(names.to_numpy(dtype = str), return_inverse = True)
+    return countries.tolist(), positions.tolist()
+
+# turn floats into a list where missing values are null
+def float_list(values):
+    return [None if np.isnan(value) else value for value in values.to_numpy(dtype = float).tolist()]
+
+# the gini index of every country and year as columns, sent once with the dashboard so that the chart of a
+# year is filtered, sorted and drawn in the browser
+@lru_cache(maxsize = 8)
+def gini_year_store(frames):
+    df = frames['gini_df'].dropna(subset = [gini])
+    countries, positions = encode_countries(df['Country Name'])
+    years = df['Year'].astype(int).to_numpy()
+    return {'country': countries,
+            'country_idx': positions,
+            'year': years.tolist(),
+            'value': float_list(df[gini]),
+            # the rows of the latest value of every country as of every year, for the years without a survey
+            'latest': latest_rows(positions, years, np.ones(len(df), dtype = bool), np.unique(years)),
+            # hover text of the notes on the surveys, or None when the vintage has none
+            'note': notes_hover(frames, gini, df['Country Code'], df['Year']),
+            'title': gini,
+            **figure_skeleton(gini_year_figure(frames, int(df['Year'].iloc[0])))}
+
+# the poverty gaps and populations of every country and year as columns, with the trace and layout of the chart per poverty line
+@lru_cache(maxsize = 8)
+def poverty_gap_store(frames):
+    df = frames['perc_pov_df']
+    gap_columns = df.filter(regex = 'Poverty gap').columns
+    countries, positions = encode_countries(df['Country Name'])
+    levels = []
+    for level in poverty_gap_levels:
+        column = next((col for col in gap_columns if level in col), None)
+        if column is None:
+            levels.append(None)
+            continue
+        sample = df.dropna(subset = [column])
+        levels.append({'column': column, 'value': float_list(df[column]),
+                       **figure_skeleton(poverty_gap_figure(frames, int(sample['year'].iloc[0]), poverty_gap_levels.index(level)))})
+    years = df['year'].astype(int).to_numpy()
+    return {'country': countries,
+            'country_idx': positions,
+            'year': years.tolist(),
+            'population': float_list(df['Population, total']),
+            # the rows of the latest poverty gaps of every country as of every year of the slider
+            'latest': latest_rows(positions, years, np.ones(len(df), dtype = bool), np.arange(years.min(), years.max() + 1)),
+            'levels': levels}
+
+# draw the gini chart of a year and the poverty gap chart in the browser, from the stores of the dashboard
+clientside_callback(ClientsideFunction(namespace = 'wdi', function_name = 'giniYearChart'),
+                    Output('gini_year_barcharts', 'figure'),
+                    Input('gini_year_dropdown', 'value'),
+                    Input('gini_year_fill', 'value'),
+                    State('gini_year_store', 'data'),
+                    State('figure_template', 'data'))
+
+clientside_callback(ClientsideFunction(namespace = 'wdi', function_name = 'povertyGapChart'),
+                    Output('percentage_poverty__scatter_chart', 'figure'),
+                    Input('percentage_poverty_year_slider', 'value'),
+                    Input('poverty_indicator_slider', 'value'),
+                    Input('poverty_gap_fill', 'value'),
+                    State('poverty_gap_store', 'data'),
+                    State('figure_template', 'data'))
+
+# compare the regions or the income groups on an indicator, read from the rollup cube of the vintage
+@callback(Output('region_comparison_chart', 'figure'),
+          Input('region_indicator_dropdown', 'value'),
+          Input('region_statistic_dropdown', 'value'),
+          Input('region_group_type', 'value'),
+          State('vintage_dropdown', 'value'))
+def plot_region_comparison(indicator, statistic, group_type, vintage):
+    if not indicator or statistic not in rollup_statistics or group_type not in group_columns:
+        raise PreventUpdate
+    frames = datasets.get(vintage)
+    return send_figure(region_comparison_figure(frames['rollup_cube'], indicator, statistic, group_type))
+
 """#### Country Dashboard"""
 
-country_dashboard = html.Div([
-    html.Br(),
-    html.H4(id = 'country_main_page'),
-    html.Br(),
-    dbc.Row([
-        dbc.Col(dcc.Graph(id = 'country_chart'))
-    ]),
-    html.Br(), html.Br(),
-    dbc.Row([
-        dbc.Col([
-            dbc.Label('Select indicator: '),
-            dcc.Dropdown(id = 'country_indicator_dropdown',
-                        placeholder = 'Choose an indicator',
-                        value = 'Population, total',
-                        options = [{'label': indicator, 'value': indicator} for indicator in indicator_list],
-                        style = {'color': 'black'}),
+@lru_cache(maxsize = 8)
+@stage('layout:country_dashboard')
+def country_dashboard(frames, vintages):
+    return html.Div([
+        html.Br(),
+        html.H4(id = 'country_main_page'),
+        html.Br(),
+        dbc.Row([
+            dbc.Col(dcc.Graph(id = 'country_chart'))
         ]),
-        dbc.Col([
-            dbc.Label("Select countries: "),
-            dcc.Dropdown(id = 'country_page_country_dropdown',
-                         placeholder = 'Select multiple countries to compare',
-                         multi = True,
-                         options = [{'label': country, 'value': country} for country in country_list],
-                         style = {'color': 'black'}),
-
+        dcc.Checklist(id = 'country_chart_overlays',
+                      value = [],
+                      inline = True,
+                      options = [{'label': ' Trend and forecast', 'value': 'trend'}],
+                      inputStyle = {'marginRight': '5px'}),
+        html.Br(), html.Br(),
+        dbc.Row([
+            dbc.Col([
+                dbc.Label('Select indicator: '),
+                dcc.Dropdown(id = 'country_indicator_dropdown',
+                            placeholder = 'Choose an indicator',
+                            value = 'Population, total',
+                            options = search_options(frames, 'indicators', selected = 'Population, total'),
+                            style = {'color': 'black'}),
+            ]),
+            dbc.Col([
+                dbc.Label("Select countries: "),
+                dcc.Dropdown(id = 'country_page_country_dropdown',
+                             placeholder = 'Select multiple countries to compare',
+                             multi = True,
+                             options = search_options(frames, 'countries'),
+                             style = {'color': 'black'}),
+
+            ]),
+            dbc.Col([
+                dbc.Label("Compare with edition: "),
+                dcc.Dropdown(id = 'country_compare_vintage',
+                             placeholder = 'Select an edition to compare',
+                             options = [{'label': vintage_label(vintage), 'value': vintage} for vintage in vintages],
+                             style = {'color': 'black'}),
+            ]),
         ]),
-    ]),
-    html.Br(), html.Br(),
-    html.Div(id = 'country_table')
-])
-
-"""#### Validation Layout"""
-
-app.validation_layout = html.Div([
-    main_layout,
-    indicators_dashboard,
-    country_dashboard
-])
+        html.Br(), html.Br(),
+        html.Div(id = 'country_table')
+    ])
 
 # set up app's layout
 app.layout = main_layout
 
 @callback(Output("main_content", "children"),
-         Input("location", "pathname"))
-def display_page(country_name):
+         Input("location", "pathname"),
+         Input("vintage_dropdown", "value"))
+def display_page(country_name, vintage):
+    frames = datasets.get(vintage)
     # deal with country names with spaces
-    if unquote(country_name[1:]) in country_list:
-        return country_dashboard
+    if unquote(country_name[1:]) in frames['country_list']:
+        return country_dashboard(frames, tuple(datasets.vintages()))
     else:
-        return indicators_dashboard
+        return indicators_dashboard(frames)
 
 @callback(Output('country_page_country_dropdown', 'value'),
-         Input('location', 'pathname'))
-def set_drop_down_countries(country_path):
-    if unquote(country_path[1:]) in country_list:
+         Output('country_page_country_dropdown', 'options', allow_duplicate = True),
+         Input('location', 'pathname'),
+         State('vintage_dropdown', 'value'),
+         prevent_initial_call = 'initial_duplicate')
+def set_drop_down_countries(country_path, vintage):
+    frames = datasets.get(vintage)
+    if unquote(country_path[1:]) in frames['country_list']:
         count = unquote(country_path[1:])
-        return [count]
+        # the dropdown only keeps the values listed in its options
+        return [count], search_options(frames, 'countries', selected = [count])
+    return None, no_update
+
+# open the dashboard of the country picked in the navigation bar
+@callback(Output('location', 'pathname'),
+          Input('country_search_dropdown', 'value'),
+          prevent_initial_call = True)
+def open_country_page(country):
+    if not country:
+        raise PreventUpdate
+    return '/' + country
+
+# fill the options of a searchable dropdown as the user types, and list the first ones again once the search is cleared
+def searchable_dropdown(dropdown_id, source):
+    def search(search_value, value, vintage):
+        return search_options(datasets.get(vintage), source, search_value, value)
+    # name the callback after its dropdown, for the metrics
+    search.__name__ = f'search_{dropdown_id}'
+    callback(Output(dropdown_id, 'options'),
+             Input(dropdown_id, 'search_value'),
+             State(dropdown_id, 'value'),
+             State('vintage_dropdown', 'value'),
+             prevent_initial_call = True)(search)
+
+for dropdown_id, source in [('country_search_dropdown', 'countries'),
+                            ('country_page_country_dropdown', 'countries'),
+                            ('indicator_dropdown', 'indicators'),
+                            ('indicator_histogram_dropdown', 'indicators'),
+                            ('region_indicator_dropdown', 'indicators'),
+                            ('country_indicator_dropdown', 'indicators'),
+                            ('gini_country_dropdown', 'gini_countries'),
+                            ('income_level_country', 'income_share_countries')]:
+    searchable_dropdown(dropdown_id, source)
 
 @callback(Output('country_main_page', 'children'),
           Output('country_chart', 'figure'),
           Output('country_table', 'children'),
           Input('location', 'pathname'),
           Input('country_page_country_dropdown', 'value'),
-          Input('country_indicator_dropdown', 'value')
+          Input('country_indicator_dropdown', 'value'),
+          Input('country_compare_vintage', 'value'),
+          Input('country_chart_overlays', 'value'),
+          State('vintage_dropdown', 'value')
          )
-def plot_country_graph(pathname, country_list, indicator):
+def plot_country_graph(pathname, country_list, indicator, compare_vintage, overlays, vintage):
     if (not country_list) or (not indicator):
         raise PreventUpdate
     if unquote(pathname[1:]) in country_list:
         count = unquote(pathname[1:])
-    df = poverty_indicator[poverty_indicator['is_country'] & poverty_indicator['Country Name'].isin(country_list)]
+    frames = datasets.get(vintage)
+    df = frames['poverty_country_index'].select({'Country Name': country_list}, [indicator])
+    codes = df.drop_duplicates('Country Name').set_index('Country Name')['Country Code']
+    note_texts = notes_hover(frames, indicator, df['Country Code'], df['year'])
+    compare = datasets.get(compare_vintage) if compare_vintage else None
+    line_dash = None
+    if compare is not None and compare is not frames and indicator in compare['indicator_list']:
+        # draw the other edition with dashed lines, to show the revisions between the two
+        other = compare['poverty_country_index'].select({'Country Name': country_list}, [indicator])
+        # every edition comes with its own notes
+        other_notes = notes_hover(compare, indicator, other['Country Code'], other['year'])
+        if note_texts or other_notes:
+            note_texts = (note_texts or [''] * len(df)) + (other_notes or [''] * len(other))
+        df = pd.concat([df[['Country Name', 'year', indicator]].assign(edition = vintage_label(vintage or datasets.active)),
+                        other[['Country Name', 'year', indicator]].assign(edition = vintage_label(compare_vintage))])
+        line_dash = 'edition'
+    if note_texts:
+        df = df.assign(Note = note_texts)
     fig = px.line(df,
                  x = 'year',
                  y = indicator,
                  title = '<b>' + indicator + '</b><br />' + ','.join(country_list),
-                 color = 'Country Name'
+                 color = 'Country Name',
+                 line_dash = line_dash,
+                 custom_data = ['Note'] if note_texts else None
                  )
+    if note_texts:
+        add_notes_hover(fig)
+    if 'trend' in (overlays or []):
+        # draw the trend of every country in the color of its line, from the trends fitted for the whole vintage
+        # the lines of the compared editions are grouped as "country, edition"
+        colors = {trace.legendgroup.rsplit(', ', 1)[0] if line_dash else trace.legendgroup: trace.line.color for trace in fig.data}
+        for country, code in codes.items():
+            trace = trend_trace(frames, code, country, indicator, line = {'color': colors.get(country), 'dash': 'dot'})
+            if trace is not None:
+                fig.add_trace(trace)
     fig.layout.paper_bgcolor = '#E5ECF6'
-    table = country[country['Short Name'] == country_list[0]].T.reset_index()
+    table = frames['country_index'].select({'Short Name': country_list[0]}).T.reset_index()
     if table.shape[1] == 2:
         table.columns = [country_list[0] + ' info', '']
         table = dbc.Table.from_dataframe(table)
     else:
         table = html.Div()
-    return count + ' Poverty Data', fig, table
+    return count + ' Poverty Data', send_figure(fig), table
+
+# build the figure cache at startup, e.g. under gunicorn --preload
+if os.environ.get('WDI_WARM_FIGURES') == '1':
+    warm_figure_cache()
+
+# write the time of every stage run so far, e.g. with WDI_WARM_FRAMES=all to time the whole data pipeline
+startup_profile = os.environ.get('WDI_STARTUP_PROFILE')
+if startup_profile:
+    write_startup_profile(startup_profile)
+
 if __name__ == '__main__':
-    app.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description = 'World Bank Development Indicators Dashboard')
+    parser.add_argument('--warm-figures', action = 'store_true',
+                        help = 'build the map chart of every indicator into the figure cache and exit')
+    args = parser.parse_args()
+    if args.warm_figures:
+        frames = warm_figure_cache()
+        print(f'{len(map_figure_cache)} map charts cached for dataset {frames.version}')
+    else:
+        app.run()
\ No newline at end of file
@@ -0,0 +1,103 @@
+
+// charts drawn in the browser from the columns of the dashboard stores (see gini_year_store and
+// poverty_gap_store in app.py) and the template of the page, so that moving a dropdown or a slider does not go back to the server
+
+// get the rows of a year whose value is not missing, sorted by that value
+// filled, the rows are those of the latest value of every country as of the year, listed by the store
+function sortedRows(store, values, year, fill) {
+    var rows = [];
+    if (fill && fill.length) {
+        rows = (store.latest[year] || []).filter(function (row) { return values[row] !== null; });
+    } else {
+        for (var row = 0; row < store.year.length; row++) {
+            if (store.year[row] === year && values[row] !== null) {
+                rows.push(row);
+            }
+        }
+    }
+    return rows.sort(function (a, b) { return values[a] - values[b]; });
+}
+
+// label the rows of earlier years shown for a year, like fill_labels in gap_fill.py
+function fillLabels(store, rows, year) {
+    return rows.map(function (row) {
+        return store.year[row] === year ? '' : '<br>Latest value, from ' + store.year[row];
+    });
+}
+
+// show the rows of earlier years fainter
+function fillOpacity(store, rows, year) {
+    return rows.map(function (row) { return store.year[row] === year ? 1 : 0.5; });
+}
+
+// pick the values of some rows of a column
+function pick(values, rows) {
+    return rows.map(function (row) { return values[row]; });
+}
+
+// pick the country names of some rows
+function pickCountries(store, rows) {
+    return rows.map(function (row) { return store.country[store.country_idx[row]]; });
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    wdi: {
+        // bar chart of the gini index of every country in a year, like gini_year_figure
+        giniYearChart: function (year, fill, store, template) {
+            if (!year || !store) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+            var rows = sortedRows(store, store.value, year, fill);
+            var trace = Object.assign({}, store.trace, {
+                x: pick(store.value, rows),
+                y: pickCountries(store, rows),
+                marker: Object.assign({}, store.trace.marker, {opacity: fillOpacity(store, rows, year)})
+            });
+            if (store.note || (fill && fill.length)) {
+                var notes = store.note ? pick(store.note, rows) : rows.map(function () { return ''; });
+                var labels = fillLabels(store, rows, year);
+                trace.customdata = notes.map(function (note, position) { return note + labels[position]; });
+                trace.hovertemplate = trace.hovertemplate.replace('<extra></extra>', '%{customdata}<extra></extra>');
+            }
+            var layout = Object.assign({}, store.layout, {
+                template: template,
+                title: {text: store.title + ' - ' + year},
+                height: 200 + 20 * rows.length
+            });
+            return {data: [trace], layout: layout};
+        },
+
+        // scatter chart of the poverty gap at a poverty line in a year, like poverty_gap_figure
+        povertyGapChart: function (year, level, fill, store, template) {
+            var line = store && store.levels[level];
+            if (!line) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+            var rows = sortedRows(store, line.value, year, fill);
+            if (rows.length === 0) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+            var countries = pickCountries(store, rows);
+            var trace = Object.assign({}, line.trace, {
+                x: pick(line.value, rows),
+                y: countries,
+                hovertext: countries,
+                marker: Object.assign({}, line.trace.marker, {
+                    color: pick(store.population, rows),
+                    size: rows.map(function () { return 30; }),
+                    opacity: fillOpacity(store, rows, year)
+                })
+            });
+            if (fill && fill.length) {
+                trace.customdata = fillLabels(store, rows, year);
+                trace.hovertemplate = trace.hovertemplate.replace('<extra></extra>', '%{customdata}<extra></extra>');
+            }
+            var layout = Object.assign({}, line.layout, {
+                template: template,
+                title: {text: line.column + '<b>: ' + year + '</b>'},
+                height: 500
+            });
+            return {data: [trace], layout: layout};
+        }
+    }
+});
@@ -0,0 +1,143 @@
+# imports
+
+# benchmarking
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+import numpy as np
+import pandas as pd
+import plotly
+import dash
+from plotly.io.json import to_json_plotly
+
+import app
+from povstats import gini
+
+# the callbacks of the dashboards with representative and worst-case inputs
+# every case is a callback, its arguments and an optional setup run untimed before every call
+def cases(frames, vintage):
+    year_list = frames['years']['year'].tolist()
+    # about the most countries the faceted gini chart can lay out with its default row spacing
+    gini_countries = frames['gini_df']['Country Name'].unique().tolist()[:30]
+    country_list = frames['country_list']
+    # the country with the most years of income shares
+    longest_history = frames['income_share_df_sorted']['Country Name'].value_counts().index[0]
+    # forget the cached map charts, to measure building one
+    clear_map_cache = lambda: app.map_figure_cache.entries.clear()
+    return {
+        'display_indicator_map_chart (cold)': (app.display_indicator_map_chart, [gini, 'animated', 'none', vintage], clear_map_cache),
+        'display_indicator_map_chart (cached)': (app.display_indicator_map_chart, [gini, 'animated', 'none', vintage], None),
+        'display_indicator_map_chart (latest values, cold)': (app.display_indicator_map_chart, [gini, 'animated', 'latest', vintage], clear_map_cache),
+        'display_indicator_map_chart (one year)': (app.display_indicator_map_chart, [gini, 'year', 'none', vintage], None),
+        'update_indicator_map_year': (app.update_indicator_map_year, [2010, gini, 'year', 'none', vintage], None),
+        'update_indicator_map_year (interpolated)': (app.update_indicator_map_year, [2010, gini, 'year', 'interpolate', vintage], None),
+        'display_histogram': (app.display_histogram, [gini, [2010, 2015], 10, vintage], None),
+        'display_histogram (all years)': (app.display_histogram, [gini, year_list, None, vintage], None),
+        'update_histogram_table': (app.update_histogram_table, [0, app.histogram_table_page_size, [], '', gini, [2015], vintage], None),
+        'update_histogram_table (all years, sorted)': (app.update_histogram_table,
+                                                       [0, app.histogram_table_page_size, [{'column_id': gini, 'direction': 'desc'}],
+                                                        '{year} >= 1990', gini, year_list, vintage], None),
+        # the gini chart of a year and the poverty gap chart are drawn in the browser, from stores sent once per page
+        'gini_year_store': (app.gini_year_store, [frames], app.gini_year_store.cache_clear),
+        'plot_gini_bar_chart_for_selected_countries': (app.plot_gini_bar_chart_for_selected_countries, [['Brazil', 'Ghana'], [], vintage], None),
+        'plot_gini_bar_chart_for_selected_countries (30 countries)': (app.plot_gini_bar_chart_for_selected_countries, [gini_countries, [], vintage], None),
+        'plot_gini_bar_chart_for_selected_countries (trends)': (app.plot_gini_bar_chart_for_selected_countries, [gini_countries, ['trend'], vintage], None),
+        'plot_income_share_per_country': (app.plot_income_share_per_country, ['Brazil', vintage], None),
+        'plot_income_share_per_country (longest history)': (app.plot_income_share_per_country, [longest_history, vintage], None),
+        'poverty_gap_store': (app.poverty_gap_store, [frames], app.poverty_gap_store.cache_clear),
+        'plot_region_comparison': (app.plot_region_comparison, [gini, 'weighted_mean', 'Region', vintage], None),
+        'search_options': (app.search_options, [frames, 'indicators', 'poverty gap', None], None),
+        'plot_country_graph': (app.plot_country_graph, ['/Ghana', ['Ghana', 'Togo'], 'Population, total', None, [], vintage], None),
+        'plot_country_graph (trends)': (app.plot_country_graph, ['/Ghana', ['Ghana', 'Togo'], 'Population, total', None, ['trend'], vintage], None),
+        'plot_country_graph (all countries)': (app.plot_country_graph, ['/Ghana', ['Ghana'] + [country for country in country_list if country != 'Ghana'],
+                                                                        'Population, total', None, [], vintage], None),
+    }
+
+# serialise the output of a callback the way dash sends it, and count its bytes
+def payload_bytes(output):
+    return len(to_json_plotly(output).encode())
+
+# time a callback, then trace the memory it allocates in a separate call so that tracing does not skew the timings
+def run_case(callback, args, setup, repeat, warmup = 1):
+    for _ in range(warmup):
+        setup and setup()
+        callback(*args)
+    timings = []
+    for _ in range(repeat):
+        setup and setup()
+        start = time.perf_counter()
+        output = callback(*args)
+        timings.append((time.perf_counter() - start) * 1e3)
+    setup and setup()
+    tracemalloc.start()
+    callback(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    timings = np.array(timings)
+    return {
+        'calls': repeat,
+        'mean_ms': round(float(timings.mean()), 3),
+        'min_ms': round(float(timings.min()), 3),
+        'p50_ms': round(float(np.percentile(timings, 50)), 3),
+        'p90_ms': round(float(np.percentile(timings, 90)), 3),
+        'p99_ms': round(float(np.percentile(timings, 99)), 3),
+        'max_ms': round(float(timings.max()), 3),
+        'peak_memory_bytes': int(peak),
+        'payload_bytes': payload_bytes(output),
+    }
+
+# run every case, or the ones whose name contains a filter
+def run(vintage = None, repeat = 20, only = None):
+    frames = app.datasets.get(vintage)
+    vintage = vintage or app.datasets.active
+    results = {}
+    for name, (callback, args, setup) in cases(frames, vintage).items():
+        if only and not any(text in name for text in only):
+            continue
+        results[name] = run_case(callback, args, setup, repeat)
+        print(f"{name:<62} p50 {results[name]['p50_ms']:>9.1f}ms  p99 {results[name]['p99_ms']:>9.1f}ms  "
+              f"peak {results[name]['peak_memory_bytes'] / 2 ** 20:>7.1f}MB  payload {results[name]['payload_bytes'] / 1024:>8.1f}kB",
+              file = sys.stderr)
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'vintage': vintage,
+        'dataset_version': frames.version,
+        'repeat': repeat,
+        'environment': {'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+                        'plotly': plotly.__version__, 'dash': dash.__version__},
+        'results': results,
+    }
+
+# print the change of every metric between two result files
+def compare(before, after, metrics = ('p50_ms', 'p99_ms', 'peak_memory_bytes', 'payload_bytes')):
+    print(f"{'case':<62} {'metric':<18} {'before':>12} {'after':>12} {'ratio':>7}")
+    for name, result in after['results'].items():
+        if name not in before['results']:
+            continue
+        for metric in metrics:
+            old, new = before['results'][name][metric], result[metric]
+            ratio = new / old if old else float('nan')
+            print(f"{name:<62} {metric:<18} {old:>12} {new:>12} {ratio:>6.2f}x")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark the dashboard callbacks: latency percentiles, peak memory and payload size')
+    parser.add_argument('--vintage', default = None, help = 'edition to benchmark, defaults to the active one')
+    parser.add_argument('--repeat', type = int, default = 20, help = 'timed calls per case')
+    parser.add_argument('--only', nargs = '*', help = 'only run the cases whose name contains one of these')
+    parser.add_argument('--output', default = None, help = 'file to write the results to as json, defaults to stdout')
+    parser.add_argument('--compare', nargs = 2, metavar = ('BEFORE', 'AFTER'), help = 'compare two result files instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as before, open(args.compare[1]) as after:
+            compare(json.load(before), json.load(after))
+    else:
+        results = json.dumps(run(args.vintage, args.repeat, args.only), indent = 2, sort_keys = True)
+        if args.output:
+            with open(args.output, 'w') as handle:
+                handle.write(results + '\n')
+        else:
+            print(results)
@@ -0,0 +1,60 @@
+
+# imports
+
+# benchmarking
+import timeit
+import argparse
+import pandas as pd
+
+from snapshot import load_frames
+
+# the row selections of the callbacks, as boolean masks over whole frames and as index lookups
+def selections(frames, year, years, countries):
+    gini_df = frames['gini_df']
+    ids = frames['poverty_table'].ids
+    perc_pov_df = frames['perc_pov_df']
+    income_share_df_sorted = frames['income_share_df_sorted']
+    country = frames['country']
+    return {
+        'display_histogram': (
+            lambda: ids[ids['year'].isin(years) & ids['is_country'].eq(True)],
+            lambda: frames['poverty_country_index'].select({'year': years})),
+        'plot_gini_chart_for_selected_year': (
+            lambda: gini_df[gini_df["Year"].eq(year)],
+            lambda: frames['gini_index'].select({"Year": year})),
+        'plot_gini_bar_chart_for_selected_countries': (
+            lambda: gini_df[gini_df["Country Name"].isin(countries)],
+            lambda: frames['gini_index'].select({"Country Name": countries})),
+        'plot_income_share_per_country': (
+            lambda: income_share_df_sorted[income_share_df_sorted["Country Name"] == countries[0]],
+            lambda: frames['income_share_index'].select({"Country Name": countries[0]})),
+        'plot_poverty_and_year_chart': (
+            lambda: perc_pov_df[perc_pov_df['year'].eq(year)],
+            lambda: frames['perc_pov_index'].select({'year': year})),
+        'plot_country_graph': (
+            lambda: ids[ids['is_country'].eq(True) & ids['Country Name'].isin(countries)],
+            lambda: frames['poverty_country_index'].select({'Country Name': countries})),
+        'plot_country_graph (table)': (
+            lambda: country[country['Short Name'] == countries[0]],
+            lambda: frames['country_index'].select({'Short Name': countries[0]})),
+    }
+
+# get the best time of a function, in microseconds
+def best_time(function, number):
+    return min(timeit.repeat(function, number = number, repeat = 5)) / number * 1e6
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Compare the row selections of the callbacks with and without indexes')
+    parser.add_argument('--data-dir', default = 'data_2020')
+    parser.add_argument('--number', type = int, default = 200)
+    args = parser.parse_args()
+
+    frames, version = load_frames(args.data_dir)
+    # build the indexes up front, so that only the lookups are timed
+    frames.materialise()
+
+    print(f"{'callback':<45} {'mask':>10} {'index':>10} {'speedup':>8}")
+    for name, (mask, index) in selections(frames, 2015, [2010, 2015], ['Brazil', 'Ghana', 'India']).items():
+        pd.testing.assert_frame_equal(mask(), index())
+        before, after = best_time(mask, args.number), best_time(index, args.number)
+        print(f"{name:<45} {before:>8.0f}us {after:>8.0f}us {before / after:>7.1f}x")
@@ -0,0 +1,175 @@
+# imports
+
+# data management
+import numpy as np
+import pandas as pd
+
+# rows of the data file read at a time
+chunk_rows = 5000
+
+# round float32 values back to the 7 significant digits they hold, e.g. 45.29999923706055 to 45.3
+def round_float32(values):
+    values = values.astype(np.float64)
+    magnitude = np.floor(np.log10(np.abs(np.where(values == 0, 1, values))))
+    scale = 10.0 ** (6 - magnitude)
+    return np.round(values * scale) / scale
+
+# the non-empty cells of the data file, as coordinates and values sorted by indicator, country and year
+# countries, years and indicators are coded as integers into the arrays of their names, and the values kept as
+# float32, except for the few that need more digits, such as the population totals, which are kept exactly aside
+class CoreStore:
+    def __init__(self, countries, country_codes, indicators, indicator_codes, years,
+                 country_idx, year_idx, indicator_idx, values):
+        self.countries = np.asarray(countries, dtype = object)
+        self.country_codes = np.asarray(country_codes, dtype = object)
+        self.indicators = np.asarray(indicators, dtype = object)
+        self.indicator_codes = np.asarray(indicator_codes, dtype = object)
+        self.years = np.asarray(years, dtype = np.int16)
+
+        order = np.lexsort((year_idx, country_idx, indicator_idx))
+        self.country_idx = np.ascontiguousarray(country_idx[order], dtype = np.int32)
+        self.year_idx = np.ascontiguousarray(year_idx[order], dtype = np.int16)
+        self.indicator_idx = np.ascontiguousarray(indicator_idx[order], dtype = np.int32)
+        values = values[order]
+        self.values = values.astype(np.float32)
+        # the cells float32 does not hold exactly, by position
+        inexact = np.flatnonzero(round_float32(self.values) != values)
+        self.exact_positions = inexact.astype(np.int64)
+        self.exact_values = values[inexact]
+        # start of the cells of every indicator
+        self.offsets = np.searchsorted(self.indicator_idx, np.arange(len(self.indicators) + 1))
+        self.indicator_positions = {name: position for position, name in enumerate(self.indicators)}
+
+    # names and arrays of the store, which are saved with the snapshot and read back without sorting the cells again
+    name_fields = ['countries', 'country_codes', 'indicators', 'indicator_codes']
+    array_fields = ['years', 'country_idx', 'year_idx', 'indicator_idx', 'values', 'exact_positions', 'exact_values', 'offsets']
+
+    # rebuild a store from its saved names and arrays, which may be memory-mapped
+    @classmethod
+    def from_arrays(cls, names, arrays):
+        core = cls.__new__(cls)
+        for field in cls.name_fields:
+            setattr(core, field, np.asarray(names[field], dtype = object))
+        for field in cls.array_fields:
+            setattr(core, field, arrays[field])
+        core.indicator_positions = {name: position for position, name in enumerate(core.indicators)}
+        return core
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in [self.country_idx, self.year_idx, self.indicator_idx, self.values,
+                                               self.exact_positions, self.exact_values, self.offsets])
+
+    # get the positions of the cells of an indicator
+    def indicator_slice(self, indicator):
+        position = self.indicator_positions[indicator]
+        return slice(self.offsets[position], self.offsets[position + 1])
+
+    # get the country and year codes and the float32 values of an indicator, as views of the store
+    def indicator(self, indicator):
+        cells = self.indicator_slice(indicator)
+        return self.country_idx[cells], self.year_idx[cells], self.values[cells]
+
+    # get the values of a range of cells as float64, with the digits of the data file
+    def exact(self, cells = slice(None)):
+        start, stop, _ = cells.indices(len(self))
+        values = round_float32(self.values[cells])
+        first, last = np.searchsorted(self.exact_positions, [start, stop])
+        values[self.exact_positions[first:last] - start] = self.exact_values[first:last]
+        return values
+
+# the rows of every country and year with data, sorted by country name, code and year, as a small frame of their ids
+# the values of an indicator are filled in from its cells in the store for the rows asked for only, so that a frame of
+# the table holds the indicators it shows rather than every indicator of the store
+class CoreTable:
+    def __init__(self, core):
+        self.core = core
+        # rank the countries by name and code, and key every cell by the rank of its country and its year
+        country_order = np.lexsort((core.country_codes.astype(str), core.countries.astype(str)))
+        self.country_rank = np.empty(len(core.countries), dtype = np.int64)
+        self.country_rank[country_order] = np.arange(len(core.countries))
+        self.keys = np.unique(self.cell_keys(slice(None)))
+        country = country_order[self.keys // len(core.years)]
+        self.ids = pd.DataFrame({'Country Name': core.countries[country],
+                                 'Country Code': core.country_codes[country],
+                                 'year': core.years[self.keys % len(core.years)].astype(np.int64)})
+        # the indicators with data, sorted by name
+        present = np.flatnonzero(np.diff(core.offsets) > 0)
+        self.indicators = pd.Index(sorted(core.indicators[present].tolist()))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def cell_keys(self, cells):
+        return self.country_rank[self.core.country_idx[cells]] * len(self.core.years) + self.core.year_idx[cells]
+
+    # get the values of an indicator for the rows at the given sorted positions, missing where it has no data
+    def column(self, indicator, positions = None):
+        keys = self.keys if positions is None else self.keys[positions]
+        column = np.full(len(keys), np.nan)
+        if indicator not in self.core.indicator_positions or not len(keys):
+            return column
+        cells = self.core.indicator_slice(indicator)
+        cell_keys = self.cell_keys(cells)
+        rows = np.minimum(np.searchsorted(keys, cell_keys), len(keys) - 1)
+        found = keys[rows] == cell_keys
+        column[rows[found]] = self.core.exact(cells)[found]
+        return column
+
+    # build the frame of the ids and the given indicators of the rows at the given sorted positions, labelled by position
+    def frame(self, indicators = (), positions = None):
+        ids = self.ids if positions is None else self.ids.iloc[positions]
+        columns = {name: ids[name].to_numpy() for name in ids.columns}
+        for indicator in indicators:
+            columns[indicator] = self.column(indicator, positions)
+        return pd.DataFrame(columns, index = ids.index)
+
+# read the data file in one pass, a chunk of rows at a time, keeping only its non-empty cells
+def read_core(path, aliases = None):
+    countries, indicators = {}, {}
+    country_names, indicator_codes = [], []
+    parts = []
+    years = None
+    for chunk in pd.read_csv(path, chunksize = chunk_rows):
+        if years is None:
+            year_columns = [column for column in chunk.columns if column.isdigit()]
+            years = [int(column) for column in year_columns]
+        values = chunk[year_columns].to_numpy(dtype = np.float64)
+        rows, year_idx = np.nonzero(~np.isnan(values))
+
+        # code the countries and indicators of the chunk, adding the new ones to those already seen
+        indicator_names = chunk['Indicator Name'].replace(aliases or {})
+        codes = []
+        for keys, seen, labels, seen_labels in [(chunk['Country Code'], countries, chunk['Country Name'], country_names),
+                                                (indicator_names, indicators, chunk['Indicator Code'], indicator_codes)]:
+            local, uniques = pd.factorize(keys)
+            first = pd.Series(labels.to_numpy()).groupby(local).first()
+            for position, key in enumerate(uniques):
+                if key not in seen:
+                    seen[key] = len(seen)
+                    seen_labels.append(first[position])
+            codes.append(np.array([seen[key] for key in uniques], dtype = np.int32)[local][rows])
+        parts.append((codes[0], year_idx, codes[1], values[rows, year_idx]))
+
+    country_idx, year_idx, indicator_idx, values = [np.concatenate(arrays) for arrays in zip(*parts)]
+    return CoreStore(country_names, list(countries), list(indicators), indicator_codes, years,
+                     country_idx, year_idx, indicator_idx, values)
+
+# read a table with one row per country and year and one column per indicator, such as an export of the dashboards,
+# into a store of its non-empty cells, leaving out the id columns and the other given columns
+def read_wide_core(path, other_columns = ()):
+    frame = pd.read_csv(path, low_memory = False).rename(columns = {'Year': 'year'})
+    skip = {'Country Name', 'Country Code', 'year', *other_columns}
+    indicators = [column for column in frame.columns if column not in skip and not column.startswith('Unnamed')]
+    values = frame[indicators].apply(pd.to_numeric, errors = 'coerce').to_numpy(dtype = np.float64)
+    rows, indicator_idx = np.nonzero(~np.isnan(values))
+    country_idx, country_codes = pd.factorize(frame['Country Code'])
+    countries = frame['Country Name'].groupby(country_idx).first()
+    years = np.unique(frame['year'])
+    year_idx = np.searchsorted(years, frame['year'])
+    # the table does not carry the codes of the indicators, which are named by themselves
+    return CoreStore(countries.to_numpy(), country_codes, indicators, indicators, years,
+                     country_idx[rows], year_idx[rows], indicator_idx, values[rows, indicator_idx])
@@ -0,0 +1,105 @@
+
+# imports
+
+# data management
+import os
+import re
+import time
+import threading
+
+from povstats import source_files
+from snapshot import changed_sources, load_frames, snapshot_root
+
+# directories holding a vintage of the PovStats csv files, e.g. data_2020
+vintage_pattern = re.compile(r'^data_\d{4}$')
+
+# list the vintages found in a directory, oldest first
+def discover_vintages(root = '.'):
+    return sorted(name for name in os.listdir(root)
+                  if vintage_pattern.match(name) and all(os.path.exists(os.path.join(root, name, file)) for file in source_files))
+
+# the loaded vintages of the dataset, one of which is active
+# a refresh picks up new vintages and modified files, and swaps the new frames in at once, so that a
+# request in flight keeps working with the frames it started with
+class DatasetManager:
+    def __init__(self, root = '.', active = None, snapshots = snapshot_root, shared = True, refresh_interval = 60):
+        self.root = root
+        # vintage kept active, otherwise the most recent one is
+        self.pinned = active
+        self.snapshots = snapshots
+        self.shared = shared
+        self.refresh_interval = refresh_interval
+        # loaded vintages and the active one, replaced together by a single assignment
+        self.current = ({}, None)
+        self.checked = 0
+        self.lock = threading.Lock()
+        # functions called with the loaded vintages and the active one whenever they change, e.g. to drop caches
+        self.listeners = []
+        self.refresh()
+
+    # tell the listeners about the vintages now loaded
+    def notify(self):
+        for listener in self.listeners:
+            listener(*self.current)
+
+    # load the frames of a vintage, reusing the frames of an earlier load that the changed files do not affect
+    def load(self, vintage, previous = None, changed = ()):
+        data_dir = os.path.join(self.root, vintage)
+        frames = load_frames(data_dir, os.path.join(self.snapshots, vintage), self.shared)[0]
+        if previous is not None:
+            frames.carry_over(previous, changed)
+        return frames
+
+    # reload the vintages whose files changed, and swap them in together with the active vintage
+    def refresh(self):
+        with self.lock:
+            datasets = {}
+            for vintage in discover_vintages(self.root):
+                previous = self.current[0].get(vintage)
+                if previous is None:
+                    datasets[vintage] = self.load(vintage)
+                    continue
+                changed = changed_sources(previous.sources, os.path.join(self.root, vintage))
+                datasets[vintage] = self.load(vintage, previous, changed) if changed else previous
+            if not datasets:
+                raise FileNotFoundError(f'no PovStats vintage found in {os.path.abspath(self.root)}')
+            active = self.pinned if self.pinned in datasets else list(datasets)[-1]
+            swapped = (datasets, active) != self.current
+            self.current = (datasets, active)
+            self.checked = time.monotonic()
+        if swapped:
+            self.notify()
+        return self
+
+    # refresh at most once per interval, leaving it to another thread when one is already at it
+    def maybe_refresh(self):
+        if self.refresh_interval <= 0 or time.monotonic() - self.checked < self.refresh_interval:
+            return
+        if self.lock.locked():
+            return
+        self.checked = time.monotonic()
+        self.refresh()
+
+    # get the frames of a vintage, or of the active vintage when none or an unknown one is given
+    def get(self, vintage = None):
+        self.maybe_refresh()
+        datasets, active = self.current
+        return datasets[vintage] if vintage in datasets else datasets[active]
+
+    def vintages(self):
+        return list(self.current[0])
+
+    @property
+    def active(self):
+        return self.current[1]
+
+    # switch the active vintage, e.g. to roll back to an earlier edition
+    def activate(self, vintage):
+        with self.lock:
+            datasets = self.current[0]
+            if vintage not in datasets:
+                raise KeyError(vintage)
+            self.pinned = vintage
+            self.current = (datasets, vintage)
+        self.notify()
+        return datasets[vintage]
@@ -0,0 +1,127 @@
+
+# imports
+
+# data management
+import io
+import hashlib
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from urllib.parse import urlencode, quote
+
+from table_query import encode_sort
+
+# columns identifying every exported row
+id_columns = ['Country Name', 'Country Code', 'year']
+
+# media types of the export formats
+export_formats = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+
+# check a range of years, and clip it to the years of the data between first and last when they are given
+# a reversed range, or one with no year of the data, raises a ValueError
+def clip_years(start, end, first = None, last = None):
+    if end < start:
+        raise ValueError(f'the range of years {start}-{end} is reversed')
+    if first is not None and last is not None:
+        if end < first or start > last:
+            raise ValueError(f'the years {start}-{end} are outside those of the data, {first}-{last}')
+        start, end = max(start, first), min(end, last)
+    return start, end
+
+# read a comma separated list of years from a query string, where ranges like 2000-2010 are allowed
+# the ranges are clipped to the years of the data between first and last before they are expanded
+def parse_years(text, first = None, last = None):
+    years = []
+    for item in (text or '').split(','):
+        start, _, end = item.strip().partition('-')
+        if start:
+            start, end = clip_years(int(start), int(end or start), first, last)
+            years.extend(range(start, end + 1))
+    return years
+
+# read a comma separated list from a query string
+def parse_list(text):
+    return [item.strip() for item in (text or '').split(',') if item.strip()]
+
+# get the positions of the rows of an export, in the order of the indexed frame
+def export_positions(index, years = None, countries = None):
+    criteria = {}
+    if years:
+        criteria['year'] = years
+    positions = index.find(criteria)
+    if countries:
+        # countries are given by code or by name
+        by_code = index.rows('Country Code', countries)
+        by_name = index.rows('Country Name', countries)
+        positions = positions[np.isin(positions, np.union1d(by_code, by_name))]
+    return positions
+
+# stream rows of a frame as csv, a chunk of rows at a time, so that the response is never held in memory as a whole
+def csv_chunks(frame, columns = None, positions = None, chunk_rows = 5000):
+    columns = columns or frame.columns.tolist()
+    positions = np.arange(len(frame)) if positions is None else positions
+    yield frame.iloc[:0][columns].to_csv(index = False)
+    for start in range(0, len(positions), chunk_rows):
+        yield frame.iloc[positions[start: start + chunk_rows]][columns].to_csv(index = False, header = False)
+
+# file-like object collecting what the parquet writer produces, until it is handed to the response
+class ChunkSink(io.RawIOBase):
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+# stream rows of a frame as parquet, writing one row group per chunk of rows
+def parquet_chunks(frame, columns = None, positions = None, chunk_rows = 50000):
+    columns = columns or frame.columns.tolist()
+    positions = np.arange(len(frame)) if positions is None else positions
+    sink = ChunkSink()
+    writer = None
+    schema = None
+    for start in range(0, len(positions), chunk_rows):
+        table = pa.Table.from_pandas(frame.iloc[positions[start: start + chunk_rows]][columns], preserve_index = False)
+        if writer is None:
+            schema = table.schema
+            writer = pq.ParquetWriter(sink, schema)
+        writer.write_table(table.cast(schema))
+        yield sink.drain()
+    if writer is None:
+        writer = pq.ParquetWriter(sink, pa.Table.from_pandas(frame.iloc[:0][columns], preserve_index = False).schema)
+    writer.close()
+    yield sink.drain()
+
+# get the generator streaming an export in a format
+def export_chunks(export_format, frame, columns = None, positions = None):
+    if export_format == 'parquet':
+        return parquet_chunks(frame, columns, positions)
+    return csv_chunks(frame, columns, positions)
+
+# create a validator of an export, which only changes with the dataset and the request
+def export_etag(dataset_version, full_path):
+    return hashlib.sha256(f'{dataset_version} {full_path}'.encode()).hexdigest()[:32]
+
+# create the link to the csv export of an indicator, with the filter and sorting of a table
+def export_url(indicator, years, filter_query = None, sort_by = None, vintage = None):
+    # the table only lists countries, so the aggregates are left out of its export
+    params = {'years': ','.join(str(year) for year in years or []), 'aggregates': '0'}
+    if filter_query:
+        params['filter'] = filter_query
+    if vintage:
+        params['vintage'] = vintage
+    query = urlencode(params) + ''.join('&' + urlencode({'sort': item}) for item in encode_sort(sort_by))
+    return f"/export/{quote(indicator, safe = '')}?{query}"
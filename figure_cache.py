@@ -0,0 +1,151 @@
+
+# imports
+
+# cache management
+import os
+import json
+import time
+import hashlib
+import shutil
+import threading
+from collections import OrderedDict
+from plotly.io import to_json
+
+# least recently used cache of serialised figures, with an optional directory as a second tier
+# entries older than max_age seconds, when given, are treated as missing
+# every entry may carry a tag, such as the version of the data it was built from, and the entries of the tags
+# no longer in use are dropped with retain; the directory holds one subdirectory per tag, and is kept under
+# max_disk_bytes by deleting its oldest files
+class FigureCache:
+    def __init__(self, max_entries = 64, cache_dir = None, max_age = None, max_disk_bytes = 256 << 20):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.max_disk_bytes = max_disk_bytes
+        # key -> (time stored, tag, serialised figure)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # bytes written to the directory since it was last pruned, None until it was measured
+        self.disk_bytes = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok = True)
+
+    # get the file of an entry in the disk tier
+    def path(self, key, tag = None):
+        digest = hashlib.sha256(json.dumps(key).encode()).hexdigest()[:24]
+        return os.path.join(self.cache_dir, str(tag or 'untagged'), f'{digest}.json')
+
+    def fresh(self, stored):
+        return self.max_age is None or time.time() - stored < self.max_age
+
+    # get the serialised figure of a key, or None when it is not cached
+    def get(self, key, tag = None):
+        with self.lock:
+            if key in self.entries:
+                stored, _, value = self.entries[key]
+                if self.fresh(stored):
+                    self.entries.move_to_end(key)
+                    return value
+                del self.entries[key]
+        if not self.cache_dir:
+            return None
+        try:
+            path = self.path(key, tag)
+            stored = os.path.getmtime(path)
+            if not self.fresh(stored):
+                os.remove(path)
+                return None
+            with open(path) as handle:
+                value = handle.read()
+        except OSError:
+            return None
+        self.remember(key, value, tag, stored)
+        return value
+
+    # keep a serialised figure in memory, dropping the least recently used ones beyond the bound
+    def remember(self, key, value, tag = None, stored = None):
+        with self.lock:
+            self.entries[key] = (time.time() if stored is None else stored, tag, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last = False)
+
+    def put(self, key, value, tag = None):
+        self.remember(key, value, tag)
+        if self.cache_dir:
+            # write to a temporary file first, so that other workers never read a partial figure
+            # the directory of the tag may be dropped by another worker meanwhile, which leaves the figure in memory only
+            path = self.path(key, tag)
+            tmp_path = f'{path}.tmp-{os.getpid()}'
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok = True)
+                with open(tmp_path, 'w') as handle:
+                    handle.write(value)
+                os.replace(tmp_path, path)
+            except OSError:
+                return
+            self.grew(len(value))
+
+    # list the files of the directory, as (modification time, size, path)
+    def disk_files(self):
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    # count bytes written to the directory, and prune it once they may take it over its bound
+    def grew(self, size):
+        with self.lock:
+            if self.disk_bytes is None:
+                self.disk_bytes = sum(file_size for _, file_size, _ in self.disk_files())
+            self.disk_bytes += size
+            if self.max_disk_bytes is None or self.disk_bytes <= self.max_disk_bytes:
+                return
+        self.prune()
+
+    # delete the expired files of the directory, then the oldest ones until it holds at most 3/4 of its bound
+    def prune(self):
+        files = sorted(self.disk_files())
+        total = sum(file_size for _, file_size, _ in files)
+        for stored, file_size, path in files:
+            if self.fresh(stored) and total <= self.max_disk_bytes * 3 // 4:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= file_size
+        with self.lock:
+            self.disk_bytes = total
+
+    # drop the entries of the tags not in use any more, e.g. of the vintages swapped out, in memory and on disk
+    def retain(self, tags):
+        tags = {str(tag) for tag in tags}
+        with self.lock:
+            for key in [key for key, (_, tag, _) in self.entries.items() if tag is not None and str(tag) not in tags]:
+                del self.entries[key]
+        if not self.cache_dir:
+            return
+        for name in os.listdir(self.cache_dir):
+            if name != 'untagged' and name not in tags:
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors = True)
+        with self.lock:
+            self.disk_bytes = None
+
+    # get the figure of a key, building and caching it on a miss
+    # the figure is returned as a plain dict, which dash serialises without going through plotly again
+    def figure(self, key, build, tag = None):
+        value = self.get(key, tag)
+        if value is None:
+            value = to_json(build(), validate = False)
+            self.put(key, value, tag)
+        return json.loads(value)
+
+    def __len__(self):
+        return len(self.entries)
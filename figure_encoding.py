@@ -0,0 +1,94 @@
+
+# imports
+
+# figure encoding
+import json
+import base64
+import numpy as np
+
+# integer types of the plotly.js typed arrays, smallest first
+integer_dtypes = [np.int8, np.uint8, np.int16, np.uint16, np.int32, np.uint32]
+
+# largest relative error accepted when storing floats as float32, about the 6 significant digits hover labels show
+float32_tolerance = 1e-6
+
+# arrays shorter than this are left as lists, so that small settings such as the domain of a trace are never encoded
+min_length = 16
+
+# pick the smallest typed array dtype that holds the values of an array exactly, or within the float32 tolerance
+def compact_dtype(values, tolerance = float32_tolerance):
+    finite = values[np.isfinite(values)] if values.dtype.kind == 'f' else values
+    if len(finite) == len(values) and np.array_equal(finite, np.round(finite)):
+        for dtype in integer_dtypes:
+            info = np.iinfo(dtype)
+            if len(finite) == 0 or (finite.min() >= info.min and finite.max() <= info.max):
+                return dtype
+    if len(finite) and np.abs(finite).max() > np.finfo(np.float32).max:
+        return np.float64
+    downcast = values.astype(np.float32).astype(np.float64)
+    if np.allclose(downcast, values, rtol = tolerance, atol = 0, equal_nan = True):
+        return np.float32
+    return np.float64
+
+# encode an array of numbers the way plotly.js reads typed arrays, {dtype, bdata}, or return None for other arrays
+# and for arrays whose json is shorter anyway, such as short decimals or mostly missing values
+def encode_array(value, tolerance = float32_tolerance):
+    if isinstance(value, (list, tuple)):
+        if len(value) < min_length or not all(isinstance(item, (int, float)) and not isinstance(item, bool) for item in value):
+            return None
+        value = np.asarray(value, dtype = float)
+    if not isinstance(value, np.ndarray) or value.dtype.kind not in 'iuf' or value.ndim != 1 or len(value) < min_length:
+        return None
+    values = value.astype(np.float64)
+    dtype = compact_dtype(values, tolerance)
+    # plotly.js reads the bytes as little-endian
+    dtype = np.dtype(dtype).newbyteorder('<')
+    bdata = base64.b64encode(values.astype(dtype).tobytes()).decode()
+    if len(bdata) + len('{"dtype": "f4", "bdata": ""}') >= len(json.dumps(value.tolist())):
+        return None
+    return {'dtype': dtype.str[1:], 'bdata': bdata}
+
+# encode the numeric arrays of a trace, including nested ones such as marker.color
+def encode_trace(trace, tolerance = float32_tolerance):
+    encoded = {}
+    for key, value in trace.items():
+        if isinstance(value, dict):
+            encoded[key] = encode_trace(value, tolerance)
+            continue
+        array = encode_array(value, tolerance)
+        encoded[key] = value if array is None else array
+    return encoded
+
+# compare two trace attributes, which can be numpy arrays
+def same_value(a, b):
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return isinstance(a, (np.ndarray, list, tuple)) and isinstance(b, (np.ndarray, list, tuple)) and \
+            len(a) == len(b) and bool(np.all(np.asarray(a, dtype = object) == np.asarray(b, dtype = object)))
+    return a == b
+
+# drop the attributes that every frame of an animation repeats from the traces of the figure, such as the
+# country codes and names of every year of the map chart
+# plotly.js merges the traces of a frame into the traces on screen, so these keep the values of the figure
+def dedupe_frames(data, frames):
+    if not frames or any(len(frame.get('data', [])) != len(data) for frame in frames):
+        return frames
+    frames = [dict(frame, data = [dict(trace) for trace in frame['data']]) for frame in frames]
+    for position, trace in enumerate(data):
+        for key, value in trace.items():
+            if key == 'type':
+                continue
+            if all(key in frame['data'][position] and same_value(frame['data'][position][key], value) for frame in frames):
+                for frame in frames:
+                    del frame['data'][position][key]
+    return frames
+
+# turn a figure into a plain dict that is cheaper to send: numeric arrays as base64 typed arrays, downcast
+# to float32 or small integers where the values allow, and animation frames without the arrays they repeat
+def compact_figure(fig, tolerance = float32_tolerance):
+    figure = fig if isinstance(fig, dict) else fig.to_plotly_json()
+    data = figure.get('data', [])
+    compact = dict(figure, data = [encode_trace(trace, tolerance) for trace in data])
+    if figure.get('frames'):
+        compact['frames'] = [dict(frame, data = [encode_trace(trace, tolerance) for trace in frame.get('data', [])])
+                             for frame in dedupe_frames(data, figure['frames'])]
+    return compact
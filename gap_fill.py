@@ -0,0 +1,136 @@
+# imports
+
+# data management
+import numpy as np
+
+from povstats import derived
+
+# how a value of the filled data was found, missing being 0
+observed, carried, interpolated = 1, 2, 3
+
+# ways of filling the years without data: not at all, with the latest value so far, or by interpolating linearly
+# between the surrounding values, then with the latest value after the last one
+fill_modes = ['none', 'latest', 'interpolate']
+
+# get the position of the last valid entry at or before every position of the last axis, -1 before the first one
+def last_valid(valid):
+    positions = np.where(valid, np.arange(valid.shape[-1]), -1)
+    return np.maximum.accumulate(positions, axis = -1)
+
+# the values of every cell of the core store, keyed by indicator, country and year in the order of the store, so that
+# the cells of every indicator and country follow each other by year; the cells with data before and after a year are
+# then found by a binary search of its key within those of its indicator and country, and the latest value as of the
+# year, or the value interpolated between two surveys, is read from them
+class LatestValues:
+    def __init__(self, core):
+        self.country_codes = core.country_codes
+        self.indicators = core.indicators
+        self.years = core.years.astype(np.int64)
+        self.keys = (core.indicator_idx.astype(np.int64) * len(core.country_codes) + core.country_idx) * len(core.years) + core.year_idx
+        self.values = core.exact()
+        self.index()
+
+    # names and arrays of the filled values, which are saved with the snapshot so that the workers map them
+    name_fields = ['country_codes', 'indicators']
+    array_fields = ['years', 'keys', 'values']
+
+    # rebuild the filled values from their saved names and arrays, which may be memory-mapped
+    @classmethod
+    def from_arrays(cls, names, arrays):
+        latest = cls.__new__(cls)
+        for field in cls.name_fields:
+            setattr(latest, field, np.asarray(names[field], dtype = object))
+        for field in cls.array_fields:
+            setattr(latest, field, arrays[field])
+        latest.index()
+        return latest
+
+    # map the country codes and the indicators to their positions in the keys
+    def index(self):
+        self.country_positions = {code: position for position, code in enumerate(self.country_codes)}
+        self.indicator_positions = {name: position for position, name in enumerate(self.indicators)}
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.values.nbytes
+
+    # get the years of cells
+    def cell_years(self, cells):
+        return self.years[self.keys[cells] % len(self.years)]
+
+    # get the values of an indicator for pairs of country codes and years, filled in one of the fill modes
+    # with how every value was found and the years of the values it comes from, -1 where there are none
+    def lookup(self, indicator, country_codes, years, mode = 'latest'):
+        country_codes, years = np.asarray(country_codes, dtype = object), np.asarray(years, dtype = np.int64)
+        values = np.full(len(years), np.nan)
+        flags = np.zeros(len(years), dtype = np.int8)
+        source_years = np.full((len(years), 2), -1)
+        position = self.indicator_positions.get(indicator)
+        country = np.array([self.country_positions.get(code, -1) for code in country_codes], dtype = np.int64)
+        year = np.searchsorted(self.years, years)
+        known = (country >= 0) & (year < len(self.years))
+        known[known] &= self.years[year[known]] == years[known]
+        if position is None or not known.any() or not len(self.keys):
+            return values, flags, source_years
+
+        # the first key of the indicator and country of every pair, and the first cell at or after its year
+        first = (position * len(self.country_codes) + country[known]) * len(self.years)
+        keys = first + year[known]
+        cells = np.searchsorted(self.keys, keys)
+        after = np.minimum(cells, len(self.keys) - 1)
+        has_after = (cells < len(self.keys)) & (self.keys[after] < first + len(self.years))
+        found_observed = has_after & (self.keys[after] == keys)
+        # the last cell at or before the year
+        before = np.where(found_observed, cells, cells - 1)
+        has_before = before >= 0
+        has_before[has_before] &= self.keys[before[has_before]] >= first[has_before]
+
+        found = np.full(len(keys), np.nan)
+        found[found_observed] = self.values[cells[found_observed]]
+        found_flags = np.where(found_observed, observed, 0).astype(np.int8)
+        found_sources = np.full((len(keys), 2), -1)
+        found_sources[found_observed, 0] = years[known][found_observed]
+        if mode in ('latest', 'interpolate'):
+            later = ~found_observed & has_before
+            found[later] = self.values[before[later]]
+            found_flags[later] = carried
+            found_sources[later, 0] = self.cell_years(before[later])
+        if mode == 'interpolate':
+            # years between two years with data take the value on the line between them
+            between = (found_flags == carried) & has_after
+            start, end = before[between], after[between]
+            start_years, end_years = self.cell_years(start), self.cell_years(end)
+            weight = (years[known][between] - start_years) / (end_years - start_years)
+            first_values, last_values = self.values[start], self.values[end]
+            found[between] = first_values + weight * (last_values - first_values)
+            found_flags[between] = interpolated
+            found_sources[between] = np.column_stack([start_years, end_years])
+        values[known], flags[known], source_years[known] = found, found_flags, found_sources
+        return values, flags, source_years
+
+# describe how the filled values were found, for the hover labels, empty for the observed and missing ones
+def fill_labels(flags, source_years):
+    labels = np.full(len(flags), '', dtype = object)
+    for position in np.flatnonzero(flags == carried):
+        labels[position] = f'<br>Latest value, from {source_years[position, 0]}'
+    for position in np.flatnonzero(flags == interpolated):
+        labels[position] = f'<br>Interpolated between {source_years[position, 0]} and {source_years[position, 1]}'
+    return labels.tolist()
+
+# get, for every year of a grid, the rows of a table holding the latest row of every country as of that year
+# the rows are given by the position of their country and their year, and the rows without a value are skipped
+def latest_rows(country_idx, years, valid, year_grid):
+    country_idx, years = np.asarray(country_idx), np.asarray(years)
+    year_grid = np.asarray(year_grid)
+    rows = np.flatnonzero(np.asarray(valid) & np.isin(years, year_grid))
+    table = np.full((country_idx.max() + 1 if len(country_idx) else 0, len(year_grid)), -1)
+    table[country_idx[rows], np.searchsorted(year_grid, years[rows])] = rows
+    latest = last_valid(table >= 0)
+    found = np.take_along_axis(table, np.maximum(latest, 0), axis = 1)
+    found[latest < 0] = -1
+    return {int(year): found[:, position][found[:, position] >= 0].tolist() for position, year in enumerate(year_grid)
+            if (found[:, position] >= 0).any()}
+
+@derived('core')
+def latest_values(core):
+    return LatestValues(core)
@@ -0,0 +1,126 @@
+# imports
+
+# data management
+import os
+import csv
+import argparse
+import numpy as np
+import pandas as pd
+
+from povstats import source_files
+
+# write a frame in the layout of the PovStats files: every field quoted, and a trailing comma on every line
+def write_csv(frame, path, append = False):
+    frame.to_csv(path, mode = 'a' if append else 'w', header = not append, index = False,
+                 quoting = csv.QUOTE_ALL, float_format = '%.17g', lineterminator = ',\n', encoding = 'utf-8' if append else 'utf-8-sig')
+
+# read a template file without its trailing empty column
+def read_template(path):
+    frame = pd.read_csv(path, dtype = str, keep_default_na = False)
+    return frame.drop(columns = frame.filter(regex = '^Unnamed').columns)
+
+# split a scale into a number of copies of the indicators and of the economies, whose product is the scale
+# indicators are multiplied first, by the largest divisor of the scale up to about the size of the full WDI,
+# then the economies by the rest
+def split_scale(scale, indicator_count, max_indicators = 1500):
+    limit = max(min(scale, max_indicators // indicator_count), 1)
+    indicator_copies = max(copies for copies in range(1, limit + 1) if scale % copies == 0)
+    return indicator_copies, scale // indicator_copies
+
+# name and code of the copy of an indicator or an economy, the first copy keeping the original
+def copy_name(name, copy, label):
+    return name if copy == 0 else f'{name} ({label} {copy})'
+
+def copy_code(code, copy):
+    return code if copy == 0 else f'{code}.{copy}'
+
+# generate the series file, with every indicator repeated once per indicator copy
+def generate_series(series, indicator_copies):
+    copies = []
+    for copy in range(indicator_copies):
+        block = series.copy()
+        block['Series Code'] = [copy_code(code, copy) for code in series['Series Code']]
+        block['Indicator Name'] = [copy_name(name, copy, 'synthetic') for name in series['Indicator Name']]
+        copies.append(block)
+    return pd.concat(copies, ignore_index = True)
+
+# generate the country file, with every economy repeated once per economy copy as a subnational unit
+# aggregates such as regions and income groups are only kept once
+def generate_countries(country, economy_copies):
+    economies = country[country['Region'] != '']
+    copies = [country]
+    for copy in range(1, economy_copies):
+        block = economies.copy()
+        block['Country Code'] = [copy_code(code, copy) for code in economies['Country Code']]
+        for column in ['Short Name', 'Table Name', 'Long Name']:
+            block[column] = [copy_name(name, copy, 'unit') for name in economies[column]]
+        copies.append(block)
+    return pd.concat(copies, ignore_index = True)
+
+# generate the data file one block at a time, so that large scales are never held in memory
+# every block repeats the rows of the template with their pattern of missing years, and values
+# scaled by a random factor per row plus a little noise per year
+def generate_data(data, country, out_path, indicator_copies, economy_copies, extra_missing = 0.0, seed = 0):
+    rng = np.random.default_rng(seed)
+    year_columns = [column for column in data.columns if column.isdigit()]
+    values = data[year_columns].apply(pd.to_numeric).to_numpy(dtype = float)
+    aggregates = set(country.loc[country['Region'] == '', 'Country Code'])
+    economy_rows = ~data['Country Code'].isin(aggregates).to_numpy()
+
+    rows = 0
+    for economy_copy in range(economy_copies):
+        # the aggregates are only written with the original economies
+        keep = np.ones(len(data), dtype = bool) if economy_copy == 0 else economy_rows
+        for indicator_copy in range(indicator_copies):
+            block = data.loc[keep, ['Country Name', 'Country Code', 'Indicator Name', 'Indicator Code']].copy()
+            if economy_copy:
+                block['Country Name'] = [copy_name(name, economy_copy, 'unit') for name in block['Country Name']]
+                block['Country Code'] = [copy_code(code, economy_copy) for code in block['Country Code']]
+            if indicator_copy:
+                block['Indicator Name'] = [copy_name(name, indicator_copy, 'synthetic') for name in block['Indicator Name']]
+                block['Indicator Code'] = [copy_code(code, indicator_copy) for code in block['Indicator Code']]
+            block_values = values[keep]
+            if economy_copy or indicator_copy:
+                factors = rng.lognormal(0, 0.2, size = (len(block_values), 1))
+                block_values = block_values * factors * rng.normal(1, 0.02, size = block_values.shape)
+            if extra_missing:
+                block_values = np.where(rng.random(block_values.shape) < extra_missing, np.nan, block_values)
+            block = pd.concat([block.reset_index(drop = True), pd.DataFrame(block_values, columns = year_columns)], axis = 1)
+            write_csv(block, out_path, append = rows > 0)
+            rows += len(block)
+    return rows
+
+# generate a vintage at a multiple of the rows of a template vintage
+def generate(template_dir = 'data_2020', out_dir = None, scale = 10, indicator_copies = None, extra_missing = 0.0, seed = 0):
+    # keep the name of the template vintage, so that the app can load the output with WDI_DATA_ROOT
+    out_dir = out_dir or os.path.join('synthetic', f'scale_{scale}x', os.path.basename(os.path.normpath(template_dir)))
+    os.makedirs(out_dir, exist_ok = True)
+    data, country, series = [read_template(os.path.join(template_dir, name)) for name in source_files]
+
+    if indicator_copies is None:
+        indicator_copies, economy_copies = split_scale(scale, data['Indicator Code'].nunique())
+    elif indicator_copies < 1 or scale % indicator_copies:
+        raise ValueError(f'the copies of the indicators, {indicator_copies}, must divide the scale, {scale}')
+    else:
+        economy_copies = scale // indicator_copies
+
+    write_csv(generate_series(series, indicator_copies), os.path.join(out_dir, 'PovStatsSeries.csv'))
+    write_csv(generate_countries(country, economy_copies), os.path.join(out_dir, 'PovStatsCountry.csv'))
+    rows = generate_data(data, country, os.path.join(out_dir, 'PovStatsData.csv'), indicator_copies, economy_copies, extra_missing, seed)
+    return {'out_dir': out_dir, 'rows': rows, 'indicator_copies': indicator_copies, 'economy_copies': economy_copies}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Generate a synthetic PovStats vintage at a multiple of the size of a real one')
+    parser.add_argument('--template-dir', default = 'data_2020', help = 'vintage whose schema, indicators, economies and sparsity are copied')
+    parser.add_argument('--out-dir', default = None, help = 'output directory, defaults to synthetic/scale_<scale>x/<template vintage>')
+    parser.add_argument('--scale', type = int, default = 10, help = 'multiple of the rows of the template, e.g. 10, 100 or 1000')
+    parser.add_argument('--indicator-copies', type = int, default = None,
+                        help = 'copies of every indicator, a divisor of the scale, the rest of it is made of copies of the economies')
+    parser.add_argument('--extra-missing', type = float, default = 0.0,
+                        help = 'share of the observed values to blank out, for data sparser than the template')
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+
+    result = generate(args.template_dir, args.out_dir, args.scale, args.indicator_copies, args.extra_missing, args.seed)
+    print(f"{result['rows']} rows written to {result['out_dir']} "
+          f"({result['indicator_copies']} copies of the indicators, {result['economy_copies']} of the economies)")
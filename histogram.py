@@ -0,0 +1,113 @@
+
+# imports
+
+# data management
+import math
+import threading
+import numpy as np
+
+# data visualization
+from plotly import express as px
+import plotly.graph_objects as go
+
+from povstats import derived
+
+# sorted values of every (indicator, year), binned on the server so that only the bar heights are sent
+# the values are read from an index of a core table (see povstats.py), one indicator at a time
+class HistogramBins:
+    def __init__(self, index, year_column = 'year'):
+        self.index = index
+        self.year_column = year_column
+        self.values = {}
+        self.edges_cache = {}
+        self.lock = threading.Lock()
+
+    # get the sorted values of an indicator, split by year
+    def sorted_values(self, indicator):
+        if indicator not in self.values:
+            values = self.index.column(indicator).to_numpy(dtype = float)
+            years = self.index.column(self.year_column).to_numpy()
+            keep = ~np.isnan(values)
+            values, years = values[keep], years[keep]
+            # sort by year, then by value, and cut the result at every change of year
+            order = np.lexsort((values, years))
+            values, years = values[order], years[order]
+            unique_years, starts = np.unique(years, return_index = True)
+            with self.lock:
+                self.values[indicator] = dict(zip(unique_years.tolist(), np.split(values, starts[1:])))
+        return self.values[indicator]
+
+    # get the bin edges of an indicator, shared by all years so that the facets can be compared
+    def edges(self, indicator, bins = None):
+        key = (indicator, bins)
+        if key not in self.edges_cache:
+            per_year = self.sorted_values(indicator)
+            values = np.concatenate(list(per_year.values())) if per_year else np.empty(0)
+            edges = np.histogram_bin_edges(values, bins = bins or 'auto')
+            with self.lock:
+                self.edges_cache[key] = edges
+        return self.edges_cache[key]
+
+    # count the values of a year in every bin, with the last bin closed like numpy.histogram
+    def counts(self, indicator, year, bins = None):
+        edges = self.edges(indicator, bins)
+        values = self.sorted_values(indicator).get(year, np.empty(0))
+        positions = np.searchsorted(values, edges, side = 'left')
+        positions[-1] = np.searchsorted(values, edges[-1], side = 'right')
+        return edges, np.diff(positions)
+
+# get the domains of the cells of a grid, from the top left, as fractions of the plotting area
+def grid_domains(rows, columns, horizontal_spacing = 0.02, vertical_spacing = 0.07):
+    width = (1 - horizontal_spacing * (columns - 1)) / columns
+    height = (1 - vertical_spacing * (rows - 1)) / rows
+    domains = []
+    for row in range(rows):
+        top = 1 - row * (height + vertical_spacing)
+        for column in range(columns):
+            left = column * (width + horizontal_spacing)
+            # clip the rounding errors of the last row and column, plotly rejects domains outside [0, 1]
+            domains.append(([max(left, 0), min(left + width, 1)], [max(top - height, 0), min(top, 1)]))
+    return domains
+
+# create a faceted histogram with one bar trace per year, wrapping the facets after a number of columns
+# the grid is laid out directly rather than through make_subplots, which dominates the cost for many years
+# progress, if given, is called with the number of facets done and the number of facets after each one
+def binned_histogram(bins_engine, indicator, years, bins = None, facet_col_wrap = 4, height = 700, title = None, progress = None):
+    available = bins_engine.sorted_values(indicator)
+    years = sorted(year for year in dict.fromkeys(years) if year in available)
+    columns = min(facet_col_wrap, max(len(years), 1))
+    rows = max(math.ceil(len(years) / columns), 1)
+    domains = grid_domains(rows, columns, vertical_spacing = min(0.07, 0.5 / rows))
+    colors = px.colors.qualitative.Plotly
+
+    traces = []
+    layout = {'height': height, 'title': title, 'bargap': 0, 'legend': {'title': {'text': 'year'}}, 'annotations': []}
+    for position, year in enumerate(years):
+        edges, counts = bins_engine.counts(indicator, year, bins)
+        axis = '' if position == 0 else str(position + 1)
+        traces.append(go.Bar(x = (edges[:-1] + edges[1:]) / 2,
+                             y = counts,
+                             # the bins share one width, so it is sent once rather than per bar
+                             width = float(edges[1] - edges[0]),
+                             hovertemplate = f'year={year}<br>{indicator}=%{{x}}<br>count=%{{y}}<extra></extra>',
+                             name = str(year),
+                             legendgroup = str(year),
+                             marker_color = colors[position % len(colors)],
+                             xaxis = f'x{axis}',
+                             yaxis = f'y{axis}'))
+        x_domain, y_domain = domains[position]
+        # share the axes of all facets, and only label the outer ones
+        layout[f'xaxis{axis}'] = {'domain': x_domain, 'anchor': f'y{axis}', 'matches': 'x' if axis else None,
+                                  'showticklabels': position + columns >= len(years)}
+        layout[f'yaxis{axis}'] = {'domain': y_domain, 'anchor': f'x{axis}', 'matches': 'y' if axis else None,
+                                  'showticklabels': position % columns == 0}
+        layout['annotations'].append({'text': f'year={year}', 'x': sum(x_domain) / 2, 'y': y_domain[1],
+                                      'xref': 'paper', 'yref': 'paper', 'xanchor': 'center', 'yanchor': 'bottom',
+                                      'showarrow': False})
+        if progress is not None:
+            progress(position + 1, len(years))
+    return go.Figure(data = traces, layout = layout)
+
+@derived('poverty_country_index')
+def histogram_bins(poverty_country_index):
+    return HistogramBins(poverty_country_index)
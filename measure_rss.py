@@ -0,0 +1,88 @@
+
+# imports
+
+# process management
+import os
+import sys
+import time
+import socket
+import argparse
+import subprocess
+from urllib.request import urlopen
+
+# read the memory counters of a process, in megabytes
+def memory_usage(pid):
+    usage = {}
+    with open(f'/proc/{pid}/smaps_rollup') as handle:
+        for line in handle:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                usage[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    # unique set size: the memory that would be freed if the process exited
+    usage['Uss'] = usage.get('Private_Clean', 0) + usage.get('Private_Dirty', 0)
+    return usage
+
+# get the worker processes of the gunicorn master
+def worker_pids(master_pid):
+    with open(f'/proc/{master_pid}/task/{master_pid}/children') as handle:
+        return [int(pid) for pid in handle.read().split()]
+
+# get a free port to bind gunicorn to
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+# wait until the memory of every worker has stopped growing, i.e. it is done building its frames
+def wait_settled(master_pid, workers, deadline, interval = 1.0, tolerance = 0.01):
+    last = None
+    while time.time() < deadline:
+        pids = worker_pids(master_pid)
+        total = sum(memory_usage(pid)['Rss'] for pid in pids) if len(pids) == workers else None
+        if total is not None and last is not None and abs(total - last) <= tolerance * last:
+            return
+        last = total
+        time.sleep(interval)
+
+# start gunicorn with a number of workers and measure every worker once all of them hold every frame
+# the frames are lazy, so they are all built at startup with WDI_WARM_FRAMES=all: once in the master when the app is
+# preloaded, whose workers are forked with them, and otherwise once in every worker
+def measure(workers, shared, preload = False, settle = 2, timeout = 300):
+    port = free_port()
+    env = dict(os.environ, WDI_SHARED_MEMORY = '1' if shared else '0', WDI_WARM_FRAMES = 'all')
+    command = [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}', '--timeout', str(timeout)]
+    master = subprocess.Popen(command + (['--preload'] if preload else []) + ['app:server'],
+                              env = env, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    try:
+        deadline = time.time() + timeout
+        # wait until the app is served and every worker is up
+        while time.time() < deadline:
+            try:
+                urlopen(f'http://127.0.0.1:{port}/', timeout = 5).read()
+                if len(worker_pids(master.pid)) == workers:
+                    break
+            except OSError:
+                pass
+            time.sleep(0.5)
+        wait_settled(master.pid, workers, deadline)
+        time.sleep(settle)
+        return [memory_usage(pid) for pid in worker_pids(master.pid)], memory_usage(master.pid)
+    finally:
+        master.terminate()
+        master.wait()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Measure per-worker memory of the app under gunicorn, with every frame built')
+    parser.add_argument('--workers', type = int, nargs = '+', default = [1, 2, 4, 8])
+    args = parser.parse_args()
+
+    # the total counts the master too, which holds the frames built before the workers were forked
+    print(f"{'mode':<8} {'preload':>7} {'workers':>7} {'rss/worker':>11} {'pss/worker':>11} {'uss/worker':>11} {'pss total':>10}")
+    for shared in (False, True):
+        for preload in (False, True):
+            for workers in args.workers:
+                usage, master = measure(workers, shared, preload)
+                mean = lambda key: sum(item[key] for item in usage) / len(usage)
+                total = sum(item['Pss'] for item in usage) + master['Pss']
+                print(f"{'mmap' if shared else 'private':<8} {'yes' if preload else 'no':>7} {workers:>7} "
+                      f"{mean('Rss'):>9.1f}MB {mean('Pss'):>9.1f}MB {mean('Uss'):>9.1f}MB {total:>8.1f}MB", flush = True)
@@ -0,0 +1,177 @@
+
+# imports
+
+# instrumentation
+import json
+import time
+import threading
+from functools import wraps
+from contextlib import ContextDecorator
+
+# upper bounds of the latency buckets, in seconds
+latency_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# upper bounds of the response size buckets, in bytes
+size_buckets = [1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 5e6]
+
+# format the labels of a sample in the prometheus text format
+def format_labels(labels, extra = None):
+    items = list(labels) + list(extra or [])
+    if not items:
+        return ''
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in items]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+# a metric with one series of values per combination of labels
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, label_names = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple((name, labels[name]) for name in self.label_names)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            for labels, value in sorted(self.series.items()):
+                lines.extend(self.samples(labels, value))
+        return lines
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def samples(self, labels, value):
+        return [f'{self.name}{format_labels(labels)} {value}']
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, label_names = (), buckets = latency_buckets):
+        super().__init__(name, help_text, label_names)
+        self.buckets = list(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total, count = self.series.get(key, ([0] * len(self.buckets), 0.0, 0))
+            counts = [bucket_count + (value <= bound) for bucket_count, bound in zip(counts, self.buckets)]
+            self.series[key] = (counts, total + value, count + 1)
+
+    def samples(self, labels, value):
+        counts, total, count = value
+        lines = [f'{self.name}_bucket{format_labels(labels, [("le", bound)])} {bucket_count}'
+                 for bound, bucket_count in zip(self.buckets, counts)]
+        lines.append(f'{self.name}_bucket{format_labels(labels, [("le", "+Inf")])} {count}')
+        lines.append(f'{self.name}_sum{format_labels(labels)} {total}')
+        lines.append(f'{self.name}_count{format_labels(labels)} {count}')
+        return lines
+
+# metrics of the callbacks
+callback_seconds = Histogram('wdi_callback_seconds', 'Wall time of a callback, building its figures and tables', ['callback'])
+callback_serialise_seconds = Histogram('wdi_callback_serialise_seconds',
+                                       'Time of a callback request outside the callback, mostly serialising its output to json', ['callback'])
+callback_response_bytes = Histogram('wdi_callback_response_bytes', 'Size of the response of a callback request', ['callback'], size_buckets)
+callback_rows = Counter('wdi_callback_rows_total', 'Rows selected from the indexed frames by a callback', ['callback'])
+callback_calls = Counter('wdi_callback_calls_total', 'Calls of a callback by outcome', ['callback', 'outcome'])
+api_queries = Counter('wdi_api_queries_total', 'Queries of the series API by outcome', ['outcome'])
+response_cache_requests = Counter('wdi_response_cache_requests_total', 'Callback requests looked up in the response cache by outcome', ['outcome'])
+
+# metrics of the stages of building the data and the layouts
+stage_seconds = Histogram('wdi_stage_seconds', 'Time spent in a stage of loading the data or building a layout', ['stage'])
+
+registry = [callback_seconds, callback_serialise_seconds, callback_response_bytes, callback_rows, callback_calls, api_queries,
+            response_cache_requests, stage_seconds]
+
+# number of runs and total time of every stage, for the startup profile
+stage_totals = {}
+stage_lock = threading.Lock()
+
+# the callback running on a thread, to which the rows selected on that thread are counted
+current = threading.local()
+
+# time a stage, as a context manager or as a decorator
+class stage(ContextDecorator):
+    def __init__(self, name):
+        self.name = name
+
+    # a decorated function times every call with a fresh timer, so that concurrent calls do not share one
+    def _recreate_cm(self):
+        return stage(self.name)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        stage_seconds.observe(elapsed, stage = self.name)
+        with stage_lock:
+            calls, total = stage_totals.get(self.name, (0, 0.0))
+            stage_totals[self.name] = (calls + 1, total + elapsed)
+        return False
+
+# count rows selected by the callback running on this thread
+def record_rows(count):
+    name = getattr(current, 'callback', None)
+    if name is not None:
+        callback_rows.inc(count, callback = name)
+
+# wrap a callback to record its wall time, the rows it selects and how it ended
+def instrument(function, on_done = None):
+    name = function.__name__
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        current.callback = name
+        start = time.perf_counter()
+        outcome = 'ok'
+        try:
+            return function(*args, **kwargs)
+        except Exception as error:
+            # PreventUpdate is how callbacks decline to update, not a failure
+            outcome = 'prevented' if type(error).__name__ == 'PreventUpdate' else 'error'
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            current.callback = None
+            callback_seconds.observe(elapsed, callback = name)
+            callback_calls.inc(callback = name, outcome = outcome)
+            if on_done is not None:
+                on_done(name, elapsed)
+    return wrapper
+
+# create a drop-in replacement of dash.callback that instruments every callback it registers
+def instrumented_callback(dash_callback, on_done = None):
+    def callback(*args, **kwargs):
+        register = dash_callback(*args, **kwargs)
+        return lambda function: register(instrument(function, on_done))
+    return callback
+
+# render every metric in the prometheus text format
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+# get the stages timed so far, slowest first
+def startup_profile():
+    with stage_lock:
+        stages = [{'stage': name, 'calls': calls, 'seconds': round(total, 6)} for name, (calls, total) in stage_totals.items()]
+    return sorted(stages, key = lambda item: item['seconds'], reverse = True)
+
+# write the stages timed so far as a json report
+def write_startup_profile(path):
+    with open(path, 'w') as handle:
+        json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'stages': startup_profile()}, handle, indent = 2)
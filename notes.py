@@ -0,0 +1,127 @@
+# imports
+
+# data management
+import os
+import csv
+import sqlite3
+import hashlib
+import textwrap
+import threading
+
+from povstats import derived, notes_files
+
+# directory of the notes databases, one per content of the notes files so that vintages and workers share them
+notes_root = os.path.join('cache', 'notes')
+
+# year of the notes on a country and an indicator as a whole, from PovStatsCountry-Series.csv
+all_years = 0
+
+# countries looked up by a query at a time, keeping its parameters under the limit of older SQLite builds
+query_countries = 500
+
+# read the rows of a notes file as (indicator code, country code, year, note)
+def read_notes(path):
+    with open(path, newline = '', encoding = 'utf-8-sig') as handle:
+        reader = csv.DictReader(handle)
+        for row in reader:
+            note = (row.get('DESCRIPTION') or '').strip()
+            if not note:
+                continue
+            # the footnotes name their year like YR2007
+            year = row.get('Year')
+            yield row['SeriesCode'], row['CountryCode'], int(year[2:]) if year else all_years, note
+
+# build the database of the notes files of a vintage, unless it already exists, and get its path
+# the table is keyed by indicator, country and year without a separate rowid, so that the key is the only index
+# and a lookup reads the note from the same b-tree page
+def build_notes(data_dir, root = notes_root):
+    paths = [os.path.join(data_dir, name) for name in notes_files if os.path.exists(os.path.join(data_dir, name))]
+    if not paths:
+        return None
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as handle:
+            for chunk in iter(lambda: handle.read(1 << 20), b''):
+                digest.update(chunk)
+    path = os.path.join(root, f'notes-{digest.hexdigest()[:16]}.sqlite')
+    if os.path.exists(path):
+        return path
+
+    # write into a temporary file first, so that other workers never open a partial database
+    os.makedirs(root, exist_ok = True)
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    connection = sqlite3.connect(tmp_path)
+    try:
+        connection.execute('CREATE TABLE notes (series TEXT NOT NULL, country TEXT NOT NULL, year INTEGER NOT NULL, '
+                           'note TEXT NOT NULL, PRIMARY KEY (series, country, year)) WITHOUT ROWID')
+        for notes_path in paths:
+            connection.executemany('INSERT OR REPLACE INTO notes VALUES (?, ?, ?, ?)', read_notes(notes_path))
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(tmp_path, path)
+    return path
+
+# notes on the data of a vintage, looked up in a database built on the first lookup
+# every thread opens its own read-only connection, and the workers share the database through the page cache
+class NotesStore:
+    def __init__(self, data_dir, root = None):
+        self.data_dir = data_dir
+        self.root = root or notes_root
+        self.path = None
+        self.built = False
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def connection(self):
+        if not self.built:
+            with self.lock:
+                if not self.built:
+                    self.path = build_notes(self.data_dir, self.root)
+                    self.built = True
+        if self.path is None:
+            return None
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = sqlite3.connect(f'file:{self.path}?mode=ro', uri = True)
+        return connection
+
+    # check whether an indicator has any notes, from the first entry of its key range
+    def has_notes(self, indicator_code):
+        connection = self.connection()
+        if connection is None:
+            return False
+        return connection.execute('SELECT 1 FROM notes WHERE series = ? LIMIT 1', (indicator_code,)).fetchone() is not None
+
+    # get the notes on an indicator for some countries and years, and on those countries for all years, by country and year
+    # the countries and years of a chart are looked up at once, rather than one point at a time
+    def lookup(self, indicator_code, country_codes, years):
+        connection = self.connection()
+        if connection is None:
+            return {}
+        countries = list(dict.fromkeys(country_codes))
+        years = sorted({int(year) for year in years} | {all_years})
+        notes = {}
+        for start in range(0, len(countries), query_countries):
+            chunk = countries[start: start + query_countries]
+            rows = connection.execute(f'SELECT country, year, note FROM notes WHERE series = ? '
+                                      f'AND country IN ({", ".join("?" * len(chunk))}) AND year IN ({", ".join("?" * len(years))})',
+                                      [indicator_code, *chunk, *years])
+            notes.update(((country, year), note) for country, year, note in rows)
+        return notes
+
+    # get the notes of points of a chart as hover text, empty for the points without notes
+    def hover_text(self, indicator_code, country_codes, years, width = 60):
+        notes = self.lookup(indicator_code, country_codes, years)
+        if not notes:
+            return [''] * len(country_codes)
+        texts = []
+        for country_code, year in zip(country_codes, years):
+            found = [note for note in [notes.get((country_code, int(year))), notes.get((country_code, all_years))] if note]
+            texts.append(''.join('<br>' + '<br>'.join(textwrap.wrap(note, width)) for note in found))
+        return texts
+
+@derived('data_dir', sources = notes_files)
+def notes(data_dir):
+    return NotesStore(data_dir)
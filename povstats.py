@@ -0,0 +1,337 @@
+
+# imports
+
+# data management
+import os
+import re
+import threading
+import numpy as np
+import pandas as pd
+from unicodedata import lookup
+
+from metrics import record_rows, stage
+from core_store import CoreTable, read_core, read_wide_core
+
+# get information on Gini coefficient
+gini = 'Gini index (World Bank estimate)'
+
+# indicators renamed between vintages, mapped to their current names so that editions can be compared
+indicator_aliases = {'GINI index (World Bank estimate)': gini}
+
+# source files the derived frames are built from
+source_files = ['PovStatsData.csv', 'PovStatsCountry.csv', 'PovStatsSeries.csv']
+
+# optional files of notes on the data, read by notes.py
+notes_files = ['PovStatsFootNote.csv', 'PovStatsCountry-Series.csv']
+
+# every frame of the dataset, mapped to the frames it depends on and the function building it
+derived_frames = {}
+
+# source files read directly by the builder of a frame
+frame_sources = {}
+
+# frames every registry provides itself rather than builds, and never takes over from an earlier load
+pseudo_frames = ['data_dir', 'sources']
+
+# register a function as the builder of the frame it is named after
+def derived(*dependencies, sources = ()):
+    def register(build):
+        derived_frames[build.__name__] = (dependencies, build)
+        frame_sources[build.__name__] = set(sources)
+        return build
+    return register
+
+# get the source files a frame is built from, directly or through the frames it depends on
+def source_dependencies(name):
+    if name not in derived_frames:
+        return set()
+    sources = set(frame_sources.get(name, ()))
+    for dependency in derived_frames[name][0]:
+        sources |= source_dependencies(dependency)
+    return sources
+
+# registry of frames that are only materialised, once, the first time they are needed
+class LazyFrames:
+    def __init__(self, data_dir, builders = None):
+        self.data_dir = data_dir
+        # the vintage directory and the fingerprint of its source files are available to builders like any other frame
+        self.builders = {'data_dir': ((), lambda: data_dir), 'sources': ((), lambda: self.sources), **(builders or {})}
+        self.built = {}
+        self.lock = threading.RLock()
+        # version and fingerprint of the source files the frames are built from, set by the loader
+        self.version = None
+        self.sources = {}
+
+    # get the builder of a frame, looking up frames registered by other modules at call time
+    def builder(self, name):
+        return self.builders[name] if name in self.builders else derived_frames[name]
+
+    def __getitem__(self, name):
+        if name not in self.built:
+            with self.lock:
+                if name not in self.built:
+                    dependencies, build = self.builder(name)
+                    arguments = [self[dependency] for dependency in dependencies]
+                    # time the frame on its own, its dependencies are timed as stages of their own
+                    with stage(f'frame:{name}'):
+                        self.built[name] = build(*arguments)
+        return self.built[name]
+
+    def __contains__(self, name):
+        return name in self.builders or name in derived_frames
+
+    def keys(self):
+        return [name for name in {**derived_frames, **self.builders} if name not in pseudo_frames]
+
+    # build frames ahead of time, e.g. in the gunicorn master before the workers are forked
+    def materialise(self, names = None):
+        for name in names or self.keys():
+            self[name]
+        return self
+
+    # take over the frames already built by the registry of an earlier load of the vintage
+    # whose source files are not among the changed ones, so that only the affected frames are rebuilt
+    def carry_over(self, previous, changed_sources):
+        with self.lock:
+            for name, frame in list(previous.built.items()):
+                if name not in self.built and name not in pseudo_frames and not source_dependencies(name) & set(changed_sources):
+                    self.built[name] = frame
+        return self
+
+# positional index of a frame, mapping every value of the indexed columns to the rows holding it
+# selections are answered by slicing those rows instead of scanning whole columns with a mask
+# the index may cover only some rows of the frame, given by their sorted positions, which are then the only ones found
+# while the rows selected are still slices of the frame itself rather than of a copy of those rows
+class FrameIndex:
+    def __init__(self, frame, columns, positions = None):
+        self.frame = frame
+        self.all_positions = np.arange(len(frame)) if positions is None else np.asarray(positions, dtype = np.intp)
+        self.positions = {column: self.column_positions(column, positions) for column in columns}
+
+    # map every value of a column to the positions of its rows, among the covered ones
+    def column_positions(self, column, positions = None):
+        if positions is None:
+            return self.frame.groupby(column, sort = False).indices
+        values = pd.Series(self.frame[column].to_numpy()[self.all_positions])
+        return {value: self.all_positions[rows] for value, rows in values.groupby(values, sort = False).indices.items()}
+
+    # get the sorted positions of the rows holding any of the values of a column
+    def rows(self, column, values):
+        lookup = self.positions[column]
+        found = [lookup[value] for value in dict.fromkeys(values) if value in lookup]
+        if not found:
+            return np.empty(0, dtype = np.intp)
+        if len(found) == 1:
+            return found[0]
+        return np.sort(np.concatenate(found))
+
+    # get the sorted positions of the rows matching every criterion, given as a value or a list of values per column
+    def find(self, criteria):
+        positions = self.all_positions
+        for position, (column, values) in enumerate(criteria.items()):
+            if not isinstance(values, (list, tuple, set, np.ndarray)):
+                values = [values]
+            rows = self.rows(column, values)
+            positions = rows if position == 0 else np.intersect1d(positions, rows, assume_unique = True)
+        record_rows(len(positions))
+        return positions
+
+    # select the rows matching every criterion
+    def select(self, criteria):
+        return self.frame.iloc[self.find(criteria)]
+
+# index of the rows of a core table (see core_store.py), over the small frame of their ids
+# the rows selected are built with the indicators asked for only
+class TableIndex(FrameIndex):
+    def __init__(self, table, columns, positions = None):
+        super().__init__(table.ids, columns, positions)
+        self.table = table
+
+    # get an id or an indicator of every row covered
+    def column(self, name):
+        if name in self.frame.columns:
+            return self.frame[name].iloc[self.all_positions]
+        return pd.Series(self.table.column(name, self.all_positions), index = self.frame.index[self.all_positions], name = name)
+
+    # select the rows matching every criterion, with the given indicators
+    def select(self, criteria, indicators = ()):
+        return self.table.frame(indicators, self.find(criteria))
+
+# create function for country flags
+def country_flag(alpha_code, country_code_list):
+    # handle the situation where the provided letters are either NaN or not part of the country code list
+    if pd.isna(alpha_code) or (alpha_code.lower() not in country_code_list):
+        return ''
+    # create emoji if alpha code is part of country code list
+    code_a = lookup(f'REGIONAL INDICATOR SYMBOL LETTER {alpha_code[0]}')
+    code_b = lookup(f'REGIONAL INDICATOR SYMBOL LETTER {alpha_code[1]}')
+    # concatenate alpha codes
+    return code_a + code_b
+
+# the non-empty cells of the data file, read in one pass (see core_store.py)
+@derived('data_dir', sources = ['PovStatsData.csv'])
+def core(data_dir):
+    return read_core(os.path.join(data_dir, 'PovStatsData.csv'), indicator_aliases)
+
+@derived('data_dir', sources = ['PovStatsCountry.csv'])
+def country(data_dir):
+    country = pd.read_csv(os.path.join(data_dir, 'PovStatsCountry.csv'), na_values = '', keep_default_na = False)
+
+    # separate regions from non-regions
+    country['is_country'] = country['Region'].notna()
+
+    # create country flag emojis
+    # get list of country codes
+    country_code_list = country[country['is_country']]['2-alpha code'].dropna().str.lower().tolist()
+
+    # add country flags to dataframe
+    with stage('country_flag'):
+        country['flag'] = [country_flag(code, country_code_list) for code in country['2-alpha code']]
+    return country
+
+@derived('data_dir', sources = ['PovStatsSeries.csv'])
+def series(data_dir):
+    series = pd.read_csv(os.path.join(data_dir, 'PovStatsSeries.csv'))
+    series['Indicator Name'] = series['Indicator Name'].replace(indicator_aliases)
+    return series
+
+@derived('core')
+def years(core):
+    # the years with data, leaving out the trailing columns of the data file that are still empty, e.g. 2020
+    return pd.DataFrame({'year': np.unique(core.years[core.year_idx]).astype(np.int64)})
+
+@derived('data_dir', 'core', 'country', sources = ['poverty_2020.csv'])
+def poverty_core(data_dir, core, country):
+    # the exported poverty table is used when present, otherwise the cells of the data file
+    poverty_csv = os.path.join(data_dir, 'poverty_2020.csv')
+    if os.path.exists(poverty_csv):
+        return read_wide_core(poverty_csv, country.columns)
+    return core
+
+@derived('poverty_core', 'country')
+def poverty_table(poverty_core, country):
+    # the rows of every country and year with data, whose indicators are only filled in for the frames showing them
+    table = CoreTable(poverty_core)
+    # flag the rows of countries, missing for the codes the country file does not list
+    table.ids['is_country'] = table.ids['Country Code'].map(country.set_index('Country Code')['is_country'])
+    return table
+
+@derived('poverty_table')
+def income_share_df(poverty_table):
+    # select income shares within countries, for all years, with a focus on 20%
+    shares = [name for name in poverty_table.indicators if re.search('Income share.*?20', name)]
+    income_share_df = poverty_table.frame(shares)[['Country Name', 'year'] + shares].rename(columns = {'year': 'Year'})
+    return income_share_df.dropna()
+
+@derived('income_share_df')
+def income_share_df_sorted(income_share_df):
+    # rearrange columns
+    income_share_df_sorted = income_share_df.rename(columns = {
+        'Income share held by lowest 20%': '1 Income share held by lowest 20%',
+        'Income share held by second 20%': '2 Income share held by second 20%',
+        'Income share held by third 20%': '3 Income share held by third 20%',
+        'Income share held by fourth 20%': '4 Income share held by fourth 20%',
+        'Income share held by highest 20%': '5 Income share held by highest 20%',
+    }).sort_index(axis = 1)
+
+    # remove redundant parts of the column names
+    income_share_df_sorted.columns = [re.sub(r'\d Income share held by ', '', col).title() for col in income_share_df_sorted.columns]
+    return income_share_df_sorted
+
+@derived('poverty_table')
+def gini_df(poverty_table):
+    # create dataframe for gini index, eliminating rows with missing values
+    gini_df = poverty_table.frame([gini])[['Country Name', 'Country Code', 'year', gini]].rename(columns = {'year': 'Year'})
+    return gini_df[gini_df[gini].notna()]
+
+@derived('country_sub')
+def perc_pov_df(country_sub):
+    # create dataframe for percentage poverty, with the population the chart is colored by
+    poverty_gap_cols = [name for name in country_sub.table.indicators if re.search('Poverty gap', name)]
+    population = [name for name in ['Population, total'] if name in country_sub.table.indicators]
+    return country_sub.select({}, poverty_gap_cols + population).dropna(subset = poverty_gap_cols)
+
+@derived('poverty_table')
+def country_sub(poverty_table):
+    # get the rows of every code the country file lists, countries and aggregates
+    return TableIndex(poverty_table, ['year'], np.flatnonzero(poverty_table.ids['is_country'].notna()))
+
+@derived('poverty_table')
+def indicator_list(poverty_table):
+    # get list of indicators with data
+    return poverty_table.indicators
+
+@derived('country_sub')
+def country_list(country_sub):
+    # get list of countries
+    return country_sub.column('Country Name').drop_duplicates().sort_values().tolist()
+
+@derived('series')
+def indicator_details(series):
+    # keep the first description of every indicator
+    details = series.drop_duplicates(subset = ['Indicator Name'])
+    # replace empty rows with N/A
+    # replace any instances of two newline characters, \n\n, with a single space, if any
+    limitations = details['Limitations and exceptions'].fillna('N/A').str.replace('\n\n', ' ')
+    unit = details['Unit of measure'].fillna("count")
+    periodicity = details["Periodicity"].fillna("N/A")
+
+    # render the markdown shown below the map chart once, rather than on every request
+    markdown = [f"""
+                    ### {name}
+                    {definition}
+
+                    * **Unit of measure**: {unit_of_measure}
+                    * **Periodicity**
+                    {period}
+                    * **Source**: {source}
+                    #### Limitations and exceptions
+                    {limitation}
+                """ for name, definition, unit_of_measure, period, source, limitation in zip(
+                    details["Indicator Name"], details["Long definition"], unit, periodicity, details["Source"], limitations)]
+
+    return pd.DataFrame({
+        'Indicator Name': details['Indicator Name'].values,
+        'Indicator Code': details['Series Code'].values,
+        'Unit of measure': unit.values,
+        'Periodicity': periodicity.values,
+        'markdown': markdown,
+    })
+
+@derived('indicator_details')
+def indicator_metadata(indicator_details):
+    # look up the details of an indicator by its name or its code
+    metadata = {}
+    for record in indicator_details.to_dict('records'):
+        metadata[record['Indicator Name']] = record
+        metadata[record['Indicator Code']] = record
+    return metadata
+
+@derived('gini_df')
+def gini_index(gini_df):
+    return FrameIndex(gini_df, ['Year', 'Country Name'])
+
+@derived('income_share_df_sorted')
+def income_share_index(income_share_df_sorted):
+    return FrameIndex(income_share_df_sorted, ['Country Name'])
+
+@derived('perc_pov_df')
+def perc_pov_index(perc_pov_df):
+    return FrameIndex(perc_pov_df, ['year'])
+
+@derived('poverty_table')
+def poverty_index(poverty_table):
+    return TableIndex(poverty_table, ['year', 'Country Name', 'Country Code'])
+
+@derived('poverty_table')
+def poverty_country_index(poverty_table):
+    # only the rows of countries are indexed, aggregates are never selected by the callbacks
+    return TableIndex(poverty_table, ['year', 'Country Name', 'Country Code'], np.flatnonzero(poverty_table.ids['is_country'].eq(True)))
+
+@derived('country')
+def country_index(country):
+    return FrameIndex(country, ['Short Name'])
+
+# read the csv files of a vintage lazily, building each frame the first time it is needed
+def build_frames(data_dir = 'data_2020'):
+    return LazyFrames(data_dir)
@@ -0,0 +1,35 @@
+# imports
+
+# search
+import re
+from bisect import bisect_left
+
+# words of a label, split on spaces, brackets, commas, dashes and slashes
+word_pattern = re.compile(r'[^\s(),\-/]+')
+
+# index of the labels of a dropdown by the start of every word, so that typing "gap at" finds
+# "Poverty gap at $1.90 a day (2011 PPP) (%)" without scanning every label
+class PrefixIndex:
+    def __init__(self, labels):
+        self.labels = list(labels)
+        # every label is listed once from the start of each of its words, in lower case
+        keys = sorted({(text[word.start():], position)
+                       for position, text in enumerate(str(label).lower() for label in self.labels)
+                       for word in word_pattern.finditer(text)})
+        self.keys = [key for key, _ in keys]
+        self.positions = [position for _, position in keys]
+
+    # get the labels with a word starting with the search text, in the order of the labels
+    def search(self, text, limit = None):
+        text = ' '.join(str(text).lower().split())
+        if not text:
+            return self.labels[:limit]
+        found = set()
+        for index in range(bisect_left(self.keys, text), len(self.keys)):
+            if not self.keys[index].startswith(text):
+                break
+            found.add(self.positions[index])
+        return [self.labels[position] for position in sorted(found)[:limit]]
+
+    def __len__(self):
+        return len(self.labels)
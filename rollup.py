@@ -0,0 +1,137 @@
+# imports
+
+# data management
+import numpy as np
+import pandas as pd
+
+# data visualization
+import plotly.graph_objects as go
+
+from povstats import derived
+
+# columns of PovStatsCountry.csv grouping the countries, the aggregates such as World have neither
+group_columns = ['Region', 'Income Group']
+
+# statistics of the countries of a group, for every year and indicator
+rollup_statistics = {'mean': 'Mean',
+                     'weighted_mean': 'Population-weighted mean',
+                     'min': 'Minimum',
+                     'max': 'Maximum',
+                     'count': 'Number of countries'}
+
+# indicator weighting the countries in the weighted mean
+weight_indicator = 'Population, total'
+
+# compute the statistics of every group, year and indicator in one pass over the cells of the core store
+# the cells are keyed by group, year and indicator, sorted by key, and every statistic is reduced over the runs
+# of equal keys, so that the cost does not grow with the number of groups or indicators
+# the result has one row per group, year and indicator with data, so that it is stored with the snapshot
+def build_rollup(core, country):
+    values = core.exact()
+    years = len(core.years)
+    indicators = len(core.indicators)
+
+    # population of every cell, from the population of its country that year
+    population = np.full((len(core.countries), years), np.nan)
+    if weight_indicator in core.indicator_positions:
+        cells = core.indicator_slice(weight_indicator)
+        population[core.country_idx[cells], core.year_idx[cells]] = core.exact(cells)
+    weights = population[core.country_idx, core.year_idx]
+
+    parts = []
+    for group_column in group_columns:
+        labels = country.drop_duplicates('Country Code').set_index('Country Code')[group_column]
+        group_idx, groups = pd.factorize(labels.reindex(core.country_codes))
+        cell_group = group_idx[core.country_idx]
+        keep = cell_group >= 0
+        keys = (cell_group[keep].astype(np.int64) * years + core.year_idx[keep]) * indicators + core.indicator_idx[keep]
+        order = np.argsort(keys, kind = 'stable')
+        keys, cell_values, cell_weights = keys[order], values[keep][order], weights[keep][order]
+        unique_keys, starts = np.unique(keys, return_index = True)
+        if not len(unique_keys):
+            continue
+
+        count = np.diff(np.append(starts, len(keys)))
+        weighted = ~np.isnan(cell_weights)
+        weight_sum = np.add.reduceat(np.where(weighted, cell_weights, 0), starts)
+        weighted_sum = np.add.reduceat(np.where(weighted, cell_weights * cell_values, 0), starts)
+        group, rest = np.divmod(unique_keys, years * indicators)
+        year, indicator = np.divmod(rest, indicators)
+        parts.append(pd.DataFrame({
+            'Group Type': group_column,
+            'Group': np.asarray(groups, dtype = object)[group],
+            'year': core.years[year].astype(np.int64),
+            'Indicator Name': core.indicators[indicator],
+            'count': count,
+            'mean': np.add.reduceat(cell_values, starts) / count,
+            'weighted_mean': np.divide(weighted_sum, weight_sum, out = np.full(len(starts), np.nan), where = weight_sum > 0),
+            'min': np.minimum.reduceat(cell_values, starts),
+            'max': np.maximum.reduceat(cell_values, starts),
+        }))
+    if not parts:
+        return pd.DataFrame(columns = ['Group Type', 'Group', 'year', 'Indicator Name', 'count'] + list(rollup_statistics)[:-1])
+    return pd.concat(parts, ignore_index = True)
+
+# the statistics of the groups as dense arrays of group x year x indicator, so that the series of an indicator
+# are read by index rather than grouped on every request
+class RollupCube:
+    def __init__(self, frame):
+        group_keys = frame[['Group Type', 'Group']].drop_duplicates().sort_values(['Group Type', 'Group'])
+        self.groups = list(group_keys.itertuples(index = False, name = None))
+        self.years = np.sort(frame['year'].unique())
+        self.indicators = np.sort(frame['Indicator Name'].unique())
+        self.group_positions = {group: position for position, group in enumerate(self.groups)}
+        self.indicator_positions = {name: position for position, name in enumerate(self.indicators)}
+
+        group = pd.MultiIndex.from_frame(frame[['Group Type', 'Group']]).map(self.group_positions).to_numpy()
+        year = np.searchsorted(self.years, frame['year'].to_numpy())
+        indicator = np.searchsorted(self.indicators, frame['Indicator Name'].to_numpy())
+        shape = (len(self.groups), len(self.years), len(self.indicators))
+        self.cube = {}
+        for statistic in rollup_statistics:
+            cube = np.zeros(shape) if statistic == 'count' else np.full(shape, np.nan)
+            cube[group, year, indicator] = frame[statistic].to_numpy(dtype = float)
+            self.cube[statistic] = cube
+
+    # get the names of the groups of a type, such as the regions
+    def group_names(self, group_type):
+        return [name for kind, name in self.groups if kind == group_type]
+
+    # get a statistic of an indicator for every group of a type, as the group names, the years with data,
+    # and a matrix of one row per group and one column per year
+    def series(self, indicator, statistic, group_type):
+        positions = [position for position, (kind, _) in enumerate(self.groups) if kind == group_type]
+        if indicator not in self.indicator_positions or not positions:
+            return [], self.years[:0], np.empty((0, 0))
+        counts = self.cube['count'][positions, :, self.indicator_positions[indicator]]
+        matrix = self.cube[statistic][positions, :, self.indicator_positions[indicator]]
+        has_data = counts.sum(axis = 0) > 0
+        return [self.groups[position][1] for position in positions], self.years[has_data], matrix[:, has_data]
+
+    # get a statistic of an indicator for a group and a year
+    def value(self, indicator, statistic, group_type, group, year):
+        year_position = np.searchsorted(self.years, year)
+        if (group_type, group) not in self.group_positions or indicator not in self.indicator_positions or \
+                year_position == len(self.years) or self.years[year_position] != year:
+            return np.nan
+        return self.cube[statistic][self.group_positions[(group_type, group)], year_position, self.indicator_positions[indicator]]
+
+# create the chart comparing the groups of a type over the years, one line per group
+def region_comparison_figure(cube, indicator, statistic, group_type):
+    names, years, matrix = cube.series(indicator, statistic, group_type)
+    fig = go.Figure([go.Scatter(x = years, y = row, name = name, mode = 'lines+markers', connectgaps = True)
+                     for name, row in zip(names, matrix)])
+    fig.update_layout(title = f'<b>{indicator}</b><br />{rollup_statistics[statistic]} by {group_type.lower()}',
+                      xaxis_title = 'year',
+                      yaxis_title = rollup_statistics[statistic],
+                      height = 550,
+                      paper_bgcolor = '#E5ECF6')
+    return fig
+
+@derived('core', 'country')
+def rollup(core, country):
+    return build_rollup(core, country)
+
+@derived('rollup')
+def rollup_cube(rollup):
+    return RollupCube(rollup)
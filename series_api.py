@@ -0,0 +1,126 @@
+# imports
+
+# data management
+import numpy as np
+import pandas as pd
+
+from export import clip_years, export_positions, id_columns, parse_list, parse_years
+
+# layouts of the rows of a result: columnar sends one list per column, records one object per row
+api_layouts = ['columnar', 'records']
+
+# error in a query of a batch, reported in its result rather than failing the whole request
+class QueryError(ValueError):
+    pass
+
+# query selecting more cells than it is allowed to
+class QueryTooCostly(QueryError):
+    pass
+
+# read the years of a query, given as a list like the export ("2000-2010,2015"), or as [first, last]
+# the ranges are clipped to the years of the data between first and last, so that a wide range expands to those only
+def query_years(years, first = None, last = None):
+    if years is None:
+        return []
+    if isinstance(years, str):
+        return parse_years(years, first, last)
+    if isinstance(years, (list, tuple)) and len(years) == 2 and all(isinstance(year, int) for year in years):
+        start, end = clip_years(years[0], years[1], first, last)
+        return list(range(start, end + 1))
+    raise QueryError('years must be a string like "2000-2010,2015" or a pair of years [first, last]')
+
+# read a list of names of a query, given as a list or a single name
+def query_names(names, field):
+    if names is None:
+        return []
+    if isinstance(names, str):
+        return [names]
+    if isinstance(names, list) and all(isinstance(name, str) for name in names):
+        return names
+    raise QueryError(f'{field} must be a name or a list of names')
+
+# check a query of a batch and get its countries, indicators, years and output columns
+# the years of the query are clipped to those of the data, given as a pair of the first and last year
+def parse_query(query, indicator_list, year_bounds = (None, None)):
+    if not isinstance(query, dict):
+        raise QueryError('a query must be an object')
+    indicators = query_names(query.get('indicators'), 'indicators')
+    if not indicators:
+        raise QueryError('a query needs at least one indicator')
+    unknown = [name for name in indicators if name not in indicator_list]
+    if unknown:
+        raise QueryError(f'unknown indicators: {", ".join(unknown)}')
+    countries = query_names(query.get('countries'), 'countries')
+    try:
+        years = query_years(query.get('years'), *year_bounds)
+    except ValueError as error:
+        raise QueryError(str(error))
+    # the fields project the columns of the result, by default the id columns and the indicators
+    columns = id_columns + indicators
+    fields = query_names(query.get('fields'), 'fields') or columns
+    unknown = [field for field in fields if field not in columns]
+    if unknown:
+        raise QueryError(f'fields not in the query: {", ".join(unknown)}')
+    return countries, indicators, years, fields
+
+# turn a column into a list for json, with null for missing values
+def json_column(values):
+    values = values.to_numpy()
+    if values.dtype.kind == 'f':
+        column = values.astype(object)
+        column[np.isnan(values)] = None
+        return column.tolist()
+    if values.dtype.kind == 'O':
+        return [None if pd.isna(value) else value for value in values.tolist()]
+    return values.tolist()
+
+# answer a query from an index of the poverty table, refusing it before its rows are serialised when it would cost more than a number of cells
+def run_query(index, query, indicator_list, max_cells, layout = 'columnar', year_bounds = (None, None)):
+    countries, indicators, years, fields = parse_query(query, indicator_list, year_bounds)
+    positions = export_positions(index, years, countries)
+    if query.get('dropna', True):
+        # leave out the rows without any of the indicators, as most countries lack most years
+        found = np.zeros(len(positions), dtype = bool)
+        for indicator in indicators:
+            found |= ~np.isnan(index.table.column(indicator, positions))
+        positions = positions[found]
+    cost = len(positions) * len(fields)
+    if cost > max_cells:
+        raise QueryTooCostly(f'the query selects {cost} cells, more than the limit of {max_cells}; narrow its countries, years or fields')
+    # only the indicators among the fields are filled in
+    frame = index.table.frame([field for field in fields if field in indicators], positions)
+    columns = {field: json_column(frame[field]) for field in fields}
+    if layout == 'records':
+        return {'rows': len(frame), 'cells': cost, 'data': [dict(zip(fields, row)) for row in zip(*columns.values())]}
+    return {'rows': len(frame), 'cells': cost, 'columns': fields, 'data': columns}
+
+# answer a batch of queries, each within its own limit and all of them within the limit of the request
+# every query gets a result, an error for those that are invalid or too costly
+def run_batch(frames, queries, max_cells, max_request_cells, layout = 'columnar', on_query = None):
+    results = []
+    budget = max_request_cells
+    year_list = frames['years']['year']
+    year_bounds = (int(year_list.min()), int(year_list.max()))
+    for query in queries:
+        aggregates = not isinstance(query, dict) or query.get('aggregates', True)
+        index = frames['poverty_index' if aggregates else 'poverty_country_index']
+        try:
+            result = run_query(index, query, frames['indicator_list'], min(max_cells, budget), layout, year_bounds)
+            budget -= result['cells']
+            outcome = 'ok'
+        except QueryError as error:
+            result = {'error': str(error)}
+            outcome = 'too_costly' if isinstance(error, QueryTooCostly) else 'invalid'
+        on_query and on_query(outcome)
+        results.append(result)
+    return results
+
+# read a single query from the parameters of a GET request, like those of the export
+# indicators are repeated (indicator=...&indicator=...) since their names hold commas
+def query_from_args(args):
+    return {'indicators': args.getlist('indicator'),
+            'countries': parse_list(args.get('countries')) + args.getlist('country'),
+            'years': args.get('years'),
+            'fields': args.getlist('field') or None,
+            'dropna': args.get('dropna') != '0',
+            'aggregates': args.get('aggregates') != '0'}
@@ -0,0 +1,218 @@
+
+# imports
+
+# data management
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+
+from povstats import LazyFrames, build_frames, notes_files, source_files
+from core_store import CoreStore
+# the modules of the frames stored in the snapshot register them on import, the rollup of the groups
+# is not used here otherwise
+from gap_fill import LatestValues
+from trends import fit_trends
+import rollup  # noqa: F401
+
+# bump whenever the layout of the snapshot directory changes
+snapshot_format = 8
+
+# default location of the snapshots, one directory per vintage
+snapshot_root = 'snapshots'
+
+# frames stored in the snapshot, the others are derived from them on demand
+# the long text columns of the series table are only kept as the rendered indicator details
+snapshot_frames = ['country', 'indicator_details', 'core', 'income_share_df_sorted', 'gini_df', 'perc_pov_df',
+                   'years', 'rollup', 'latest_values']
+
+# stored frames that are stores of arrays rather than data frames, by the class rebuilding them
+array_stores = {'core': CoreStore, 'latest_values': LatestValues}
+
+# get the snapshot directory of a vintage
+def default_snapshot_dir(data_dir):
+    return os.path.join(snapshot_root, os.path.basename(os.path.normpath(data_dir)))
+
+# hash a file in chunks, so that large vintages are not read into memory at once
+def file_hash(path, chunk_size = 1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# list the source files of a vintage that exist on disk
+def vintage_sources(data_dir):
+    names = source_files + ['poverty_2020.csv'] + notes_files
+    return [name for name in names if os.path.exists(os.path.join(data_dir, name))]
+
+# record size, modification time and hash of every source file
+def fingerprint_sources(data_dir):
+    sources = {}
+    for name in vintage_sources(data_dir):
+        path = os.path.join(data_dir, name)
+        stat = os.stat(path)
+        sources[name] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': file_hash(path)}
+    return sources
+
+# combine the hashes of the source files into a short dataset version
+def dataset_version(sources):
+    digest = hashlib.sha256()
+    for name in sorted(sources):
+        digest.update(name.encode())
+        digest.update(sources[name]['sha256'].encode())
+    return digest.hexdigest()[:12]
+
+# list the source files that were added, removed or modified since they were fingerprinted
+def changed_sources(sources, data_dir):
+    current = vintage_sources(data_dir)
+    changed = sorted(set(current).symmetric_difference(sources))
+    for name, entry in sources.items():
+        if name not in current:
+            continue
+        path = os.path.join(data_dir, name)
+        stat = os.stat(path)
+        # an unchanged modification time is trusted, otherwise the content decides
+        if stat.st_size != entry['size'] or (stat.st_mtime != entry['mtime'] and file_hash(path) != entry['sha256']):
+            changed.append(name)
+    return changed
+
+# check that the snapshot was built from the source files currently on disk
+def is_fresh(manifest, data_dir):
+    if manifest.get('format') != snapshot_format:
+        return False
+    return not changed_sources(manifest.get('sources', {}), data_dir)
+
+# write a frame as a parquet table plus a matrix of its float columns
+# the matrix holds one row per column, so every column is a contiguous slice of the file
+def write_frame(out_dir, name, frame):
+    value_columns = frame.select_dtypes('float64').columns.tolist()
+    frame.drop(columns = value_columns).to_parquet(os.path.join(out_dir, f'{name}.parquet'))
+    if not value_columns:
+        return {'kind': 'frame', 'columns': frame.columns.tolist(), 'values': None}
+    values = np.ascontiguousarray(frame[value_columns].to_numpy().T)
+    # name the matrix after its content, so that frames holding the same numbers share one file
+    values_file = f'values-{hashlib.sha256(values.tobytes()).hexdigest()[:12]}.npy'
+    values_path = os.path.join(out_dir, values_file)
+    if not os.path.exists(values_path):
+        np.save(values_path, values)
+    return {'kind': 'frame', 'columns': frame.columns.tolist(), 'values': values_file, 'value_columns': value_columns}
+
+# write a store of arrays as one .npy file per array, with its lists of names kept in the layout
+def write_arrays(out_dir, name, store):
+    arrays = {}
+    for field in store.array_fields:
+        arrays[field] = f'{name}-{field}.npy'
+        np.save(os.path.join(out_dir, arrays[field]), np.ascontiguousarray(getattr(store, field)))
+    names = {field: getattr(store, field).tolist() for field in store.name_fields}
+    return {'kind': 'arrays', 'names': names, 'arrays': arrays}
+
+# read a store of arrays back, with its arrays mapped from their files
+def read_arrays(snapshot_dir, name, layout, mmap_mode = 'r'):
+    arrays = {field: np.load(os.path.join(snapshot_dir, path), mmap_mode = mmap_mode) for field, path in layout['arrays'].items()}
+    return array_stores[name].from_arrays(layout['names'], arrays)
+
+# read a frame back, with its float columns mapped from the shared matrix
+def read_frame(snapshot_dir, name, layout, mmap_mode = 'r'):
+    table = pd.read_parquet(os.path.join(snapshot_dir, f'{name}.parquet'))
+    if layout['values'] is None:
+        return table
+    values = np.load(os.path.join(snapshot_dir, layout['values']), mmap_mode = mmap_mode)
+    # start from the mapped columns, which pandas keeps as a single block without copying
+    frame = pd.DataFrame(values.T, index = table.index, columns = layout['value_columns'], copy = False)
+    # put the remaining columns back at their original positions
+    for position, column in enumerate(layout['columns']):
+        if column in table.columns:
+            frame.insert(position, column, table[column])
+    return frame
+
+# create the builder of a stored frame, which falls back to the csv files if the snapshot cannot be read
+def snapshot_reader(snapshot_dir, name, layout, mmap_mode):
+    def read(data_dir):
+        try:
+            if layout['kind'] == 'arrays':
+                return read_arrays(snapshot_dir, name, layout, mmap_mode)
+            return read_frame(snapshot_dir, name, layout, mmap_mode)
+        except (OSError, ValueError, ImportError):
+            return build_frames(data_dir)[name]
+    return ('data_dir',), read
+
+# build the frames from the csv files and write them as a versioned snapshot
+# the trends of the vintage are fitted then too, unless the same data file was fitted before
+def build_snapshot(data_dir = 'data_2020', snapshot_dir = None, trends_root = None):
+    snapshot_dir = snapshot_dir or default_snapshot_dir(data_dir)
+    sources = fingerprint_sources(data_dir)
+    frames = build_frames(data_dir)
+    frames.sources, frames.version = sources, dataset_version(sources)
+
+    # write into a temporary directory first, so that readers never see a partial snapshot
+    tmp_dir = f'{snapshot_dir}.tmp-{os.getpid()}'
+    shutil.rmtree(tmp_dir, ignore_errors = True)
+    os.makedirs(tmp_dir)
+    layouts = {name: write_arrays(tmp_dir, name, frames[name]) if name in array_stores else write_frame(tmp_dir, name, frames[name])
+               for name in snapshot_frames}
+
+    manifest = {
+        'format': snapshot_format,
+        'data_dir': data_dir,
+        'version': frames.version,
+        'created': time.time(),
+        'sources': sources,
+        'frames': layouts,
+    }
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as handle:
+        json.dump(manifest, handle, indent = 2)
+
+    # swap the new snapshot into place
+    old_dir = f'{snapshot_dir}.old-{os.getpid()}'
+    if os.path.exists(snapshot_dir):
+        os.rename(snapshot_dir, old_dir)
+    os.rename(tmp_dir, snapshot_dir)
+    shutil.rmtree(old_dir, ignore_errors = True)
+    fit_trends(frames, trends_root)
+    return manifest
+
+# read the manifest of a snapshot, if there is one
+def read_manifest(snapshot_dir):
+    try:
+        with open(os.path.join(snapshot_dir, 'manifest.json')) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+# get the lazy frames of a snapshot, or None when it is missing or stale
+# stored frames are read on first use, the others are derived from them
+def load_snapshot(data_dir = 'data_2020', snapshot_dir = None, shared = True):
+    snapshot_dir = snapshot_dir or default_snapshot_dir(data_dir)
+    manifest = read_manifest(snapshot_dir)
+    if manifest is None or not is_fresh(manifest, data_dir):
+        return None
+    mmap_mode = 'r' if shared else None
+    readers = {name: snapshot_reader(snapshot_dir, name, layout, mmap_mode) for name, layout in manifest['frames'].items()}
+    frames = LazyFrames(data_dir, readers)
+    frames.version, frames.sources = manifest['version'], manifest['sources']
+    return frames, frames.version
+
+# load the frames from the snapshot, falling back to the csv files
+def load_frames(data_dir = 'data_2020', snapshot_dir = None, shared = True):
+    loaded = load_snapshot(data_dir, snapshot_dir, shared)
+    if loaded is not None:
+        return loaded
+    frames = build_frames(data_dir)
+    frames.sources = fingerprint_sources(data_dir)
+    frames.version = dataset_version(frames.sources)
+    return frames, frames.version
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Build a precompiled snapshot of a PovStats vintage')
+    parser.add_argument('--data-dir', default = 'data_2020', help = 'directory holding the PovStats csv files')
+    parser.add_argument('--snapshot-dir', default = None, help = 'output directory, defaults to snapshots/<vintage>')
+    parser.add_argument('--trends-dir', default = None, help = 'directory of the fitted trends, defaults to cache/trends')
+    args = parser.parse_args()
+
+    manifest = build_snapshot(args.data_dir, args.snapshot_dir, args.trends_dir)
+    print(f"snapshot {manifest['version']} written to {args.snapshot_dir or default_snapshot_dir(args.data_dir)}")
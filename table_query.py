@@ -0,0 +1,88 @@
+
+# imports
+
+# data management
+import math
+import pandas as pd
+
+# operators of the dash table filter syntax, with their symbolic aliases
+operators = [['ge ', '>='],
+             ['le ', '<='],
+             ['lt ', '<'],
+             ['gt ', '>'],
+             ['ne ', '!='],
+             ['eq ', '='],
+             ['contains '],
+             ['datestartswith ']]
+
+# split one part of a filter query, e.g. "{year} >= 2010", into column, operator and value
+# the value is kept as text, and read as a number by filter_frame when its column holds numbers
+def split_filter_part(filter_part):
+    for operator_type in operators:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+
+                value = value_part.strip()
+                quote = value[:1]
+                if len(value) > 1 and quote == value[-1] and quote in ("'", '"', '`'):
+                    value = value[1: -1].replace('\\' + quote, quote)
+
+                return name, operator_type[0].strip(), value
+
+    return [None] * 3
+
+# read the value of a filter as the type of its column, None when it can't be compared with it
+def column_value(series, value):
+    if pd.api.types.is_numeric_dtype(series):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return value
+
+# keep the rows of a frame matching a dash table filter query
+# a value that can't be compared with its column, such as text against a column of numbers, matches no row
+def filter_frame(frame, filter_query):
+    for filter_part in (filter_query or '').split(' && '):
+        column, operator, value = split_filter_part(filter_part)
+        if column not in frame.columns:
+            continue
+        if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+            value = column_value(frame[column], value)
+            if value is None:
+                frame = frame.iloc[:0]
+                continue
+            frame = frame.loc[getattr(frame[column].astype(str) if isinstance(value, str) else frame[column], operator)(value)]
+        elif operator == 'contains':
+            frame = frame.loc[frame[column].astype(str).str.contains(value, regex = False)]
+        elif operator == 'datestartswith':
+            frame = frame.loc[frame[column].astype(str).str.startswith(value)]
+    return frame
+
+# sort a frame by the columns of a dash table sort_by property
+def sort_frame(frame, sort_by):
+    sort_by = [column for column in (sort_by or []) if column['column_id'] in frame.columns]
+    if not sort_by:
+        return frame
+    return frame.sort_values([column['column_id'] for column in sort_by],
+                             ascending = [column['direction'] == 'asc' for column in sort_by],
+                             kind = 'stable')
+
+# get one page of a frame, and the number of pages
+def page_frame(frame, page_current, page_size):
+    page_current = page_current or 0
+    start = page_current * page_size
+    return frame.iloc[start: start + page_size], max(math.ceil(len(frame) / page_size), 1)
+
+# convert the sort_by property to and from the query string of the export endpoint
+def encode_sort(sort_by):
+    return [f"{column['column_id']}:{column['direction']}" for column in sort_by or []]
+
+def decode_sort(sort_args):
+    sort_by = []
+    for item in sort_args:
+        column, _, direction = item.rpartition(':')
+        sort_by.append({'column_id': column, 'direction': direction})
+    return sort_by
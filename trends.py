@@ -0,0 +1,236 @@
+# imports
+
+# data management
+import os
+import glob
+import hashlib
+import argparse
+import warnings
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+# trend fitting
+from sklearn.linear_model import HuberRegressor
+from sklearn.exceptions import ConvergenceWarning
+
+from metrics import stage
+from povstats import derived
+
+# directory of the fitted trends, one file per content of the data file, so that vintages and workers share them
+trends_root = os.path.join('cache', 'trends')
+
+# fewest years of data a series needs to be given a trend
+min_points = 3
+
+# years forecast after the last year of data of a series
+horizon = 3
+
+# processes fitting the robust trends, None for one per cpu, 0 to fit them in the calling process
+trend_workers = None
+
+# series fitted by a process at a time
+chunk_series = 256
+
+# refit only the series whose data changed since the trends fitted last, e.g. for another vintage
+incremental = True
+
+# spread the bits of 64 bit integers, the finaliser of splitmix64
+def mix(bits):
+    bits = (bits ^ (bits >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    bits = (bits ^ (bits >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return bits ^ (bits >> np.uint64(31))
+
+# get the series of the core store, a run of cells per indicator and country since its cells are sorted by both
+def series_runs(core):
+    keys = core.indicator_idx.astype(np.int64) * len(core.countries) + core.country_idx
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.empty(0, dtype = np.int64)
+    return starts, np.diff(np.append(starts, len(keys)))
+
+# hash the years and values of every series, so that the series unchanged since an earlier fit are found without comparing them
+def series_hashes(years, values, starts):
+    cells = mix(values.view(np.uint64) ^ mix(years.astype(np.uint64)))
+    return np.add.reduceat(cells, starts).view(np.int64) if len(starts) else np.empty(0, dtype = np.int64)
+
+# fit a least squares line to every series at once, from the sums of its years and values
+def linear_trends(years, values, starts, counts):
+    # center the years of every series, so that the sums stay small
+    mean_year = np.add.reduceat(years, starts) / counts
+    x = years - np.repeat(mean_year, counts)
+    mean_value = np.add.reduceat(values, starts) / counts
+    sxx = np.add.reduceat(x * x, starts)
+    sxy = np.add.reduceat(x * values, starts)
+    slope = np.divide(sxy, sxx, out = np.zeros(len(starts)), where = sxx > 0)
+    return slope, mean_value - slope * mean_year
+
+# fit a robust line to every series of a chunk, one at a time, less swayed by the odd survey than least squares
+# the values are scaled first, since the huber loss compares the residuals to a fixed threshold
+def fit_robust(chunk):
+    slopes, intercepts = [], []
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', ConvergenceWarning)
+        for years, values in chunk:
+            center, scale = np.median(values), values.std()
+            mean_year = years.mean()
+            if scale == 0:
+                slopes.append(0.0)
+                intercepts.append(center)
+                continue
+            model = HuberRegressor(max_iter = 200).fit((years - mean_year)[:, None], (values - center) / scale)
+            slope = model.coef_[0] * scale
+            slopes.append(slope)
+            intercepts.append(center + model.intercept_ * scale - slope * mean_year)
+    return slopes, intercepts
+
+# fit the robust lines of some series, in a pool of processes when there are enough of them
+def robust_trends(years, values, starts, counts, workers = None):
+    series = [(years[start: start + count], values[start: start + count]) for start, count in zip(starts, counts)]
+    chunks = [series[start: start + chunk_series] for start in range(0, len(series), chunk_series)]
+    workers = os.cpu_count() if workers is None else workers
+    if workers and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers = min(workers, len(chunks))) as pool:
+            results = list(pool.map(fit_robust, chunks))
+    else:
+        results = [fit_robust(chunk) for chunk in chunks]
+    slopes = [slope for chunk_slopes, _ in results for slope in chunk_slopes]
+    intercepts = [intercept for _, chunk_intercepts in results for intercept in chunk_intercepts]
+    return np.array(slopes, dtype = float), np.array(intercepts, dtype = float)
+
+# get the path of the trends of a vintage, named after the hash of its data file in the fingerprint of its sources
+# and the settings of the fits, None when the vintage was loaded without a fingerprint
+def trends_path(sources, root = None):
+    if 'PovStatsData.csv' not in sources:
+        return None
+    key = f"{sources['PovStatsData.csv']['sha256']} {min_points} {horizon}"
+    return os.path.join(root or trends_root, f'trends-{hashlib.sha256(key.encode()).hexdigest()[:16]}.parquet')
+
+# read the trends fitted last for other data, to take over the series that did not change
+def previous_trends(root, path):
+    paths = sorted((other for other in glob.glob(os.path.join(root, 'trends-*.parquet')) if other != path),
+                   key = os.path.getmtime, reverse = True)
+    for other in paths:
+        try:
+            return pd.read_parquet(other)
+        except (OSError, ValueError):
+            continue
+    return None
+
+# fit the trend of every country and indicator with enough years of data, and forecast the next years
+# the least squares lines are fitted at once for all series, the robust lines fanned out over processes
+# with a previous fit, only the series whose years or values changed are refitted, and their number is returned too
+def build_trends(core, previous = None, workers = None):
+    starts, counts = series_runs(core)
+    # keep the cells of the series with enough years, which then follow each other
+    keep = np.repeat(counts >= min_points, counts)
+    counts = counts[counts >= min_points]
+    starts = np.cumsum(counts) - counts
+    ends = starts + counts - 1
+    years = core.years[core.year_idx[keep]].astype(float)
+    values = core.exact()[keep]
+    country_idx, indicator_idx = core.country_idx[keep], core.indicator_idx[keep]
+
+    trends = pd.DataFrame({'Country Code': core.country_codes[country_idx[starts]],
+                           'Indicator Name': core.indicators[indicator_idx[starts]],
+                           'points': counts,
+                           'first_year': years[starts].astype(np.int64),
+                           'last_year': years[ends].astype(np.int64),
+                           'data_hash': series_hashes(years, values, starts)})
+    with stage('trends:linear'):
+        trends['slope'], trends['intercept'] = linear_trends(years, values, starts, counts)
+
+    # take over the robust lines of the series fitted before with the same data
+    robust = pd.DataFrame(index = trends.index, columns = ['robust_slope', 'robust_intercept'], dtype = float)
+    if previous is not None and len(previous):
+        known = trends[['Country Code', 'Indicator Name', 'data_hash']].merge(
+            previous[['Country Code', 'Indicator Name', 'data_hash', 'robust_slope', 'robust_intercept']],
+            how = 'left', on = ['Country Code', 'Indicator Name', 'data_hash'])
+        robust[['robust_slope', 'robust_intercept']] = known[['robust_slope', 'robust_intercept']].to_numpy()
+    refit = np.flatnonzero(robust['robust_slope'].isna().to_numpy())
+    with stage('trends:robust'):
+        slopes, intercepts = robust_trends(years, values, starts[refit], counts[refit], workers)
+    if len(refit):
+        robust.iloc[refit] = np.column_stack([slopes, intercepts])
+    trends[['robust_slope', 'robust_intercept']] = robust.to_numpy()
+
+    # forecast the next years from the robust line
+    for step in range(1, horizon + 1):
+        trends[f'forecast_{step}'] = trends['robust_intercept'] + trends['robust_slope'] * (trends['last_year'] + step)
+    return trends, len(refit)
+
+# fit the trends of the frames of a vintage and write them, unless they were fitted already
+# returns the trends and the number of series refitted, none when they were read back from their file
+# this runs when the snapshot is built, or from the command line, never in the workers answering requests
+def fit_trends(frames, root = None, workers = None):
+    root = root or trends_root
+    path = trends_path(frames.sources, root)
+    if path is None:
+        return None, 0
+    if os.path.exists(path):
+        try:
+            return pd.read_parquet(path), 0
+        except (OSError, ValueError):
+            pass
+    trends, refitted = build_trends(frames['core'], previous_trends(root, path) if incremental else None,
+                          trend_workers if workers is None else workers)
+    # write into a temporary file first, so that other workers never read a partial file
+    os.makedirs(root, exist_ok = True)
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    trends.to_parquet(tmp_path)
+    os.replace(tmp_path, path)
+    return trends, refitted
+
+# the fitted trends of a vintage, looked up by country code and indicator
+# they are read once their file exists, and until then every lookup finds no trend
+class TrendStore:
+    def __init__(self, path):
+        self.path = path
+        self.frame = None
+        self.positions = {}
+
+    # read the trends when their file was written, and tell whether they are available
+    def available(self):
+        if self.frame is None and self.path is not None and os.path.exists(self.path):
+            try:
+                frame = pd.read_parquet(self.path)
+            except (OSError, ValueError):
+                return False
+            self.positions = {key: position for position, key in enumerate(zip(frame['Country Code'], frame['Indicator Name']))}
+            self.frame = frame
+        return self.frame is not None
+
+    def __len__(self):
+        return len(self.frame) if self.available() else 0
+
+    # get the trend line of a country and an indicator over its years of data, and its forecast, as years and values
+    # None when the series has too few years of data, or the trends of the vintage were not fitted yet
+    def line(self, country_code, indicator):
+        if not self.available():
+            return None
+        position = self.positions.get((country_code, indicator))
+        if position is None:
+            return None
+        row = self.frame.iloc[position]
+        years = np.array([row['first_year'], row['last_year']] + [row['last_year'] + step for step in range(1, horizon + 1)])
+        return years, row['robust_intercept'] + row['robust_slope'] * years
+
+@derived('sources', sources = ['PovStatsData.csv'])
+def trends(sources):
+    return TrendStore(trends_path(sources))
+
+if __name__ == '__main__':
+    from snapshot import load_frames
+
+    parser = argparse.ArgumentParser(description = 'Fit the trends of every country and indicator of a PovStats vintage')
+    parser.add_argument('--data-dir', default = 'data_2020', help = 'directory holding the PovStats csv files')
+    parser.add_argument('--root', default = None, help = 'directory of the fitted trends, defaults to cache/trends')
+    parser.add_argument('--workers', type = int, default = None, help = 'processes fitting the robust trends, 0 to fit them in this one')
+    parser.add_argument('--full', action = 'store_true', help = 'refit every series rather than only those that changed')
+    args = parser.parse_args()
+
+    incremental = not args.full
+    frames = load_frames(args.data_dir)[0]
+    path = trends_path(frames.sources, args.root)
+    if args.full and os.path.exists(path):
+        os.remove(path)
+    fitted, refitted = fit_trends(frames, args.root, args.workers)
+    print(f"{len(fitted)} series, {refitted} refitted, written to {path}")